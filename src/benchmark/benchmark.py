@@ -1,16 +1,20 @@
 import copy
-import multiprocessing
+import functools
 import os
 import pickle
-import time
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Dict, Union, Tuple, List
+from typing import Dict, Union, Tuple, List, Optional
 from uuid import uuid4
 
 import numpy as np
 from matplotlib import pyplot as plt
 
+from src.benchmark.repetitions import measure_repetitions
+from src.benchmark.result_channel import (LazyMapping, decode_camera_mapping,
+                                          decode_point_mapping,
+                                          encode_camera_mapping,
+                                          encode_point_mapping, run_isolated)
 from src.dataset.camera import Camera
 from src.dataset.dataset import Dataset
 from src.dataset.loaders.colmap_dataset_loader.loader import (
@@ -19,6 +23,35 @@ from src.dataset.loaders.colmap_dataset_loader.loader import (
 )
 from src.dataset.loss_functions import LossFunction
 from src.dataset.point import Point3D
+from src.tracing import Tracer, span
+
+
+def traced_benchmark(benchmark_function):
+    """
+    Decorator for the benchmark functions: the call runs in its own Tracer under the span "benchmark",
+    benchmark.trace holds the per-span summary afterwards, the kwarg trace_path exports the chrome trace,
+    with the kwarg verbose the summary table is printed
+    """
+
+    @functools.wraps(benchmark_function)
+    def wrapper(self, *args, **kwargs):
+        with Tracer() as tracer:
+            with span("benchmark", framework=self.FRAMEWORK, benchmark=self.NAME):
+                result = benchmark_function(self, *args, **kwargs)
+        self.trace = tracer.summary()
+        if kwargs.get("trace_path"):
+            tracer.export_chrome_trace(kwargs["trace_path"])
+        if kwargs.get("verbose"):
+            print(tracer.summary_table())
+        return result
+
+    return wrapper
+
+
+def scalar_attributes(benchmark) -> Dict:
+    """ public attributes with a plain value, e.g. points_limit / camera_limit of the jaxopt benchmarks """
+    return {k: v for k, v in vars(benchmark).items()
+            if not k.startswith("_") and (v is None or isinstance(v, (bool, int, float, str)))}
 
 
 class Benchmark(ABC):
@@ -28,6 +61,9 @@ class Benchmark(ABC):
     def __init__(self, dataset: Dataset):
         self.dataset = dataset
         self.benchmark_args_kwargs: Tuple[List, Dict] = ([], {})
+        self.memory: Optional[Dict] = None  # Note: MemoryProfiler.summary() of benchmarks measuring their phases
+        self.trace: Optional[Dict] = None  # Note: Tracer.summary() of the last benchmark call, see traced_benchmark
+        self.repetitions: Optional[Dict] = None  # Note: summary of the last repeat call
 
     @abstractmethod
     def benchmark(self, *args, **kwargs):
@@ -43,6 +79,23 @@ class Benchmark(ABC):
     def time(self):
         raise NotImplementedError
 
+    def phase_times(self) -> Tuple[float, float]:
+        """ (compile, run) seconds of the last benchmark call, without a compile_time attribute it is 0 """
+        return getattr(self, "compile_time", None) or 0.0, self.time
+
+    def repeat(self, *args, warmup=1, repetitions=5, cpu_affinity=None, confidence=0.95, **kwargs):
+        """
+        Runs benchmark(*args, **kwargs) warmup + repetitions times (results, memory and trace are the ones of the
+        last call), self.repetitions holds cold / warm compile and steady state statistics afterwards,
+        see src.benchmark.repetitions.
+        cpu_affinity: cpus to pin this process to during the repetitions, e.g. {2, 3}
+        """
+        self.repetitions = measure_repetitions(
+            lambda: self.benchmark(*args, **kwargs), self.phase_times, warmup=warmup, repetitions=repetitions,
+            cpu_affinity=cpu_affinity, confidence=confidence, verbose=kwargs.get("verbose", False),
+        )
+        return self.repetitions
+
     def export_pickle(self, full_path_to_folder, filename=None) -> str:
         os.makedirs(full_path_to_folder, exist_ok=True)
         if not filename:
@@ -84,6 +137,7 @@ class SinglePoseBenchmark(Benchmark, ABC):
         self._time = None
         self._single_times = None
         self._iterations = None
+        self.measured_times: Optional[List[float]] = None  # Note: per camera wall times of benchmarks timing them
 
     @property
     def results(self) -> SinglePoseBenchmarkResults:
@@ -122,66 +176,38 @@ class SinglePoseBenchmark(Benchmark, ABC):
             **kwargs (object): kwargs passed to benchmark function
         """
 
-        def execute_subprocess_benchmark(
-                dataset, queue: multiprocessing.Queue, function_name: str, *ar, **kw
-        ):
+        def execute_subprocess_benchmark(dataset, function_name: str, *ar, **kw):
             subprocess_benchmark_class = self.__class__(copy.copy(dataset))
             benchmark_function = getattr(subprocess_benchmark_class, function_name)
             benchmark_function(*ar, **kw)
-            queue.put(subprocess_benchmark_class.results)
-            queue.put(subprocess_benchmark_class.time)
-            queue.put(subprocess_benchmark_class.single_times)
-            queue.put(subprocess_benchmark_class.iterations)
-            print("Process exiting")
-            exit(0)
-
-        q = multiprocessing.Queue()
-        p = multiprocessing.Process(
-            target=execute_subprocess_benchmark,
-            args=args,
-            kwargs={
-                "queue": q,
-                "dataset": self.dataset,
-                "function_name": benchmark_function_name,
-                **kwargs,
-            },
+            arrays, objects = encode_camera_mapping(subprocess_benchmark_class.results.camera_mapping)
+            return arrays, {**objects,
+                            "time": subprocess_benchmark_class.time,
+                            "single_times": subprocess_benchmark_class.single_times,
+                            "iterations": subprocess_benchmark_class.iterations,
+                            "memory": subprocess_benchmark_class.memory,
+                            "trace": subprocess_benchmark_class.trace,
+                            "repetitions": subprocess_benchmark_class.repetitions,
+                            "measured_times": subprocess_benchmark_class.measured_times,
+                            "attributes": scalar_attributes(subprocess_benchmark_class)}
+
+        arrays, objects = run_isolated(execute_subprocess_benchmark, *args, dataset=self.dataset,
+                                       function_name=benchmark_function_name, **kwargs)
+        # Note: the cameras are built from the (memory-mapped) arrays on first access
+        self._results = SinglePoseBenchmarkResults(
+            camera_mapping=LazyMapping(lambda: decode_camera_mapping(arrays, objects))
         )
-        p.start()
-        item_count = 0
-        items = []
-        while (
-                item_count != 4
-        ):  # We do this because join does not work when putting large objects in queue.
-            if q.empty():
-                time.sleep(5)
-            else:
-                if item_count == 0:
-                    print("transferring items")
-                items.append(q.get())
-                item_count += 1
-        p.join()  # Now it can exit and join properly.
-        if p.exitcode != 0:
-            raise Exception("An unknown exception happened.")
-        self._results = copy.deepcopy(items[0])
-        self._time = copy.deepcopy(items[1])
-        self._single_times = copy.deepcopy(items[2])
-        self._iterations = copy.deepcopy(items[3])
-
-    def shallow_results_dataset(
-            self,
-    ):  # Note: everything (excluding cameras) points to the original dataset(!!)
+        self._time, self._single_times, self._iterations = \
+            objects["time"], objects["single_times"], objects["iterations"]
+        self.memory, self.trace = objects["memory"], objects["trace"]
+        self.repetitions, self.measured_times = objects["repetitions"], objects["measured_times"]
+        for k, v in objects["attributes"].items():
+            setattr(self, k, v)
+
+    def shallow_results_dataset(self):
+        """ snapshot of the dataset with the resulting cameras, everything else is shared with the original """
         if self._results:
-            copied_dataset = copy.copy(
-                self.dataset
-            )  # Shallow copy(!) is enough to export, but be really careful here
-            copied_dataset.datasetEntries = list(
-                map(lambda x: copy.copy(x), copy.copy(copied_dataset.datasetEntries))
-            )
-            # Since only the camera changes we can substitute it with the by the new cameras
-            camera_mapping = self.results.camera_mapping
-            for index, de in enumerate(copied_dataset.datasetEntries):
-                de.camera = camera_mapping.get(index)
-            return copied_dataset
+            return self.dataset.snapshot(cameras=self.results.camera_mapping)
         raise AttributeError
 
     def export_results_in_colmap_format(
@@ -220,17 +246,7 @@ class SinglePoseBenchmark(Benchmark, ABC):
     def reprojection_errors(self, loss_function):
         if self._results:
             dataset = self.shallow_results_dataset()
-            reprojection_errors = dataset.compute_reprojection_errors_alt(
-                loss_function=loss_function
-            )
-            reprojection_errors_list = np.array(
-                [
-                    item
-                    for sublist in list(reprojection_errors.values())
-                    for item in sublist
-                ]
-            )
-            return reprojection_errors_list
+            return dataset.reprojection_errors(loss_function=loss_function).errors
         raise AttributeError
 
 
@@ -268,51 +284,25 @@ class BundleAdjustmentBenchmark(Benchmark, ABC):
         raise AttributeError
 
     def shallow_results_trimmed_original_dataset(self):
-        # Note: everything (excluding cameras, and 3d_points) points to the original dataset(!!)
+        """
+        for reduced datasets only for testing: snapshot of the original dataset (cameras and points) trimmed to the
+        cameras and points of the results, 2d points of the dropped 3d points lose their 3d point identifier
+        """
         if self._results:
-            copied_dataset = copy.copy(
-                self.dataset
-            )  # Shallow copy(!) is enough to export, but be really careful here
-
-            copied_dataset.datasetEntries = list(
-                map(lambda x: copy.copy(x), copy.copy(copied_dataset.datasetEntries))
+            results_point_ids = np.array([p.identifier for p in self._results.point_mapping.values()])
+            kept_point_ids = set(results_point_ids.tolist())
+            points3D = [p for p in self.dataset.points3D if p.identifier in kept_point_ids]
+            assert len(self.dataset.points3D) != len(self._results.point_mapping)
+
+            def dropped_point2d_indices(image_index):
+                de = self.dataset.datasetEntries[image_index]
+                return de.indices_with_3d[~np.isin(de.point3d_ids, results_point_ids)]
+
+            return self.dataset.snapshot(
+                points3D=points3D,
+                entry_indices=np.arange(len(self._results.camera_mapping)),
+                dropped_point2d_indices=dropped_point2d_indices,
             )
-
-            prior_point_length = len(copied_dataset.points3D)
-            results_point_ids = [
-                p.identifier for p in list(self._results.point_mapping.values())
-            ]
-            copied_dataset.points3D = [
-                p for p in copied_dataset.points3D if p.identifier in results_point_ids
-            ]
-            posterior_point_length = len(self._results.point_mapping.values())
-
-            assert prior_point_length != posterior_point_length
-
-            """for reduced datasets only for testing"""
-            copied_dataset.datasetEntries = copied_dataset.datasetEntries[
-                                            0: len(self._results.camera_mapping)
-                                            ]
-
-            for index, de in enumerate(copied_dataset.datasetEntries):
-                if prior_point_length != posterior_point_length:
-                    de.points2D = copy.copy(
-                        de.points2D
-                    )  # Replace by shallow copy, points are still -> orig. dataset
-                    for index in range(len(de.points2D)):  # this is slow as fk
-                        try:
-                            copied_dataset.points3D_mapped[
-                                de.points2D[index].point3D_identifier
-                            ]
-                        except KeyError:
-                            # Point got lost due to reduced dataset for debug test
-                            mod_point = copy.deepcopy(de.points2D[index])
-                            mod_point.point3D_identifier = None
-                            de.points2D[
-                                index
-                            ] = mod_point  # Note: the list is a new object, created by copy.copy(...)
-            copied_dataset.refresh_mapping()
-            return copied_dataset
         raise AttributeError
 
     def subprocess_benchmark(
@@ -328,54 +318,36 @@ class BundleAdjustmentBenchmark(Benchmark, ABC):
             **kwargs (object): kwargs passed to benchmark function
         """
 
-        def execute_subprocess_benchmark(
-                dataset, queue: multiprocessing.Queue, function_name: str, *ar, **kw
-        ):
+        def execute_subprocess_benchmark(dataset, function_name: str, *ar, **kw):
             subprocess_benchmark_class = self.__class__(copy.copy(dataset))
             benchmark_function = getattr(subprocess_benchmark_class, function_name)
             benchmark_function(*ar, **kw)
-            queue.put(subprocess_benchmark_class.results)
-            queue.put(subprocess_benchmark_class.time)
-            queue.put(subprocess_benchmark_class.iterations)
-            print("Process exiting")
-            exit(0)
-
-        q = multiprocessing.Queue()
-        p = multiprocessing.Process(
-            target=execute_subprocess_benchmark,
-            args=args,
-            kwargs={
-                "queue": q,
-                "dataset": self.dataset,
-                "function_name": benchmark_function_name,
-                **kwargs,
-            },
+            results = subprocess_benchmark_class.results
+            camera_arrays, camera_objects = encode_camera_mapping(results.camera_mapping)
+            point_arrays, point_objects = encode_point_mapping(results.point_mapping)
+            return {**camera_arrays, **point_arrays}, {**camera_objects, **point_objects,
+                                                        "time": subprocess_benchmark_class.time,
+                                                        "iterations": subprocess_benchmark_class.iterations,
+                                                        "memory": subprocess_benchmark_class.memory,
+                                                        "trace": subprocess_benchmark_class.trace,
+                                                        "repetitions": subprocess_benchmark_class.repetitions,
+                                                        "attributes": scalar_attributes(subprocess_benchmark_class)}
+
+        arrays, objects = run_isolated(execute_subprocess_benchmark, *args, dataset=self.dataset,
+                                       function_name=benchmark_function_name, **kwargs)
+        # Note: cameras and points are built from the (memory-mapped) arrays on first access
+        self._results = BundleAdjustmentBenchmarkResults(
+            camera_mapping=LazyMapping(lambda: decode_camera_mapping(arrays, objects)),
+            point_mapping=LazyMapping(lambda: decode_point_mapping(arrays, objects)),
         )
-        p.start()
-        item_count = 0
-        items = []
-        while (
-                item_count != 3
-        ):  # We do this because join does not work when putting large objects in queue.
-            if q.empty():
-                time.sleep(5)
-            else:
-                if item_count == 0:
-                    print("transferring items")
-                items.append(q.get())
-                item_count += 1
-        p.join()  # Now it can exit and join properly.
-        if p.exitcode != 0:
-            raise Exception("An unknown exception happened.")
-        self._results = copy.deepcopy(items[0])
-        self._time = copy.deepcopy(items[1])
-        self._iterations = copy.deepcopy(items[2])
+        self._time, self._iterations = objects["time"], objects["iterations"]
+        self.memory, self.trace = objects["memory"], objects["trace"]
+        self.repetitions = objects["repetitions"]
+        for k, v in objects["attributes"].items():
+            setattr(self, k, v)
 
     def _shallow_results_dataset(self):
-        """ Function for complete results """
-        # Note: everything (excluding cameras, and 3d_points) points to the original dataset(!!)
-        # Shallow copy(!) is enough to export, but be really careful here
-
+        """ Function for complete results, a snapshot sharing the 2d points with the original dataset """
         if not self._results:
             raise AttributeError
 
@@ -383,82 +355,40 @@ class BundleAdjustmentBenchmark(Benchmark, ABC):
             "number of points3D must be equal"
         assert len(self._results.camera_mapping) == len(self.dataset.datasetEntries), \
             "number of cameras must be equal"
+        assert None not in self._results.camera_mapping.values(), \
+            "something wrong happened in the camera_mapping"
 
-        copied_dataset = copy.copy(self.dataset)
-        copied_dataset.datasetEntries = list(
-            map(lambda x: copy.copy(x), copy.copy(copied_dataset.datasetEntries))
+        return self.dataset.snapshot(
+            cameras=self._results.camera_mapping,
+            points3D=list(self._results.point_mapping.values()),
         )
-        copied_dataset.points3D = list(self._results.point_mapping.values())
-        copied_dataset.refresh_mapping()
-
-        #  Since only the camera changes we can substitute it with the by the new cameras
-        camera_mapping = self._results.camera_mapping
-        for index, de in enumerate(copied_dataset.datasetEntries):
-            de.camera = camera_mapping.get(index)
-            assert de.camera is not None, \
-                "something wrong happened in the camera_mapping"
-
-        copied_dataset.refresh_mapping()
-        return copied_dataset
 
     def _shallow_reduced_results_dataset(self, points_limit, camera_limit, only_trimmed_2d_points):
-        """for reduced datasets mostly only for testing"""
-
-        # Note: everything (excluding cameras, and 3d_points) points to the original dataset(!!)
-        # Shallow copy(!) is enough to export, but be really careful here
-        def _replace_point_with_p3d_id_none(de_points2d, ind):
-            # Point got lost due to reduced dataset for debug test
-            mod_point = copy.deepcopy(de_points2d[ind])
-            mod_point.point3D_identifier = None
-            # Note: the list is a new object, created by copy.copy(...)
-            de_points2d[ind] = mod_point
-
+        """ for reduced datasets mostly only for testing, a snapshot sharing the kept 2d points """
         if not self._results:
             raise AttributeError
 
         assert len(self._results.camera_mapping) == camera_limit, \
             "not enough cameras found in the results"
-
-        copied_dataset = copy.copy(self.dataset)
-        copied_dataset.datasetEntries = list(
-            map(lambda x: copy.copy(x), copy.copy(copied_dataset.datasetEntries))
-        )
-
-        copied_dataset.points3D = list(self._results.point_mapping.values())
-        copied_dataset.refresh_mapping()
-
-        copied_dataset.datasetEntries = copied_dataset.datasetEntries[:camera_limit]
-
-        # Since only the camera changes we can substitute it with the by the new cameras
-        camera_mapping = self._results.camera_mapping
-        point_2d_ids_per_dataset_entry = self.dataset.get_reduced_dataset_2d_ids_per_camera(
-            cameras_limit=camera_limit,
-            points_limit=points_limit
+        assert None not in self._results.camera_mapping.values(), "a camera index had no camera"
+
+        # Note: the same (cached) selection make_reduced_dataset used for the benchmark input
+        selection = self.dataset.reduction_selection(camera_limit=camera_limit, points_limit=points_limit)
+
+        points3D = list(self._results.point_mapping.values())
+        if only_trimmed_2d_points:
+            keep = selection.observation_mask
+        else:  # every 2d point whose 3d point is part of the results
+            keep = np.isin(selection.table.point3d_ids, [p.identifier for p in points3D])
+
+        # we set the p3d identifier to none if its not kept but has a p3d_identifier
+        return self.dataset.snapshot(
+            cameras=self._results.camera_mapping,
+            points3D=points3D,
+            entry_indices=selection.camera_indices,
+            dropped_point2d_indices=lambda image_index: selection.dropped_point2d_indices(image_index, keep),
         )
 
-        for index, de in enumerate(copied_dataset.datasetEntries):
-            de.camera = camera_mapping.get(index)
-            assert de.camera is not None, f"camera index: {index} had no camera"
-
-            # Replace list by shallow copy, points are still -> orig. dataset
-            de.points2D = copy.copy(de.points2D)
-
-            if only_trimmed_2d_points:
-                ids_of_reduced_set_of_points = point_2d_ids_per_dataset_entry[index]
-                list_of_ids_to_keep = ids_of_reduced_set_of_points
-            else:
-                list_of_ids_with_points_3d = [p.identifier for p in de.points2D
-                                              if copied_dataset.points3D_mapped.get(p.point3D_identifier)]
-                list_of_ids_to_keep = list_of_ids_with_points_3d
-
-            for i in range(len(de.points2D)):
-                """ we set the p3d identifier to none if its not in the list_to_keep but has a p3d_identifier """
-                if de.points2D[i].identifier not in list_of_ids_to_keep and de.points2D[i].point3D_identifier:
-                    _replace_point_with_p3d_id_none(de.points2D, i)
-
-        copied_dataset.refresh_mapping()
-        return copied_dataset
-
     def shallow_results_dataset(self, points_limit=None, camera_limit=None, only_trimmed_2d_points=True):
         if not self._results:
             raise AttributeError
@@ -476,17 +406,7 @@ class BundleAdjustmentBenchmark(Benchmark, ABC):
     def reprojection_errors(self, loss_function, points_limit, camera_limit):
         if self._results:
             dataset = self.shallow_results_dataset(points_limit=points_limit, camera_limit=camera_limit)
-            reprojection_errors = dataset.compute_reprojection_errors_alt(
-                loss_function=loss_function
-            )
-            reprojection_errors_list = np.array(
-                [
-                    item
-                    for sublist in list(reprojection_errors.values())
-                    for item in sublist
-                ]
-            )
-            return reprojection_errors_list
+            return dataset.reprojection_errors(loss_function=loss_function).errors
         raise AttributeError
 
     def export_results_in_colmap_format(
@@ -1,13 +1,18 @@
+import asyncio
 import os
-import shutil
+from contextlib import nullcontext
+from typing import Dict, List, Tuple
 
 from src.benchmark.benchmark import (
     BundleAdjustmentBenchmark,
     BundleAdjustmentBenchmarkResults,
+    traced_benchmark,
 )
 from src.benchmark.colmap_benchmark.bundle_adjuster import (
-    _process_std_out,
-    perform_bundle_adjustment,
+    BundleAdjusterRun,
+    run_bundle_adjuster,
+    run_bundle_adjuster_async,
+    scratch_directory,
 )
 from src.config import DATASETS_PATH
 from src.dataset.loaders.colmap_dataset_loader.cameras import read_cameras_bin
@@ -19,65 +24,91 @@ from src.dataset.loaders.colmap_dataset_loader.loader import (
     load_colmap_dataset,
 )
 from src.dataset.loaders.colmap_dataset_loader.points import read_points3d_bin
+from src.tracing import span
+
+
+def _print_line(line):
+    print(line, end="")
 
 
 class ColmapBundleAdjustmentBenchmark(BundleAdjustmentBenchmark):
     FRAMEWORK = "Colmap"
 
+    def _export_input(self, input_path, camera_limit, points_limit):
+        with span("load"):
+            dataset = self.dataset if camera_limit == -1 and points_limit == -1 else \
+                self.dataset.make_reduced_dataset(
+                    camera_limit=camera_limit,
+                    points_limit=points_limit
+                )
+        with span("transfer"):
+            os.makedirs(input_path, exist_ok=True)
+            export_in_colmap_format(dataset, input_path, binary=True)
+
+    def _read_output(self, output_path, run: BundleAdjusterRun):
+        with span("parse"):
+            points, _ = read_points3d_bin(os.path.join(output_path, "points3D.bin"))
+            result_points = {p.identifier: p for p in _parse_points(points)}
+            result_cameras = _parse_cameras_only(
+                images=read_images_bin(os.path.join(output_path, "images.bin")),
+                cameras=read_cameras_bin(os.path.join(output_path, "cameras.bin")),
+                path_to_images=self.dataset.images_path,
+            )
+        # Since colmap starts with non-zero indices we have to undo that by subtracting 1 from each id
+        result_cameras = {k - 1: v for k, v in result_cameras.items()}
+
+        self._results = BundleAdjustmentBenchmarkResults(
+            camera_mapping=result_cameras, point_mapping=result_points
+        )
+        self._time = run.report.time  # Note: self reported, run.measured_time includes the colmap start-up
+        self._iterations = run.report.iterations
+
+    @traced_benchmark
     def benchmark(self, *args, **kwargs):
         """
         @type verbose: bool; specify verbosity
         @type camera_limit: int; specify for reduced dataset
         @type points_limit: int; specify for reduced dataset
+        @type tmpfs: bool; scratch directory of the colmap input / output in memory (/dev/shm)
+        @type trace_path: str; export the spans of this call as chrome trace json
         """
         self.benchmark_args_kwargs = (args, kwargs)
         verbose = kwargs.get("verbose", False)
-        camera_limit = kwargs.get("camera_limit", -1)
-        points_limit = kwargs.get("points_limit", -1)
-        os.makedirs("benchmark_input", exist_ok=True)
-
-        dataset = self.dataset if camera_limit == -1 and points_limit == -1 else \
-            self.dataset.make_reduced_dataset(
-                camera_limit=camera_limit,
-                points_limit=points_limit
-            )
-        export_in_colmap_format(dataset, "benchmark_input", binary=True)
-
-        self_reported_time = 0.0
-        measured_time = 0.0
-        os.makedirs("benchmark_output", exist_ok=True)
-        std_out, t = perform_bundle_adjustment(
-            "benchmark_input",
-            "benchmark_output",
-        )
-        if verbose:
-            print(std_out)
-        bundle_adjustment_report = _process_std_out(std_out)
-        self_reported_time += bundle_adjustment_report.time
-        measured_time += t
-
-        result_points = {
-            p.identifier: p
-            for p in _parse_points(
-                read_points3d_bin(os.path.join("benchmark_output", "points3D.bin"))
-            )
-        }
-        result_cameras = _parse_cameras_only(
-            images=read_images_bin(os.path.join("benchmark_output", "images.bin")),
-            cameras=read_cameras_bin(os.path.join("benchmark_output", "cameras.bin")),
-            path_to_images=self.dataset.images_path,
-        )
-        # Since colmap starts with non-zero indices we have to undo that by subtracting 1 from each id
-        result_cameras = {k - 1: v for k, v in result_cameras.items()}
+        # Note: every run has its own scratch directory, runs can happen at the same time
+        with scratch_directory(tmpfs=kwargs.get("tmpfs", False)) as scratch:
+            input_path, output_path = os.path.join(scratch, "input"), os.path.join(scratch, "output")
+            self._export_input(input_path, kwargs.get("camera_limit", -1), kwargs.get("points_limit", -1))
+            with span("solve"):
+                run = run_bundle_adjuster(input_path, output_path, on_line=_print_line if verbose else None)
+            self._read_output(output_path, run)
+
+    async def benchmark_async(self, *args, semaphore: asyncio.Semaphore = None, **kwargs):
+        """
+        benchmark with the colmap process awaited, with a semaphore at most its value benchmarks (incl. their
+        scratch directories) exist at once, see benchmark_concurrently
+        """
+        async with semaphore or nullcontext():
+            self.benchmark_args_kwargs = (args, kwargs)
+            verbose = kwargs.get("verbose", False)
+            with scratch_directory(tmpfs=kwargs.get("tmpfs", False)) as scratch:
+                input_path, output_path = os.path.join(scratch, "input"), os.path.join(scratch, "output")
+                self._export_input(input_path, kwargs.get("camera_limit", -1), kwargs.get("points_limit", -1))
+                run = await run_bundle_adjuster_async(input_path, output_path,
+                                                      on_line=_print_line if verbose else None)
+                self._read_output(output_path, run)
 
-        shutil.rmtree("benchmark_output")
 
-        shutil.rmtree("benchmark_input")
-        self._results = BundleAdjustmentBenchmarkResults(
-            camera_mapping=result_cameras, point_mapping=result_points
-        )
-        self._time = self_reported_time
-        self._iterations = bundle_adjustment_report.iterations
+def benchmark_concurrently(benchmarks: List[Tuple[ColmapBundleAdjustmentBenchmark, Dict]],
+                           max_concurrent=os.cpu_count()):
+    """
+    Runs benchmark(**kwargs) of every (benchmark, kwargs), at most max_concurrent colmap processes at once.
+    Exporting and parsing happen in this thread, the bundle adjustments run in parallel.
+    """
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_concurrent)
+        await asyncio.gather(*(b.benchmark_async(semaphore=semaphore, **kwargs) for b, kwargs in benchmarks))
+
+    asyncio.run(run_all())
 
 
 if __name__ == "__main__":
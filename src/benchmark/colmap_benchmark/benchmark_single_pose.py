@@ -1,14 +1,19 @@
 import collections
+import functools
 import os
 import re
 import time
+from typing import Dict
 
 import numpy as np
 import pycolmap
 from pycolmap import AbsolutePoseRefinementOptions
 
-from src.benchmark.benchmark import SinglePoseBenchmark, SinglePoseBenchmarkResults
-from src.benchmark.colmap_benchmark.utils import OutputGrabber
+from src.benchmark.benchmark import (SinglePoseBenchmark,
+                                     SinglePoseBenchmarkResults,
+                                     traced_benchmark)
+from src.benchmark.colmap_benchmark.utils import StdoutCapture
+from src.benchmark.multiprocesser import Backend, parallel_map_chunks
 from src.config import DATASETS_PATH
 from src.dataset.camera import Camera
 from src.dataset.camera_pose.camera_pose import CameraPose
@@ -16,7 +21,10 @@ from src.dataset.camera_pose.enums_and_types import (
     CoordinateSystem,
     TransformationDirection,
 )
+from src.dataset.camera_pose.metrics import pose_errors_of_poses
+from src.dataset.dataset import Dataset
 from src.dataset.loaders.colmap_dataset_loader.loader import load_colmap_dataset
+from src.tracing import traced
 
 PoseRefinementReport = collections.namedtuple(  # TODO: maybe just a dataclass
     "PoseRefinementReport",
@@ -50,9 +58,46 @@ def _process_std_out(std_out):
     )
 
 
+def _refinement_options(options: Dict) -> AbsolutePoseRefinementOptions:
+    refinement_options = AbsolutePoseRefinementOptions()
+    for k, v in options.items():
+        setattr(refinement_options, k, v)
+    return refinement_options
+
+
+def _refine_poses(problems, refinement_options: Dict):
+    """
+    worker: refines the (tvec, qvec, points2D, points3D, inlier_mask, camera kwargs) problems of a chunk,
+    returns (output, captured solver summary, measured time) each, the capture is read outside the measured time
+    """
+    options = _refinement_options(refinement_options)
+    results = []
+    with StdoutCapture() as capture:
+        for tvec, qvec, points2D, points3D, inlier_mask, camera in problems:
+            colmap_camera = pycolmap.Camera(**camera)
+            start = time.perf_counter()
+            o = pycolmap.pose_refinement(
+                tvec=tvec,
+                qvec=qvec,
+                points2D=points2D,
+                points3D=points3D,
+                inlier_mask=inlier_mask,
+                camera=colmap_camera,
+                refinement_options=options,
+            )
+            measured_time = time.perf_counter() - start
+            results.append((o, capture.take(), measured_time))
+    return results
+
+
 class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
     FRAMEWORK = "Colmap"
 
+    def __init__(self, dataset: Dataset):
+        super().__init__(dataset)
+        self.num_workers = 1  # Note: of the last benchmark call, stored with the run (timings under contention)
+
+    @traced("prepare")
     def _prepare_dataset(self):
         mapping = {}
         for index, e in enumerate(self.dataset.datasetEntries):
@@ -68,10 +113,11 @@ class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
         return mapping
 
     def _prepare_colmap_cameras(self, mapping_cameras):
+        """ keyword arguments of pycolmap.Camera, the cameras are built where the poses are refined """
         mapping = {}
         for image_id, c in list(mapping_cameras.items()):
             # Note: by default colmap uses focal length of 1.2*max(width, height) to start
-            colmap_camera = pycolmap.Camera(
+            colmap_camera = dict(
                 model="PINHOLE",
                 width=c.width,
                 height=c.height,
@@ -86,6 +132,7 @@ class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
             mapping[image_id] = colmap_camera
         return mapping
 
+    @traced("solve")
     def benchmark_absolute_pose(
         self,
         tvecs,
@@ -94,30 +141,31 @@ class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
         p3d_list,
         inlier_mask_list,
         camera_list,
-        absolute_pose_refinement_options,
+        refinement_options: Dict,
         verbose,
+        num_workers=1,
     ):
+        """
+        camera_list: pycolmap.Camera keyword arguments, refinement_options: AbsolutePoseRefinementOptions attributes
+        The cameras are distributed over num_workers processes (in chunks), 1 refines them in this process.
+        Returns (outputs, solver times, reports, measured times) per camera.
+        """
         assert len(p2d_list) == len(p3d_list) == len(camera_list)
-        outputs = []
-        reports = []
-        for index in range(len(p2d_list)):
-            output_grabber = OutputGrabber()
-            output_grabber.start()
-            o = pycolmap.pose_refinement(
-                tvec=tvecs[index],
-                qvec=qvecs[index],
-                points2D=p2d_list[index],
-                points3D=p3d_list[index],
-                inlier_mask=inlier_mask_list[index],
-                camera=camera_list[index],
-                refinement_options=absolute_pose_refinement_options,
-            )
-            output_grabber.stop()
-            reports.append(_process_std_out(output_grabber.capturedtext))
+        problems = list(zip(tvecs, qvecs, p2d_list, p3d_list, inlier_mask_list, camera_list))
+        chunks = parallel_map_chunks(
+            functools.partial(_refine_poses, refinement_options=refinement_options),
+            problems,
+            backend=Backend.PROCESS if num_workers > 1 else Backend.SERIAL,
+            num_workers=num_workers,
+        )
+        outputs, reports, measured_times = [], [], []
+        for o, captured_text, measured_time in (result for chunk in chunks for result in chunk):
+            reports.append(_process_std_out(captured_text))
             if verbose:
-                print(output_grabber.capturedtext)
+                print(captured_text)
             outputs.append(o)
-        return outputs, [r.time for r in reports], reports
+            measured_times.append(measured_time)
+        return outputs, [r.time for r in reports], reports, measured_times
 
     def validate_output(
         self,
@@ -143,33 +191,15 @@ class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
             )
         )
 
-        expected_result = list(zip(camera_poses_list, output_camera_poses))
-        position_errors = np.array(
-            list(
-                map(
-                    lambda cp1_cp2: CameraPose.compute_position_error(
-                        cp1_cp2[0], cp1_cp2[1]
-                    ),
-                    expected_result,
-                )
-            )
-        )
-        rotation_errors = np.array(
-            list(
-                map(
-                    lambda cp1_cp2: CameraPose.compute_rotation_error(
-                        cp1_cp2[0], cp1_cp2[1]
-                    ),
-                    expected_result,
-                )
-            )
-        )
+        errors = pose_errors_of_poses(camera_poses_list, output_camera_poses)
+        position_errors, rotation_errors = errors["positional"], errors["identity_error"]
 
         assert all(map(lambda o: o["success"], output))
         #  assert np.max(position_errors) <= validation_error_position
         #  assert np.max(rotation_errors) <= validation_error_rotation
 
     @staticmethod
+    @traced("parse")
     def _parse_colmap_output(output):
         return list(
             map(
@@ -188,11 +218,16 @@ class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
             )
         )
 
+    @traced_benchmark
     def benchmark(self, *args, **kwargs):
         """
         @type verbose: bool; specify verbosity
+        @type num_workers: int; processes refining the poses in parallel (default: 1, i.e. in this process), the
+        solver times of parallel refinements are taken under contention and not comparable to serial ones
+        @type trace_path: str; export the spans of this call as chrome trace json
         """
         verbose = kwargs.get("verbose", False)
+        num_workers = self.num_workers = kwargs.get("num_workers", 1)
         self.benchmark_args_kwargs = (args, kwargs)
         # TODO: Different ids could be a problem, perhaps switch to datasetEntry.identifier-based mapping
         self.benchmark_args_kwargs = (args, kwargs)
@@ -202,10 +237,11 @@ class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
             mapping_cameras_by_id
         )
 
-        absolute_pose_refinement_options = AbsolutePoseRefinementOptions()
-        absolute_pose_refinement_options.refine_extra_params = True
-        absolute_pose_refinement_options.refine_focal_length = True
-        absolute_pose_refinement_options.print_summary = True  # Set to false for now
+        absolute_pose_refinement_options = {
+            "refine_extra_params": True,
+            "refine_focal_length": True,
+            "print_summary": True,  # Note: the summary is parsed for the iterations and the solver time
+        }
 
         """input preparation"""
         (
@@ -236,7 +272,7 @@ class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
 
         """benchmark"""
         elapsed_time = 0.0
-        output, times, reports = self.benchmark_absolute_pose(
+        output, times, reports, self.measured_times = self.benchmark_absolute_pose(
             tvecs,
             qvecs,
             p2d_list,
@@ -245,6 +281,7 @@ class ColmapSinglePoseBenchmark(SinglePoseBenchmark):
             colmap_camera_list,
             absolute_pose_refinement_options,
             verbose=verbose,
+            num_workers=num_workers,
         )
         elapsed_time += sum(times)
         iterations = [r.iterations for r in reports]
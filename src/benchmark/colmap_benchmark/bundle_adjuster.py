@@ -1,11 +1,16 @@
+import asyncio
 import collections
 import os
 import re
 import subprocess
+import tempfile
 import time
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Tuple
 
 COLMAP_PATH = "/usr/local/bin/colmap"
+TMPFS_PATH = "/dev/shm"
 
 BundleAdjustmentReport = collections.namedtuple(  # TODO: maybe just a dataclass
     "BundleAdjustmentReport",
@@ -38,67 +43,164 @@ class BundleAdjustmentOptions:
     refine_extrinsics: int = 1
 
 
-def perform_bundle_adjustment(
-    input_path, output_path, bundle_adjustment_options: BundleAdjustmentOptions = None
-):
-    os.makedirs(output_path, exist_ok=True)
+@contextmanager
+def scratch_directory(prefix="colmap_", tmpfs=False):
+    """ temporary directory of one run (removed afterwards), with tmpfs in memory if available """
+    directory = TMPFS_PATH if tmpfs and os.path.isdir(TMPFS_PATH) else None
+    with tempfile.TemporaryDirectory(prefix=prefix, dir=directory) as path:
+        yield path
+
+
+def _bundle_adjuster_command(input_path, output_path, bundle_adjustment_options: BundleAdjustmentOptions = None):
     input_path = input_path if input_path else "."
     output_path = output_path if output_path else "."
     if not bundle_adjustment_options:
         bundle_adjustment_options = BundleAdjustmentOptions()
+    return [
+        COLMAP_PATH,
+        "bundle_adjuster",
+        "--input_path",
+        input_path,
+        "--output_path",
+        output_path,
+        "--BundleAdjustment.max_num_iterations",
+        str(bundle_adjustment_options.max_num_iterations),
+        "--BundleAdjustment.max_linear_solver_iterations",
+        str(bundle_adjustment_options.max_linear_solver_iterations),
+        "--BundleAdjustment.function_tolerance",
+        str(bundle_adjustment_options.function_tolerance),
+        "--BundleAdjustment.gradient_tolerance",
+        str(bundle_adjustment_options.gradient_tolerance),
+        "--BundleAdjustment.parameter_tolerance",
+        str(bundle_adjustment_options.parameter_tolerance),
+        "--BundleAdjustment.refine_focal_length",
+        str(bundle_adjustment_options.refine_focal_length),
+        "--BundleAdjustment.refine_principal_point",
+        str(bundle_adjustment_options.refine_principal_point),
+        "--BundleAdjustment.refine_extra_params",
+        str(bundle_adjustment_options.refine_extra_params),
+        "--BundleAdjustment.refine_extrinsics",
+        str(bundle_adjustment_options.refine_extrinsics),
+    ]
+
+
+REPORT_PATTERNS = {  # Note: field -> (pattern of the summary line, type), the first matching line counts
+    "residuals": (re.compile(r".*Residuals : (\d+)$"), int),
+    "parameters": (re.compile(r".*Parameters : (\d+)$"), int),
+    "iterations": (re.compile(r".*Iterations : (\d+)$"), int),
+    "time": (re.compile(r".*Time : (\d+\.\d+) \[s]"), float),
+    "initial_cost": (re.compile(r".*Initial cost : (\d+\.\d+) \[px]"), float),
+    "final_cost": (re.compile(r".*Final cost : (\d+\.\d+) \[px]"), float),
+    "termination": (re.compile(r".*Termination : (Convergence|No convergence)$"), str),
+    "elapsed_time": (re.compile(r".*Elapsed time: (\d+\.\d+) \[minutes]"), float),
+}
+
+
+class BundleAdjustmentReportParser:
+    """ parses the report while the lines of colmap's output come in, instead of searching the whole output """
+
+    def __init__(self, patterns=None):
+        self.patterns = dict(REPORT_PATTERNS if patterns is None else patterns)
+        self.values = {}
+        self.lines = []
+
+    def feed(self, line: str):
+        line = line.rstrip("\n")
+        self.lines.append(line)
+        for field, (pattern, to_type) in list(self.patterns.items()):
+            match = pattern.match(line)
+            if match:
+                self.values[field] = to_type(match.group(1))
+                del self.patterns[field]  # Note: summary lines are rare, most lines test against few patterns
+                break
+
+    @property
+    def std_out(self) -> str:
+        return "".join(line + "\n" for line in self.lines)
+
+    def report(self, report_type=None):
+        report_type = report_type or BundleAdjustmentReport
+        missing = [f for f in report_type._fields if f not in self.values]
+        if missing:
+            raise ValueError(f"colmap output has no {', '.join(missing)}:\n{self.std_out}")
+        return report_type(**{f: self.values[f] for f in report_type._fields})
+
+
+@dataclass
+class BundleAdjusterRun:
+    std_out: str
+    measured_time: float
+    report: BundleAdjustmentReport
+
+
+def _finished_run(command, return_code, parser: BundleAdjustmentReportParser, measured_time) -> BundleAdjusterRun:
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, command, output=parser.std_out)
+    return BundleAdjusterRun(parser.std_out, measured_time, parser.report())
+
 
+def run_bundle_adjuster(input_path, output_path, bundle_adjustment_options: BundleAdjustmentOptions = None,
+                        on_line: Optional[Callable[[str], None]] = None) -> BundleAdjusterRun:
+    """ runs colmap's bundle_adjuster, its output is parsed (and handed to on_line) line by line """
+    os.makedirs(output_path, exist_ok=True)
+    command = _bundle_adjuster_command(input_path, output_path, bundle_adjustment_options)
+    parser = BundleAdjustmentReportParser()
     start = time.perf_counter()
-    p = subprocess.run(
-        [
-            COLMAP_PATH,
-            "bundle_adjuster",
-            "--input_path",
-            input_path,
-            "--output_path",
-            output_path,
-            "--BundleAdjustment.max_num_iterations",
-            str(bundle_adjustment_options.max_num_iterations),
-            "--BundleAdjustment.max_linear_solver_iterations",
-            str(bundle_adjustment_options.max_linear_solver_iterations),
-            "--BundleAdjustment.function_tolerance",
-            str(bundle_adjustment_options.function_tolerance),
-            "--BundleAdjustment.gradient_tolerance",
-            str(bundle_adjustment_options.gradient_tolerance),
-            "--BundleAdjustment.parameter_tolerance",
-            str(bundle_adjustment_options.parameter_tolerance),
-            "--BundleAdjustment.refine_focal_length",
-            str(bundle_adjustment_options.refine_focal_length),
-            "--BundleAdjustment.refine_principal_point",
-            str(bundle_adjustment_options.refine_principal_point),
-            "--BundleAdjustment.refine_extra_params",
-            str(bundle_adjustment_options.refine_extra_params),
-            "--BundleAdjustment.refine_extrinsics",
-            str(bundle_adjustment_options.refine_extrinsics),
-        ],
-        stdout=subprocess.PIPE,
-    )
-    total_time = time.perf_counter() - start
-    std_out = p.stdout.decode("utf-8")
-    assert p.returncode == 0
-    return std_out, total_time
+    with subprocess.Popen(command, stdout=subprocess.PIPE, text=True) as p:
+        for line in p.stdout:
+            parser.feed(line)
+            if on_line:
+                on_line(line)
+    return _finished_run(command, p.returncode, parser, time.perf_counter() - start)
+
+
+async def run_bundle_adjuster_async(input_path, output_path, bundle_adjustment_options: BundleAdjustmentOptions = None,
+                                    on_line: Optional[Callable[[str], None]] = None,
+                                    semaphore: asyncio.Semaphore = None) -> BundleAdjusterRun:
+    """ run_bundle_adjuster as coroutine, with a semaphore at most its value colmap processes run at once """
+    os.makedirs(output_path, exist_ok=True)
+    command = _bundle_adjuster_command(input_path, output_path, bundle_adjustment_options)
+    async with semaphore or nullcontext():
+        parser = BundleAdjustmentReportParser()
+        start = time.perf_counter()
+        p = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+        try:
+            async for line in p.stdout:
+                line = line.decode("utf-8")
+                parser.feed(line)
+                if on_line:
+                    on_line(line)
+            return_code = await p.wait()
+        except BaseException:  # Note: e.g. cancelled, no orphaned colmap processes
+            if p.returncode is None:
+                p.kill()
+                await p.wait()
+            raise
+        measured_time = time.perf_counter() - start
+    return _finished_run(command, return_code, parser, measured_time)
+
+
+def run_bundle_adjusters(jobs: Iterable[Tuple[str, str, Optional[BundleAdjustmentOptions]]],
+                         max_concurrent=os.cpu_count()) -> List[BundleAdjusterRun]:
+    """ runs of the (input path, output path, options) jobs, at most max_concurrent at once, in order of jobs """
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_concurrent)
+        return await asyncio.gather(*(run_bundle_adjuster_async(i, o, options, semaphore=semaphore)
+                                      for i, o, options in jobs))
+
+    return asyncio.run(run_all())
+
+
+def perform_bundle_adjustment(
+    input_path, output_path, bundle_adjustment_options: BundleAdjustmentOptions = None
+):
+    """ (std_out, measured time), see run_bundle_adjuster for the parsed report """
+    run = run_bundle_adjuster(input_path, output_path, bundle_adjustment_options)
+    return run.std_out, run.measured_time
 
 
 def _process_std_out(std_out):
-    return BundleAdjustmentReport(
-        residuals=int(re.search(r".*Residuals : (\d+)\n", std_out).group(1)),
-        parameters=int(re.search(r".*Parameters : (\d+)\n", std_out).group(1)),
-        iterations=int(re.search(r".*Iterations : (\d+)\n", std_out).group(1)),
-        time=float(re.search(r".*Time : (\d+\.\d+) \[s]", std_out).group(1)),
-        initial_cost=float(
-            re.search(r".*Initial cost : (\d+\.\d+) \[px]", std_out).group(1)
-        ),
-        final_cost=float(
-            re.search(r".*Final cost : (\d+\.\d+) \[px]", std_out).group(1)
-        ),
-        termination=re.search(
-            r".*Termination : (Convergence|No convergence)\n", std_out
-        ).group(1),
-        elapsed_time=float(
-            re.search(r".*Elapsed time: (\d+\.\d+) \[minutes]", std_out).group(1)
-        ),
-    )
+    parser = BundleAdjustmentReportParser()
+    for line in std_out.splitlines():
+        parser.feed(line)
+    return parser.report()
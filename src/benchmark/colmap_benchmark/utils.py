@@ -1,8 +1,59 @@
+import ctypes
 import os
 import sys
+import tempfile
 import threading
 import time
 
+try:
+    _LIBC = ctypes.CDLL(None)
+except OSError:  # Note: e.g. windows, there the C buffers are not flushed before reading the capture
+    _LIBC = None
+
+
+def _flush_c_stdout():
+    """ flushes the C stdio buffers (printf / std::cout of libraries) into the redirected file descriptor """
+    if _LIBC is not None:
+        _LIBC.fflush(None)
+
+
+class StdoutCapture:
+    """
+    Redirects the stdout file descriptor (incl. the output of C/C++ libraries) into a temporary file.
+    take() returns what was written since the last take(), read in one go, nothing runs while the captured code
+    writes (unlike a pipe, that has to be read while it fills up).
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.fd = self.stream.fileno()
+        self._file, self._saved_fd, self._offset = None, None, 0
+
+    def __enter__(self):
+        self.stream.flush()
+        _flush_c_stdout()
+        self._file = tempfile.TemporaryFile()
+        self._saved_fd = os.dup(self.fd)
+        os.dup2(self._file.fileno(), self.fd)
+        self._offset = 0
+        return self
+
+    def take(self) -> str:
+        self.stream.flush()
+        _flush_c_stdout()
+        size = os.fstat(self._file.fileno()).st_size
+        # Note: pread keeps the file position, which the redirected descriptor shares
+        data = os.pread(self._file.fileno(), size - self._offset, self._offset)
+        self._offset = size
+        return data.decode(self.stream.encoding or "utf-8", errors="replace")
+
+    def __exit__(self, *exc_info):
+        self.stream.flush()
+        _flush_c_stdout()
+        os.dup2(self._saved_fd, self.fd)
+        os.close(self._saved_fd)
+        self._file.close()
+
 
 class OutputGrabber(object):
     """
@@ -70,11 +121,17 @@ class OutputGrabber(object):
 
     def readOutput(self):
         """
-        Read the stream data (one byte at a time)
+        Read the stream data (in blocks, up to the escape character)
         and save the text in `capturedtext`.
         """
+        escape = self.escape_char.encode()
+        blocks = []
         while True:
-            char = os.read(self.pipe_out, 1).decode(self.origstream.encoding)
-            if not char or self.escape_char in char:
+            block = os.read(self.pipe_out, 65536)
+            if not block:
+                break
+            if escape in block:
+                blocks.append(block[:block.index(escape)])
                 break
-            self.capturedtext += char
+            blocks.append(block)
+        self.capturedtext = b"".join(blocks).decode(self.origstream.encoding)
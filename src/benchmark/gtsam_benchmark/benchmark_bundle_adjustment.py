@@ -16,6 +16,7 @@ from gtsam import (
 from src.benchmark.benchmark import (
     BundleAdjustmentBenchmark,
     BundleAdjustmentBenchmarkResults,
+    traced_benchmark,
 )
 from src.config import DATASETS_PATH
 from src.dataset.camera import Camera, CameraIntrinsics
@@ -30,12 +31,14 @@ from src.dataset.loaders.colmap_dataset_loader.loader import (
     params_to_intrinsics,
 )
 from src.dataset.point import Point3D
+from src.tracing import span
 
 L = symbol_shorthand.L
 X = symbol_shorthand.X
 
 
 class GtsamBundleAdjustmentBenchmark(BundleAdjustmentBenchmark):
+    @traced_benchmark
     def benchmark(self, *args, **kwargs):
         self.benchmark_args_kwargs = (args, kwargs)
         graph = NonlinearFactorGraph()
@@ -107,7 +110,8 @@ class GtsamBundleAdjustmentBenchmark(BundleAdjustmentBenchmark):
             params.setVerbosity("TERMINATION")
             optimizer = LevenbergMarquardtOptimizer(graph, initial_estimate, params)
             print("Optimizing:")
-            result = optimizer.optimize()
+            with span("solve"):
+                result = optimizer.optimize()
             total_time = time.perf_counter() - start
         except RuntimeError as e:
             # TODO: Something here
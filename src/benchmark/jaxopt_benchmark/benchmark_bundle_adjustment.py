@@ -5,13 +5,15 @@ import jax
 import numpy as np
 
 from src.benchmark.jaxopt_benchmark.helpers import _parse_output_params_bundle
-from src.config import DATASETS_PATH
+from src.benchmark.memory import MemoryProfiler
+from src.config import DATASETS_PATH, JAX_PLATFORM_NAME
 
-jax.config.update("jax_platform_name", "gpu")
+jax.config.update("jax_platform_name", JAX_PLATFORM_NAME)
 
 from src.benchmark.benchmark import (
     BundleAdjustmentBenchmark,
     BundleAdjustmentBenchmarkResults,
+    traced_benchmark,
 )
 from src.dataset.dataset import Dataset
 from src.dataset.loaders.colmap_dataset_loader.loader import load_colmap_dataset
@@ -38,12 +40,21 @@ class JaxoptBundleAdjustmentBenchmark(BundleAdjustmentBenchmark):
          self.masks_all_gpu,
          self.optimizer,
          ) = None, None, None, None, None, None, None, None, None, None, None, None, None, None
+        self.compile_time = None
+        self.memory_profiler = MemoryProfiler(enabled=False)
+        self._optimizer_key = None
 
     def __len__(self):
         return len(self.cam_poses)
 
     def _prepare_dataset(self):
-        dataset = self.dataset.make_reduced_dataset(camera_limit=self.camera_limit, points_limit=self.points_limit)
+        with self.memory_profiler.phase("load"):
+            dataset = self.dataset.make_reduced_dataset(camera_limit=self.camera_limit, points_limit=self.points_limit)
+        with self.memory_profiler.phase("prepare"):
+            return self._prepare_arrays(dataset)
+
+    @staticmethod
+    def _prepare_arrays(dataset):
         cam_poses = []
         intrinsics = []
 
@@ -120,11 +131,17 @@ class JaxoptBundleAdjustmentBenchmark(BundleAdjustmentBenchmark):
             self.avg_cam_width,
         ) = self._prepare_dataset()
 
-        self.points_2d_all_gpu = to_gpu(self.points_2d_all)
-        self.p3d_indices_all_gpu = to_gpu(self.p3d_indices_all)
-        self.masks_all_gpu = to_gpu(self.masks_all)
+        with self.memory_profiler.phase("transfer"):
+            self.points_2d_all_gpu = to_gpu(self.points_2d_all)
+            self.p3d_indices_all_gpu = to_gpu(self.p3d_indices_all)
+            self.masks_all_gpu = to_gpu(self.masks_all)
 
-        self.optimizer = JaxBundleAdjustment(len(self.cam_poses), self.avg_cam_width)
+        # Note: reused by repeated calls (see Benchmark.repeat) of the same problem, its jitted solver keeps
+        #  the compiled executables, a new one would compile from scratch again
+        optimizer_key = (len(self.cam_poses), self.avg_cam_width)
+        if self.optimizer is None or self._optimizer_key != optimizer_key:
+            self.optimizer = JaxBundleAdjustment(*optimizer_key)
+            self._optimizer_key = optimizer_key
 
     def compile(self) -> None:
         self.optimizer.compile(
@@ -140,14 +157,20 @@ class JaxoptBundleAdjustmentBenchmark(BundleAdjustmentBenchmark):
             self.masks_all_gpu,
         )
 
+    @traced_benchmark
     def benchmark(self, *args, **kwargs):
         """
         @type verbose: bool; specify verbosity
         @type camera_limit: int; specify for reduced dataset
         @type points_limit: int; specify for reduced dataset
+        @type memory_profile: bool; measure the memory of the phases (self.memory), implied by the two below
+        @type memory_report_threshold: int; bytes (rss or device), print an allocation report for phases above it
+        @type memory_report_path: str; append the allocation reports to this file instead
+        @type trace_path: str; export the spans of this call as chrome trace json
         """
         verbose = kwargs.get("verbose", False)
         self.benchmark_args_kwargs = (args, kwargs)
+        self.memory_profiler = MemoryProfiler.from_kwargs(kwargs)
 
         # No defaults; will raise errors if not set
         camera_limit = kwargs["camera_limit"]
@@ -161,34 +184,41 @@ class JaxoptBundleAdjustmentBenchmark(BundleAdjustmentBenchmark):
             ]
         )
 
-        opt_params, cx_cy_skew = self.optimizer.prepare_params(
-            self.cam_poses, initial_intrinsics, self.points_3d_all
-        )
-
-        opt_params = to_gpu(opt_params)
-        cx_cy_skew = to_gpu(cx_cy_skew)
-
-        start = time.perf_counter()
-        self.compile()
-        compile_time = time.perf_counter() - start
-
-        print("compile: ", compile_time)
-
-        start = time.perf_counter()
-        params, state = self.optimize(opt_params, cx_cy_skew)
-        total_time = time.perf_counter() - start
-
-        print("run: ", total_time)
+        with self.memory_profiler.phase("prepare"):
+            opt_params, cx_cy_skew = self.optimizer.prepare_params(
+                self.cam_poses, initial_intrinsics, self.points_3d_all
+            )
 
-        print("iterations:", state.iter_num)
-        cam, points = _parse_output_params_bundle(
-            params,
-            self.dataset,
-            cx_cy_skew=cx_cy_skew,
-            num_3d_points=len(self.points_3d_all),
-            num_cams=len(self.cam_poses),
-            benchmark_index_to_point_identifier_mapping=self.benchmark_index_to_point_identifier_mapping,
-        )
+        with self.memory_profiler.phase("transfer"):
+            opt_params = to_gpu(opt_params)
+            cx_cy_skew = to_gpu(cx_cy_skew)
+
+        with self.memory_profiler.phase("compile"):
+            start = time.perf_counter()
+            self.compile()
+            compile_time = time.perf_counter() - start
+        self.compile_time = compile_time
+
+        with self.memory_profiler.phase("solve"):
+            start = time.perf_counter()
+            params, state = self.optimize(opt_params, cx_cy_skew)
+            total_time = time.perf_counter() - start
+
+        if verbose:
+            print("iterations:", state.iter_num)
+        with self.memory_profiler.phase("parse"):
+            cam, points = _parse_output_params_bundle(
+                params,
+                self.dataset,
+                cx_cy_skew=cx_cy_skew,
+                num_3d_points=len(self.points_3d_all),
+                num_cams=len(self.cam_poses),
+                benchmark_index_to_point_identifier_mapping=self.benchmark_index_to_point_identifier_mapping,
+            )
+        if self.memory_profiler.enabled:
+            self.memory = self.memory_profiler.summary()
+            if verbose:
+                print(self.memory_profiler)
         self._results = BundleAdjustmentBenchmarkResults(
             camera_mapping=cam, point_mapping=points
         )
@@ -3,8 +3,11 @@ import time
 import numpy as np
 from tqdm import tqdm
 
-from src.benchmark.benchmark import SinglePoseBenchmark, SinglePoseBenchmarkResults
+from src.benchmark.benchmark import (SinglePoseBenchmark,
+                                     SinglePoseBenchmarkResults,
+                                     traced_benchmark)
 from src.benchmark.jaxopt_benchmark.helpers import _parse_output_params
+from src.benchmark.memory import MemoryProfiler
 from src.dataset.dataset import Dataset
 from src.reconstruction.bundle_adjustment.loss import JaxLossFunction
 from src.reconstruction.bundle_adjustment.pose_optimization import JaxPoseOptimizer
@@ -28,26 +31,40 @@ class JaxoptSinglePoseBenchmarkBatched(SinglePoseBenchmark):
             self.masks,
             self.cam_poses_gpu,
         ) = (None, None, None, None, None, None, None, None, None)
+        self.memory_profiler = MemoryProfiler(enabled=False)
+        self.compile_time = None  # Note: warm-up compile and the compile of the first batch
+        self._optimizer_key = None
 
     def setup(self):
-        (
-            self.cam_poses,
-            self.intrinsics,
-            self.points,
-            self.observations,
-            self.avg_cam_width,
-        ) = self._prepare_dataset()
+        with self.memory_profiler.phase("prepare"):
+            (
+                self.cam_poses,
+                self.intrinsics,
+                self.points,
+                self.observations,
+                self.avg_cam_width,
+            ) = self._prepare_dataset()
+
+            # Note: reused by repeated calls (see Benchmark.repeat) of the same problem, its jitted solver keeps
+            #  the compiled executables, a new one would compile from scratch again
+            optimizer_key = (self.avg_cam_width, JaxLossFunction.CAUCHY)
+            if self.optimizer is None or self._optimizer_key != optimizer_key:
+                self.optimizer = JaxPoseOptimizer(
+                    avg_cam_width=self.avg_cam_width, loss_fn=JaxLossFunction.CAUCHY
+                )
+                self._optimizer_key = optimizer_key
 
-        self.optimizer = JaxPoseOptimizer(
-            avg_cam_width=self.avg_cam_width, loss_fn=JaxLossFunction.CAUCHY
-        )
+            self.initial_point_sizes = [len(p) for p in self.points]
+            self.points_num = max(self.points, key=lambda x: x.shape[0]).shape[0]
 
-        self.initial_point_sizes = [len(p) for p in self.points]
-        self.points_num = max(self.points, key=lambda x: x.shape[0]).shape[0]
+            self.masks = self._create_masks()
 
-        self.masks = self._create_masks()
+        with self.memory_profiler.phase("transfer"):
+            self.cam_poses_gpu = to_gpu(self.cam_poses)
 
-        self.cam_poses_gpu = to_gpu(self.cam_poses)
+    def phase_times(self):
+        c_times, o_times, total_t = self.time
+        return self.compile_time, sum(o_times)
 
     def __len__(self):
         return len(self.cam_poses)
@@ -151,37 +168,42 @@ class JaxoptSinglePoseBenchmarkBatched(SinglePoseBenchmark):
         ).T
 
         poses0 = self.cam_poses_gpu[camera_index : camera_index + batch_size]
-        opt_params, cx_cy_skew = self.optimizer.prepare_params(poses0, intrinsics0)
+        with self.memory_profiler.phase("prepare"):
+            opt_params, cx_cy_skew = self.optimizer.prepare_params(poses0, intrinsics0)
 
-        opt_params = to_gpu(opt_params)
-        cx_cy_skew = to_gpu(cx_cy_skew)
+        with self.memory_profiler.phase("transfer"):
+            opt_params = to_gpu(opt_params)
+            cx_cy_skew = to_gpu(cx_cy_skew)
 
-        points_gpu, observations_gpu = self._prepare_points(
-            camera_index, batch_size=batch_size
-        )
+            points_gpu, observations_gpu = self._prepare_points(
+                camera_index, batch_size=batch_size
+            )
 
-        masks_gpu = self._get_mask(camera_index, batch_size=batch_size)
+            masks_gpu = self._get_mask(camera_index, batch_size=batch_size)
 
-        start = time.perf_counter()
-        self.compile(
-            len(self.points[camera_index]) if batch_size == 0 else self.points_num,
-            batch_size=batch_size,
-        )
-        compilation_time = time.perf_counter() - start
+        with self.memory_profiler.phase("compile"):
+            start = time.perf_counter()
+            self.compile(
+                len(self.points[camera_index]) if batch_size == 0 else self.points_num,
+                batch_size=batch_size,
+            )
+            compilation_time = time.perf_counter() - start
         if batch_size != 0 and camera_index != 0:
             compilation_time = 0.0
 
-        start = time.perf_counter()
-        params, state = self.optimize(
-            opt_params,
-            points_gpu,
-            observations_gpu,
-            cx_cy_skew,
-            masks_gpu,
-        )
-        optimization_time = time.perf_counter() - start
+        with self.memory_profiler.phase("solve"):
+            start = time.perf_counter()
+            params, state = self.optimize(
+                opt_params,
+                points_gpu,
+                observations_gpu,
+                cx_cy_skew,
+                masks_gpu,
+            )
+            optimization_time = time.perf_counter() - start
 
-        params = np.concatenate([params, cx_cy_skew], axis=1)
+        with self.memory_profiler.phase("parse"):
+            params = np.concatenate([params, cx_cy_skew], axis=1)
 
         if verbose:
             print("=== Camera %d ===" % camera_index)
@@ -191,14 +213,22 @@ class JaxoptSinglePoseBenchmarkBatched(SinglePoseBenchmark):
             print("Gradient:", np.mean(np.abs(state.gradient)))
         return compilation_time, optimization_time, params, state
 
+    @traced_benchmark
     def benchmark(self, *args, **kwargs):
         """
         Args:
             @parameter verbose (bool, default: True): specify verbosity of output
             @parameter batch_size (int, default: 1): specify num of entries processed in parallel.
             Must be divisible by length of datasetEntries.
+            @parameter memory_profile (bool, default: False): measure the memory of the phases (self.memory), implied
+            by the two below
+            @parameter memory_report_threshold (int, default: None): bytes (rss or device), print an allocation report
+            for phases above it
+            @parameter memory_report_path (str, default: None): append the allocation reports to this file instead
+            @parameter trace_path (str, default: None): export the spans of this call as chrome trace json
         """
         self.benchmark_args_kwargs = (args, kwargs)
+        self.memory_profiler = MemoryProfiler.from_kwargs(kwargs)
         self.setup()
         verbose = kwargs.get("verbose", True)
         batch_size = kwargs.get("batch_size", 1)
@@ -206,9 +236,10 @@ class JaxoptSinglePoseBenchmarkBatched(SinglePoseBenchmark):
 
         if verbose:
             print("Warming up...")
-        s = time.perf_counter()
-        self.compile(3000, batch_size=batch_size)
-        e = time.perf_counter() - s
+        with self.memory_profiler.phase("compile"):
+            s = time.perf_counter()
+            self.compile(3000, batch_size=batch_size)
+            e = time.perf_counter() - s
 
         for i in tqdm(
             range(0, len(self.cam_poses), batch_size),
@@ -248,10 +279,16 @@ class JaxoptSinglePoseBenchmarkBatched(SinglePoseBenchmark):
                     f"Average iterations: {np.round(np.average(iterations), decimals=2)}"
                 )
 
-        self._results = SinglePoseBenchmarkResults(
-            camera_mapping=_parse_output_params(param_list, self.dataset)
-        )
+        with self.memory_profiler.phase("parse"):
+            self._results = SinglePoseBenchmarkResults(
+                camera_mapping=_parse_output_params(param_list, self.dataset)
+            )
+        if self.memory_profiler.enabled:
+            self.memory = self.memory_profiler.summary()
+            if verbose:
+                print(self.memory_profiler)
         self._time = c_times, o_times, total_t
+        self.compile_time = e + total_c
         #  self._single_times = list(map(lambda x: x[0] + x[1], list(zip(c_times, o_times))))
         self._single_times = [o_times[0] + total_c, *o_times[1:]]
         self._iterations = iterations
@@ -1,5 +1,3 @@
-import copy
-
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.spatial.transform import Rotation
@@ -8,11 +6,13 @@ from triangulation_relaxations.so3 import rotvec_to_r
 
 from src.dataset.camera import Camera
 from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
 from src.dataset.camera_pose.enums_and_types import (
     CoordinateSystem,
     TransformationDirection,
 )
 from src.dataset.loaders.colmap_dataset_loader.loader import params_to_intrinsics
+from src.dataset.point import Point3D
 from src.reconstruction.bundle_adjustment.utils import get_reprojection_residuals_cpu
 
 
@@ -20,19 +20,21 @@ def _parse_output_params(param_list, dataset):
     # VERY BIG NOTE: If we don't use np.array(...) or float(...) we reference memory stored on the GPU
     # This will be "revived" if we get the values in the queue.get(), filling up the complete GPU memory again
     cameras = {}
+    params_array = np.array([np.array(params[0:6]) for params in param_list]).reshape((-1, 6))
+    new_camera_poses = CameraPoseArray.from_rotvecs(
+        rotvecs=params_array[:, 0:3],
+        translations=params_array[:, 3:6],
+        identifiers=[de.camera.camera_pose.identifier for de in dataset.datasetEntries[:len(param_list)]],
+        coordinate_system=CoordinateSystem.COLMAP,
+        direction=TransformationDirection.W2C,
+    ).to_poses()
     for index, params in enumerate(param_list):
         if any(np.isnan(params)):  # TODO: adjust this later
             raise Exception(
                 "NANANANANANANANANANANANANANANANANANANANANANANANA BATMAN (nan detected)"
             )
         old_camera = dataset.datasetEntries[index].camera
-        new_camera_pose = CameraPose(
-            rotation=Rotation.from_rotvec(np.array(params[0:3])),
-            translation=np.array(params[3:6]),
-            coordinate_system=CoordinateSystem.COLMAP,
-            identifier=old_camera.camera_pose.identifier,
-            direction=TransformationDirection.W2C,
-        )
+        new_camera_pose = new_camera_poses[index]
         new_intrinsics = params_to_intrinsics(
             fx=float(params[6]),
             fy=float(params[7]),
@@ -116,16 +118,14 @@ def _parse_output_params_bundle(
     point_mapping = {}
     for index, point in enumerate(new_points):
         identifier = benchmark_index_to_point_identifier_mapping.get(index)
-        copied_point = copy.deepcopy(dataset.points3D_mapped.get(identifier))
-
-        # get new data
+        original_point = dataset.points3D_mapped.get(identifier)
 
         # Note we need this mapping and cannot use point[0], point[1], ...; because it revives GPU memory
-        copied_point.x, copied_point.y, copied_point.z = list(
-            map(float, np.array(point))
-        )
-        copied_point.metadata.update({"note": "returned from bundle adjustment"})
-        point_mapping.update({identifier: copied_point})
+        x, y, z = list(map(float, np.array(point)))
+        point_mapping.update({identifier: Point3D(
+            identifier=identifier, x=x, y=y, z=z,
+            metadata={**original_point.metadata, "note": "returned from bundle adjustment"},
+        )})
     return cameras, point_mapping
 
 
@@ -0,0 +1,202 @@
+"""
+Host / device memory per benchmark phase (load, prepare, transfer, compile, solve, parse):
+process RSS (sampled in the background during a phase to catch its peak) and the bytes of the live JAX arrays
+"""
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from src.tracing import span
+
+
+def rss_bytes() -> int:
+    """ current resident set size of this process """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):  # Note: no procfs (e.g. macOS), the peak so far is the best we get
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else 1024 * maxrss
+
+
+def _jax():
+    """ jax if this process already imported it, a profiler must not initialize a backend on its own """
+    return sys.modules.get("jax")
+
+
+def live_arrays():
+    jax = _jax()
+    return jax.live_arrays() if jax is not None else []
+
+
+def device_bytes() -> int:
+    """ bytes of the live jax arrays (over all devices) """
+    return sum(a.nbytes for a in live_arrays())
+
+
+def device_memory_stats() -> Dict[str, Dict]:
+    """ allocator statistics per device (bytes_in_use, peak_bytes_in_use, ...), empty for the cpu backend """
+    jax = _jax()
+    if jax is None:
+        return {}
+    stats = {}
+    for device in jax.local_devices():
+        device_stats = device.memory_stats() if hasattr(device, "memory_stats") else None
+        if device_stats:
+            stats[str(device)] = device_stats
+    return stats
+
+
+def allocation_report(top=20) -> str:
+    """ the largest live jax arrays and the allocator statistics, for finding what fills the (gpu) memory """
+    arrays = sorted(live_arrays(), key=lambda a: a.nbytes, reverse=True)
+    lines = [f"rss: {_mb(rss_bytes())}, live jax arrays: {len(arrays)} with {_mb(sum(a.nbytes for a in arrays))}"]
+    for device, stats in device_memory_stats().items():
+        lines.append(f"{device}: in use {_mb(stats.get('bytes_in_use', 0))}, "
+                     f"peak {_mb(stats.get('peak_bytes_in_use', 0))}, limit {_mb(stats.get('bytes_limit', 0))}")
+    for a in arrays[:top]:
+        lines.append(f"  {_mb(a.nbytes):>12}  {a.dtype}{list(a.shape)} on {', '.join(map(str, a.devices()))}")
+    if len(arrays) > top:
+        lines.append(f"  ... {len(arrays) - top} more")
+    return "\n".join(lines)
+
+
+def _allocator_peak() -> int:
+    """ peak_bytes_in_use summed over the devices (0 for the cpu backend) """
+    return sum(s.get("peak_bytes_in_use", 0) for s in device_memory_stats().values())
+
+
+def _mb(num_bytes) -> str:
+    return f"{num_bytes / 2 ** 20:.1f} MB"
+
+
+class _PeakSampler(threading.Thread):
+    """ samples rss every interval seconds until stopped """
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, rss_bytes())
+
+
+class MemoryProfiler:
+    """
+    Usage:
+        profiler = MemoryProfiler(report_threshold=8 * 2 ** 30)
+        with profiler.phase("solve"):
+            ...
+        profiler.summary()
+
+    A phase entered several times (e.g. transfer per batch) accumulates: deltas add up, peaks are the maximum.
+    Every phase is a tracing span as well. Measuring costs about a millisecond per phase (sampler thread, scans of the
+    live arrays), so timers belong inside the phase and the profiler is off unless asked for, see from_kwargs.
+    If report_threshold (bytes) is set and a phase peaks above it (rss or device), an allocation_report is
+    printed or appended to report_path.
+    interval: seconds between rss samples during a phase, None samples at the phase boundaries only.
+    """
+
+    def __init__(self, report_threshold: Optional[int] = None, report_path: Optional[str] = None,
+                 interval: Optional[float] = 0.005, enabled=True):
+        self.report_threshold = report_threshold
+        self.report_path = report_path
+        self.interval = interval
+        self.enabled = enabled
+        self.phases: Dict[str, Dict] = {}
+        self.reports: List[str] = []
+        self.rss_start: Optional[int] = None  # Note: rss at the entry of the first phase
+
+    @classmethod
+    def from_kwargs(cls, kwargs: Dict) -> "MemoryProfiler":
+        """ profiler of the benchmark kwargs memory_profile / memory_report_threshold / memory_report_path """
+        report_threshold, report_path = kwargs.get("memory_report_threshold"), kwargs.get("memory_report_path")
+        return cls(report_threshold=report_threshold, report_path=report_path,
+                   enabled=bool(kwargs.get("memory_profile")) or report_threshold is not None or bool(report_path))
+
+    @contextmanager
+    def phase(self, name):
+        with span(name):
+            if self.enabled:
+                with self._measured(name):
+                    yield
+            else:
+                yield
+
+    @contextmanager
+    def _measured(self, name):
+        rss_before, device_before = rss_bytes(), device_bytes()
+        if self.rss_start is None:
+            self.rss_start = rss_before
+        allocator_peak_before = _allocator_peak()
+        sampler = _PeakSampler(self.interval) if self.interval else None
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            rss_peak = sampler.stop() if sampler else max(rss_before, rss_bytes())
+            rss_after, device_after = rss_bytes(), device_bytes()
+            # Note: the allocator peak is the one since the process started, it belongs to this phase if it rose
+            allocator_peak = _allocator_peak()
+            device_peak = max(device_before, device_after,
+                              allocator_peak if allocator_peak > allocator_peak_before else 0)
+            self._record(name, rss_before, rss_after, rss_peak, device_before, device_after, device_peak, seconds)
+
+    def _record(self, name, rss_before, rss_after, rss_peak, device_before, device_after, device_peak, seconds):
+        entry = self.phases.setdefault(name, {"count": 0, "seconds": 0.0, "rss_delta": 0, "rss_peak": 0,
+                                              "device_delta": 0, "device_peak": 0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+        entry["rss_delta"] += rss_after - rss_before
+        entry["rss_peak"] = max(entry["rss_peak"], rss_peak)
+        entry["device_delta"] += device_after - device_before
+        entry["device_peak"] = max(entry["device_peak"], device_peak)
+        entry["rss_after"], entry["device_after"] = rss_after, device_after
+
+        if self.report_threshold is not None and max(rss_peak, device_peak) > self.report_threshold:
+            self._report(f"memory threshold {_mb(self.report_threshold)} exceeded in phase {name} "
+                         f"(rss peak {_mb(rss_peak)}, device peak {_mb(device_peak)})\n{allocation_report()}")
+
+    def _report(self, report):
+        self.reports.append(report)
+        if self.report_path:
+            with open(self.report_path, "a") as f:
+                f.write(report + "\n\n")
+        else:
+            print(report)
+
+    @property
+    def rss_peak(self) -> int:
+        return max((p["rss_peak"] for p in self.phases.values()), default=0)
+
+    @property
+    def device_peak(self) -> int:
+        return max((p["device_peak"] for p in self.phases.values()), default=0)
+
+    def summary(self) -> Dict:
+        """ json compatible: overall peaks and the phases (in order of first entry) """
+        return {"rss_peak": self.rss_peak, "rss_start": self.rss_start, "device_peak": self.device_peak,
+                "phases": {name: dict(entry) for name, entry in self.phases.items()},
+                "reports": len(self.reports)}
+
+    def __str__(self):
+        lines = [f"peak rss {_mb(self.rss_peak)}, peak device {_mb(self.device_peak)}"]
+        for name, p in self.phases.items():
+            lines.append(f"  {name:<10} rss {_mb(p['rss_delta']):>12} (peak {_mb(p['rss_peak'])}), "
+                         f"device {_mb(p['device_delta']):>12} (peak {_mb(p['device_peak'])})")
+        return "\n".join(lines)
@@ -1,79 +1,188 @@
-import os
-import time
-from multiprocessing import Manager, Process, cpu_count
+"""
+Ordered parallel map over chunks of the input, with process, thread and serial backends behind one call:
+
+    parallel_map(function, items)                      # [function(item) for item in items]
+    parallel_map(function, items, shared={"xyz": xyz})  # [function(item, xyz=xyz) for item in items]
+    parallel_map_chunks(function, items)               # [function(chunk) for chunk in chunks of items]
+
+Process backend: the function (and the shared arrays) reach every worker once, not per item. Numeric numpy arrays
+(shared arrays and items given as array) are placed in shared memory and arrive as read-only views, other items are
+pickled per chunk. The first exception of a worker cancels the remaining chunks and is raised as ParallelMapError.
+"""
+import traceback
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from enum import Enum
+from multiprocessing import cpu_count
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+ITEMS = "__items__"
+
+
+class Backend(Enum):
+    PROCESS = "process"  # Note: cpu bound python code
+    THREAD = "thread"  # Note: io or code releasing the GIL (numpy, jax, file access)
+    SERIAL = "serial"  # Note: debugging, profiling
+
+
+class ParallelMapError(Exception):
+    """ the function raised for an item, message: index of the item and the traceback of the worker """
+
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.index = index
+
+    def __reduce__(self):
+        return ParallelMapError, (self.args[0], self.index)
+
+
+def _chunk_ranges(num_items, num_workers, chunk_size=None) -> List[Tuple[int, int]]:
+    if chunk_size is None:  # Note: about 4 chunks per worker even out items of different cost
+        chunk_size = max(1, -(-num_items // (4 * num_workers)))
+    return [(start, min(start + chunk_size, num_items)) for start in range(0, num_items, chunk_size)]
+
+
+class _SharedArrays:
+    """ copies of numpy arrays in shared memory blocks, specs is what a worker needs to attach """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self._blocks = []
+        self.specs = {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                if array.dtype.hasobject:
+                    raise TypeError(f"shared array {name} has dtype object, pass it as item (pickled) instead")
+                block = SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+                self.specs[name] = (block.name, array.shape, array.dtype.str)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        # Note: unlinking removes the names only, workers keep their mappings until they exit
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def _attach(specs) -> Tuple[list, Dict[str, np.ndarray]]:
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = SharedMemory(name=block_name)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        blocks.append(block)
+        arrays[name] = array
+    return blocks, arrays
+
+
+def _run_chunk(function, shared, chunk, start, per_chunk) -> list:
+    try:
+        if per_chunk:
+            return [function(chunk, **shared)]
+    except Exception:
+        raise ParallelMapError(f"chunk starting at item {start}:\n{traceback.format_exc()}", start) from None
+    results = []
+    for offset, item in enumerate(chunk):
+        try:
+            results.append(function(item, **shared))
+        except Exception:
+            raise ParallelMapError(f"item {start + offset}:\n{traceback.format_exc()}", start + offset) from None
+    return results
+
+
+_worker = {}  # Note: state of a pool process, set once by _initialize_worker
+
+
+def _initialize_worker(function, specs, per_chunk):
+    _worker["blocks"], shared = _attach(specs)
+    _worker["items"] = shared.pop(ITEMS, None)
+    _worker["function"], _worker["shared"], _worker["per_chunk"] = function, shared, per_chunk
+
+
+def _process_chunk(start, stop, chunk):
+    if chunk is None:
+        chunk = _worker["items"][start:stop]
+    return _run_chunk(_worker["function"], _worker["shared"], chunk, start, _worker["per_chunk"])
+
+
+def _collect(executor, futures, verbose) -> List[list]:
+    """ chunk results in submission order, the first exception cancels the chunks that did not start yet """
+    done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+    failed = [f for f in futures if f in done and f.exception() is not None]
+    if failed:
+        for f in not_done:
+            f.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise failed[0].exception()
+    if verbose:
+        print(f"{len(futures)} chunks finished", flush=True)
+    return [f.result() for f in futures]
+
+
+def _map(function, items, backend, num_workers, chunk_size, shared, per_chunk, verbose) -> List[list]:
+    num_workers = num_workers or cpu_count()
+    shared = shared or {}
+    array_items = isinstance(items, np.ndarray) and not items.dtype.hasobject
+    if not isinstance(items, np.ndarray):
+        items = list(items)
+    ranges = _chunk_ranges(len(items), num_workers, chunk_size)
+
+    if backend == Backend.SERIAL or num_workers == 1 or len(ranges) <= 1:
+        return [_run_chunk(function, shared, items[start:stop], start, per_chunk) for start, stop in ranges]
+
+    if backend == Backend.THREAD:
+        with ThreadPoolExecutor(min(num_workers, len(ranges))) as executor:
+            futures = [executor.submit(_run_chunk, function, shared, items[start:stop], start, per_chunk)
+                       for start, stop in ranges]
+            return _collect(executor, futures, verbose)
+
+    shared_arrays = _SharedArrays({**shared, **({ITEMS: items} if array_items else {})})
+    try:
+        with ProcessPoolExecutor(min(num_workers, len(ranges)), initializer=_initialize_worker,
+                                 initargs=(function, shared_arrays.specs, per_chunk)) as executor:
+            futures = [executor.submit(_process_chunk, start, stop, None if array_items else items[start:stop])
+                       for start, stop in ranges]
+            return _collect(executor, futures, verbose)
+    finally:
+        shared_arrays.close()
+
+
+def parallel_map(function: Callable, items: Sequence, backend=Backend.PROCESS, num_workers=None, chunk_size=None,
+                 shared: Dict[str, np.ndarray] = None, verbose=False) -> List:
+    """
+    [function(item, **shared) for item in items] in the order of items.
+    num_workers: default cpu_count(), chunk_size: items per task, default about 4 tasks per worker
+    shared: numpy arrays every call gets as keyword arguments (read-only, in shared memory for processes)
+    """
+    return [result for chunk in _map(function, items, backend, num_workers, chunk_size, shared, False, verbose)
+            for result in chunk]
+
+
+def parallel_map_chunks(function: Callable, items: Sequence, backend=Backend.PROCESS, num_workers=None,
+                        chunk_size=None, shared: Dict[str, np.ndarray] = None, verbose=False) -> List:
+    """ [function(chunk, **shared) for chunk in chunks of items], e.g. for vectorized functions over array rows """
+    return [chunk[0] for chunk in _map(function, items, backend, num_workers, chunk_size, shared, True, verbose)]
 
 
 class ListMultiProcessor:
     """
     Input: List, Function
-    Output: List of outputs
+    Output: List of outputs (in the order of the input)
+    Deprecated: use parallel_map
     """
 
     def __init__(self, input_list, function, num_threads=cpu_count(), verbose=True):
         self.verbose = verbose
-        self.input_list = (
-            input_list if not self.verbose else list(enumerate(input_list, start=1))
-        )
+        self.input_list = input_list
         self.function = function
         self.num_threads = num_threads
 
-    # TODO: Deprecated
-    # @staticmethod
-    # def _split(a, n):
-    #    k, m = divmod(len(a), n)
-    #    return (a[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n))
-
-    def _process(self, input, output, verbose=True, initial_length=None):
-        def _pop(array, index=0, default=None):
-            try:
-                return array.pop(index)
-            except IndexError:
-                return default
-
-        if verbose:  # Verbose case
-            print(f"Process: {os.getpid()} starting.", flush=True)
-            while index_element := _pop(
-                input
-            ):  # Note: Walrus operator (:=) requires Python >= 3.8
-                i, element = index_element
-                output.append(self.function(element))
-                if (
-                    initial_length
-                    and i
-                    % (
-                        int(initial_length * 0.1)
-                        if (int(initial_length * 0.1)) > 0
-                        else 1
-                    )
-                    == 0
-                ):
-                    print(
-                        f"Process: {os.getpid()} reached {int(i / initial_length * 100)}%",
-                        flush=True,
-                    )
-            print(f"Process: {os.getpid()} finished.", flush=True)
-        else:
-            while element := _pop(
-                input
-            ):  # Note: Walrus operator (:=) requires Python >= 3.8
-                output.append(self.function(element))
-
     def process(self):
-        with Manager() as manager:
-            global input_list
-            input_list = self.input_list
-            INPUT = manager.list(input_list)
-            OUTPUT = manager.list()  # <-- can be shared between processes.
-
-            pr = []
-            for _ in range(self.num_threads):
-                p = Process(
-                    target=self._process,
-                    args=(INPUT, OUTPUT, self.verbose, len(self.input_list)),
-                )
-                p.start()
-                pr.append(p)
-            for pp in pr:
-                pp.join()
-            o = list(OUTPUT)
-            return o
+        return parallel_map(self.function, self.input_list, num_workers=self.num_threads, verbose=self.verbose)
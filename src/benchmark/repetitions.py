@@ -0,0 +1,164 @@
+"""
+Repeated benchmark runs: warmup repetitions are discarded, the measured ones are summarized by median, IQR, min and a
+distribution-free confidence interval of the median. Compile and run times are kept apart:
+
+    cold compile: compile time of the first call in the process (nothing cached yet)
+    warm compile: compile time of the later calls (jit / executable caches are populated, the jaxopt benchmarks
+                  keep their optimizer while the problem stays the same)
+    steady state: run time of the measured repetitions (after warmup)
+"""
+import math
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _median_confidence_ranks(n, confidence) -> Tuple[int, int, float]:
+    """
+    0-based ranks (lower, upper) of the order statistics enclosing the median with at least the confidence
+    (number of samples below the median ~ Binomial(n, 1/2)), and the confidence they actually reach.
+    Too few samples for the confidence give the full range.
+    """
+    alpha = 1.0 - confidence
+    cumulative, lower = 0.0, 0
+    for k in range(n // 2):
+        cumulative += math.comb(n, k) / 2 ** n
+        if cumulative > alpha / 2:
+            break
+        lower = k + 1
+    lower = max(lower, 1)  # Note: rank 1 (the minimum) is as wide as it gets
+    reached = 1.0 - 2 * sum(math.comb(n, k) for k in range(lower)) / 2 ** n
+    return lower - 1, n - lower, reached
+
+
+def min_samples(confidence) -> int:
+    """ the fewest samples whose median confidence interval reaches the confidence """
+    n = 1
+    while _median_confidence_ranks(n, confidence)[2] < confidence:
+        n += 1
+    return n
+
+
+@dataclass
+class TimingStatistics:
+    """ of the measured samples, seconds unless stated otherwise (e.g. bytes for memory samples) """
+    n: int
+    median: float
+    q1: float
+    q3: float
+    min: float
+    max: float
+    mean: float
+    std: float
+    ci_low: float  # confidence interval of the median
+    ci_high: float
+    confidence: float  # reached by (ci_low, ci_high), below the requested one for few samples
+
+    @property
+    def iqr(self) -> float:
+        return self.q3 - self.q1
+
+    @classmethod
+    def from_samples(cls, samples: Sequence[float], confidence=0.95) -> "TimingStatistics":
+        samples = np.sort(np.asarray(samples, dtype=float))
+        if len(samples) == 0:
+            raise ValueError("no samples")
+        lower, upper, reached = _median_confidence_ranks(len(samples), confidence)
+        q1, median, q3 = np.percentile(samples, [25, 50, 75])
+        return cls(n=len(samples), median=float(median), q1=float(q1), q3=float(q3),
+                   min=float(samples[0]), max=float(samples[-1]), mean=float(samples.mean()),
+                   std=float(samples.std(ddof=1)) if len(samples) > 1 else 0.0,
+                   ci_low=float(samples[lower]), ci_high=float(samples[upper]), confidence=reached)
+
+    def overlaps(self, other: "TimingStatistics") -> bool:
+        """ whether the confidence intervals of the medians overlap, i.e. the difference may be noise """
+        return self.ci_low <= other.ci_high and other.ci_low <= self.ci_high
+
+    def __str__(self):
+        return (f"median {self.median:.4f}s [{self.ci_low:.4f}, {self.ci_high:.4f}] ({self.confidence:.0%} CI), "
+                f"IQR {self.iqr:.4f}s, min {self.min:.4f}s, n={self.n}")
+
+
+def repetition_statistics(summary: Dict, key="steady_state") -> Optional[TimingStatistics]:
+    """ TimingStatistics of a stored repetition summary (Benchmark.repetitions), None if it has none for key """
+    entry = (summary or {}).get(key)
+    return TimingStatistics(**entry) if entry else None
+
+
+def _thread_ids() -> List[int]:
+    try:
+        return [int(t) for t in os.listdir("/proc/self/task")]
+    except OSError:
+        return [0]
+
+
+@contextmanager
+def pinned(cpus: Optional[Iterable[int]]):
+    """
+    Restricts this process (every thread already running and the ones / child processes started inside) to cpus,
+    the previous affinity is restored afterwards. None or platforms without sched_setaffinity: no pinning.
+    """
+    if cpus is None or not hasattr(os, "sched_setaffinity"):
+        yield
+        return
+    cpus = set(cpus)
+    previous = {tid: os.sched_getaffinity(tid) for tid in _thread_ids()}
+    for tid in previous:
+        os.sched_setaffinity(tid, cpus)
+    try:
+        yield
+    finally:
+        for tid, affinity in previous.items():
+            try:
+                os.sched_setaffinity(tid, affinity)
+            except OSError:  # Note: the thread ended in the meantime
+                pass
+
+
+@dataclass
+class Repetition:
+    wall: float  # seconds of the whole call
+    compile: float
+    run: float
+    warmup: bool
+
+
+def measure_repetitions(call: Callable[[], None], phase_times: Callable[[], Tuple[float, float]], warmup=1,
+                        repetitions=5, cpu_affinity: Optional[Iterable[int]] = None, confidence=0.95,
+                        verbose=False) -> Dict:
+    """
+    Calls call() warmup + repetitions times, phase_times() gives the (compile, run) seconds of the last call.
+    Returns a json compatible summary: the single repetitions, cold / warm compile and steady state statistics.
+    """
+    if repetitions < 1:
+        raise ValueError("at least one measured repetition is needed")
+    runs: List[Repetition] = []
+    with pinned(cpu_affinity):
+        for index in range(warmup + repetitions):
+            start = time.perf_counter()
+            call()
+            wall = time.perf_counter() - start
+            compile_time, run_time = phase_times()
+            runs.append(Repetition(wall=wall, compile=compile_time, run=run_time, warmup=index < warmup))
+            if verbose:
+                print(f"{'warmup' if index < warmup else 'repetition'} {index}: "
+                      f"compile {compile_time:.4f}s, run {run_time:.4f}s, wall {wall:.4f}s")
+
+    measured = [r for r in runs if not r.warmup]
+    summary = {
+        "warmup": warmup,
+        "cpu_affinity": sorted(cpu_affinity) if cpu_affinity is not None else None,
+        "repetitions": [asdict(r) for r in runs],
+        "cold_compile": runs[0].compile,
+        "warm_compile": asdict(TimingStatistics.from_samples([r.compile for r in runs[1:]], confidence))
+        if len(runs) > 1 else None,
+        "steady_state": asdict(TimingStatistics.from_samples([r.run for r in measured], confidence)),
+        "wall": asdict(TimingStatistics.from_samples([r.wall for r in measured], confidence)),
+    }
+    if verbose:
+        print(f"steady state: {repetition_statistics(summary)}")
+    return summary
@@ -0,0 +1,254 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import traceback
+from collections.abc import Mapping
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from src.dataset.camera import Camera, CameraIntrinsics
+from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
+                                                     TransformationDirection)
+from src.dataset.point import Point3D
+
+Arrays = Dict[str, np.ndarray]
+Objects = Dict[str, object]
+
+
+class BenchmarkSubprocessError(Exception):
+    """ the isolated benchmark raised (message: the traceback of the child) or died """
+
+
+class LazyMapping(Mapping):
+    """ read-only mapping built on first access, pickles (and copies) as a plain dict """
+
+    def __init__(self, build: Callable[[], dict]):
+        self._build = build
+        self._mapping = None
+
+    @property
+    def _built(self) -> dict:
+        if self._mapping is None:
+            self._mapping, self._build = self._build(), None
+        return self._mapping
+
+    def __getitem__(self, key):
+        return self._built[key]
+
+    def __iter__(self):
+        return iter(self._built)
+
+    def __len__(self):
+        return len(self._built)
+
+    def __reduce__(self):
+        return dict, (self._built,)
+
+
+class ResultChannel:
+    """
+    One-shot child -> parent transfer: the child writes arrays as .npy files into a temporary directory and sends
+    their names with the remaining (small) objects through a pipe. The parent waits on the pipe and the process
+    sentinel at the same time, so results, exceptions and crashes arrive without polling.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="benchmark_results_")
+        self._receiver, self._sender = multiprocessing.Pipe(duplex=False)
+
+    def send(self, arrays: Arrays, objects: Objects):
+        for name, array in arrays.items():
+            np.save(os.path.join(self.directory, f"{name}.npy"), array, allow_pickle=False)
+        self._sender.send(("ok", list(arrays), objects))
+
+    def send_exception(self):
+        self._sender.send(("error", traceback.format_exc(), None))
+
+    def receive(self, process: multiprocessing.Process) -> Tuple[Arrays, Objects]:
+        """ blocks until the child sent something or died, arrays are memory-mapped """
+        wait([self._receiver, process.sentinel])
+        if not self._receiver.poll():
+            process.join()
+            raise BenchmarkSubprocessError(f"benchmark process died with exit code {process.exitcode}")
+        status, names, objects = self._receiver.recv()
+        if status == "error":
+            raise BenchmarkSubprocessError(names)
+        # Note: the mappings stay valid after close() removed the files
+        return {name: np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r") for name in names}, objects
+
+    def close(self):
+        self._receiver.close()
+        self._sender.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class IsolatedRun:
+    """ target running in a subprocess, result() returns its (arrays, objects), see run_isolated """
+
+    def __init__(self, target: Callable[..., Tuple[Arrays, Objects]], *args, **kwargs):
+        self.channel = ResultChannel()
+        channel = self.channel
+
+        def execute(*ar, **kw):
+            try:
+                channel.send(*target(*ar, **kw))
+            except BaseException:
+                channel.send_exception()
+                os._exit(1)
+
+        self.process = multiprocessing.Process(target=execute, args=args, kwargs=kwargs)
+        self.process.start()
+
+    @property
+    def waitables(self) -> list:
+        """ ready (see multiprocessing.connection.wait) once the result is sent or the process died """
+        return [self.channel._receiver, self.process.sentinel]
+
+    def result(self) -> Tuple[Arrays, Objects]:
+        try:
+            result = self.channel.receive(self.process)
+            self.process.join()
+            return result
+        finally:
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.channel.close()
+
+
+def run_isolated(target: Callable[..., Tuple[Arrays, Objects]], *args, **kwargs) -> Tuple[Arrays, Objects]:
+    """ runs target in a subprocess and returns its (arrays, objects), exceptions of the child are re-raised """
+    return IsolatedRun(target, *args, **kwargs).result()
+
+
+"""
+ENCODING
+"""
+
+
+def _put(arrays: Arrays, objects: Objects, name, values):
+    """ values as array if they form one (numbers, strings, equally shaped arrays), else as object list """
+    try:
+        array = np.asarray(values)
+    except ValueError:  # Note: ragged
+        array = None
+    if array is not None and array.dtype != object:
+        arrays[name] = array
+    else:
+        objects[name] = list(values)
+
+
+def _get(arrays: Arrays, objects: Objects, name) -> List:
+    """ values stored by _put, 1d arrays as python scalars, others as rows of an in-memory copy """
+    if name in objects:
+        return objects[name]
+    array = np.array(arrays[name])
+    return array.tolist() if array.ndim == 1 else list(array)
+
+
+def encode_camera_mapping(camera_mapping: Dict, prefix="cameras") -> Tuple[Arrays, Objects]:
+    arrays, objects = {}, {}
+    cameras = list(camera_mapping.values())
+    poses = [c.camera_pose for c in cameras]
+    _put(arrays, objects, f"{prefix}.keys", list(camera_mapping.keys()))
+    arrays[f"{prefix}.rotations"] = Rotation.concatenate([p.rotation for p in poses]).as_matrix() if poses else \
+        np.zeros((0, 3, 3))
+    arrays[f"{prefix}.translations"] = np.array([p.translation for p in poses], dtype=float).reshape((-1, 3))
+    _put(arrays, objects, f"{prefix}.identifiers", [p.identifier for p in poses])
+    _put(arrays, objects, f"{prefix}.coordinate_systems", [p.coordinate_system.value for p in poses])
+    _put(arrays, objects, f"{prefix}.directions", [p.direction.value for p in poses])
+    _put(arrays, objects, f"{prefix}.widths", [c.width for c in cameras])
+    _put(arrays, objects, f"{prefix}.heights", [c.height for c in cameras])
+    intrinsics = [c.camera_intrinsics for c in cameras]
+    if all(i is not None and i.camera_intrinsics_matrix is not None and
+           None not in (i.focal_length, i.skew_factor, i.center_x, i.center_y) for i in intrinsics):
+        arrays[f"{prefix}.intrinsics"] = np.array([i.camera_intrinsics_matrix for i in intrinsics],
+                                                  dtype=float).reshape((-1, 3, 3))
+        # Note: focal lengths are a float or an (fx, fy) tuple, the flag restores which one
+        arrays[f"{prefix}.focal_lengths"] = np.array([np.broadcast_to(i.focal_length, 2) for i in intrinsics],
+                                                     dtype=float).reshape((-1, 2))
+        arrays[f"{prefix}.focal_length_pairs"] = np.array(
+            [isinstance(i.focal_length, (tuple, list, np.ndarray)) for i in intrinsics], dtype=bool)
+        arrays[f"{prefix}.principal_points_skews"] = np.array(
+            [(i.center_x, i.center_y, i.skew_factor) for i in intrinsics], dtype=float).reshape((-1, 3))
+    else:
+        objects[f"{prefix}.intrinsics"] = intrinsics
+    return arrays, objects
+
+
+def _decode_intrinsics(arrays: Arrays, objects: Objects, prefix) -> List[CameraIntrinsics]:
+    if f"{prefix}.intrinsics" in objects:
+        return objects[f"{prefix}.intrinsics"]
+    focal_lengths = np.array(arrays[f"{prefix}.focal_lengths"]).tolist()
+    principal_points_skews = np.array(arrays[f"{prefix}.principal_points_skews"]).tolist()
+    return [CameraIntrinsics(camera_intrinsics_matrix=matrix,
+                             focal_length=tuple(focal_length) if pair else focal_length[0],
+                             skew_factor=skew,
+                             center_x=center_x,
+                             center_y=center_y)
+            for matrix, focal_length, pair, (center_x, center_y, skew) in
+            zip(np.array(arrays[f"{prefix}.intrinsics"]), focal_lengths,
+                arrays[f"{prefix}.focal_length_pairs"].tolist(), principal_points_skews)]
+
+
+def decode_camera_mapping(arrays: Arrays, objects: Objects, prefix="cameras") -> Dict:
+    keys = _get(arrays, objects, f"{prefix}.keys")
+    rotations = Rotation.from_matrix(np.array(arrays[f"{prefix}.rotations"])) if len(keys) else []
+    translations = np.array(arrays[f"{prefix}.translations"])
+    columns = zip(keys, _get(arrays, objects, f"{prefix}.identifiers"),
+                  _get(arrays, objects, f"{prefix}.coordinate_systems"),
+                  _get(arrays, objects, f"{prefix}.directions"),
+                  _get(arrays, objects, f"{prefix}.widths"),
+                  _get(arrays, objects, f"{prefix}.heights"),
+                  _decode_intrinsics(arrays, objects, prefix))
+    camera_mapping = {}
+    for index, (key, identifier, coordinate_system, direction, width, height, intrinsics) in enumerate(columns):
+        camera_mapping[key] = Camera(
+            camera_pose=CameraPose(rotation=rotations[index],
+                                   translation=translations[index],
+                                   identifier=identifier,
+                                   coordinate_system=CoordinateSystem(coordinate_system),
+                                   direction=TransformationDirection(direction)),
+            camera_intrinsics=intrinsics,
+            width=width,
+            height=height,
+        )
+    return camera_mapping
+
+
+def encode_point_mapping(point_mapping: Dict[object, Point3D], prefix="points") -> Tuple[Arrays, Objects]:
+    arrays, objects = {}, {}
+    points = list(point_mapping.values())
+    _put(arrays, objects, f"{prefix}.keys", list(point_mapping.keys()))
+    _put(arrays, objects, f"{prefix}.identifiers", [p.identifier for p in points])
+    arrays[f"{prefix}.xyz"] = np.array([(p.x, p.y, p.z) for p in points], dtype=float).reshape((-1, 3))
+
+    metadata_keys = list(points[0].metadata) if points else []
+    if all(list(p.metadata) == metadata_keys for p in points):  # Note: one column per metadata key
+        objects[f"{prefix}.metadata_keys"] = metadata_keys
+        for key in metadata_keys:
+            _put(arrays, objects, f"{prefix}.metadata.{key}", [p.metadata[key] for p in points])
+    else:
+        objects[f"{prefix}.metadata"] = [p.metadata for p in points]
+    return arrays, objects
+
+
+def decode_point_mapping(arrays: Arrays, objects: Objects, prefix="points") -> Dict[object, Point3D]:
+    keys = _get(arrays, objects, f"{prefix}.keys")
+    xyz = np.array(arrays[f"{prefix}.xyz"]).tolist()
+    if f"{prefix}.metadata" in objects:
+        metadata = objects[f"{prefix}.metadata"]
+    else:
+        metadata_keys = objects[f"{prefix}.metadata_keys"]
+        columns = [_get(arrays, objects, f"{prefix}.metadata.{key}") for key in metadata_keys]
+        metadata = [dict(zip(metadata_keys, values)) for values in zip(*columns)] if columns else \
+            [{} for _ in keys]
+    return {
+        key: Point3D(identifier, x, y, z, m)
+        for key, identifier, (x, y, z), m in zip(keys, _get(arrays, objects, f"{prefix}.identifiers"), xyz, metadata)
+    }
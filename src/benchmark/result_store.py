@@ -0,0 +1,218 @@
+import hashlib
+import importlib
+import json
+import os
+import pickle
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+from src.benchmark.benchmark import (Benchmark, BundleAdjustmentBenchmark,
+                                     BundleAdjustmentBenchmarkResults,
+                                     SinglePoseBenchmarkResults,
+                                     scalar_attributes)
+from src.benchmark.result_channel import (Arrays, LazyMapping, Objects,
+                                          decode_camera_mapping,
+                                          decode_point_mapping,
+                                          encode_camera_mapping,
+                                          encode_point_mapping)
+from src.dataset.dataset import Dataset
+
+RUNS_FILE = "runs.jsonl"
+ARRAYS_FOLDER = "arrays"
+OBJECTS_FILE = "objects.pkl"
+
+
+def dataset_hash(dataset: Dataset) -> str:
+    """ sha1 of the observations, the 3d points and the cameras of the dataset (not of the images) """
+    table = dataset.observation_table()
+    sha = hashlib.sha1()
+    for array in (table.point3d_ids, table.point2d_indices, table.offsets, table.xy, table.xyz,
+                  np.array([p.identifier for p in dataset.points3D], dtype=np.int64)):
+        sha.update(np.ascontiguousarray(array).tobytes())
+    for de in dataset.datasetEntries:
+        pose = de.camera.camera_pose
+        sha.update(str(pose.identifier).encode())
+        sha.update(np.ascontiguousarray(pose.rotation_translation_matrix).tobytes())
+        if de.camera.camera_intrinsics is not None:
+            sha.update(np.asarray(de.camera.camera_intrinsics.camera_intrinsics_matrix, dtype=float).tobytes())
+    return sha.hexdigest()
+
+
+def _to_json(o):
+    """ json default: numpy (and jax) arrays and scalars as lists / numbers, everything else as repr """
+    if isinstance(o, np.generic) or hasattr(o, "__array__"):
+        return np.asarray(o).tolist()
+    return repr(o)
+
+
+def _scalar_attributes(benchmark: Benchmark) -> Dict:
+    return {k: v for k, v in scalar_attributes(benchmark).items() if k not in ("memory", "trace", "repetitions")}
+
+
+def encode_benchmark(benchmark: Benchmark) -> Tuple[Arrays, Objects, Dict]:
+    """ (result columns, small result objects, run metadata) of a finished benchmark """
+    results = benchmark.results
+    arrays, objects = encode_camera_mapping(results.camera_mapping)
+    if isinstance(results, BundleAdjustmentBenchmarkResults):
+        point_arrays, point_objects = encode_point_mapping(results.point_mapping)
+        arrays, objects = {**arrays, **point_arrays}, {**objects, **point_objects}
+    metadata = {
+        "benchmark_class": f"{benchmark.__class__.__module__}.{benchmark.__class__.__qualname__}",
+        "name": benchmark.NAME,
+        "framework": benchmark.FRAMEWORK,
+        "dataset": benchmark.dataset.name,
+        "dataset_hash": dataset_hash(benchmark.dataset),
+        "args_kwargs": benchmark.benchmark_args_kwargs,
+        "attributes": _scalar_attributes(benchmark),
+        "time": benchmark.time,
+        "single_times": getattr(benchmark, "_single_times", None),
+        "measured_times": getattr(benchmark, "measured_times", None),
+        "iterations": benchmark.iterations,
+        "memory": getattr(benchmark, "memory", None),
+        "trace": getattr(benchmark, "trace", None),
+        "repetitions": getattr(benchmark, "repetitions", None),
+    }
+    return arrays, objects, metadata
+
+
+@dataclass
+class StoredRun:
+    """ one benchmark run of a ResultStore: its metadata line and lazily memory-mapped result columns """
+    store_path: str
+    metadata: Dict
+
+    @property
+    def run_id(self) -> str:
+        return self.metadata["run_id"]
+
+    @property
+    def framework(self) -> str:
+        return self.metadata["framework"]
+
+    @property
+    def dataset_hash(self) -> str:
+        return self.metadata["dataset_hash"]
+
+    @property
+    def columns(self) -> List[str]:
+        return self.metadata["columns"]
+
+    @property
+    def _arrays_path(self):
+        return os.path.join(self.store_path, ARRAYS_FOLDER, self.run_id)
+
+    def column(self, name) -> np.ndarray:
+        """ memory-mapped, nothing but the column is read """
+        return np.load(os.path.join(self._arrays_path, f"{name}.npy"), mmap_mode="r")
+
+    def _objects(self) -> Dict:
+        objects = dict(self.metadata["objects"])
+        if self.metadata["pickled_objects"]:
+            with open(os.path.join(self._arrays_path, OBJECTS_FILE), "rb") as f:
+                objects.update(pickle.load(f))
+        return objects
+
+    def to_benchmark(self, dataset: Dataset) -> Benchmark:
+        """ instance of the stored benchmark class on dataset, results are decoded from the columns on access """
+        if dataset_hash(dataset) != self.dataset_hash:
+            raise ValueError(f"dataset {dataset.name} does not match run {self.run_id} ({self.metadata['dataset']})")
+        module_name, class_name = self.metadata["benchmark_class"].rsplit(".", 1)
+        benchmark = getattr(importlib.import_module(module_name), class_name)(dataset)
+
+        arrays = LazyMapping(lambda: {name: self.column(name) for name in self.columns})
+        camera_mapping = LazyMapping(lambda: decode_camera_mapping(arrays, self._objects()))
+        if isinstance(benchmark, BundleAdjustmentBenchmark):
+            benchmark._results = BundleAdjustmentBenchmarkResults(
+                camera_mapping=camera_mapping,
+                point_mapping=LazyMapping(lambda: decode_point_mapping(arrays, self._objects())),
+            )
+        else:
+            benchmark._results = SinglePoseBenchmarkResults(camera_mapping=camera_mapping)
+            benchmark._single_times = self.metadata["single_times"]
+            benchmark.measured_times = self.metadata.get("measured_times")
+        benchmark._time, benchmark._iterations = self.metadata["time"], self.metadata["iterations"]
+        benchmark.benchmark_args_kwargs = tuple(self.metadata["args_kwargs"])
+        benchmark.memory, benchmark.trace = self.metadata.get("memory"), self.metadata.get("trace")
+        benchmark.repetitions = self.metadata.get("repetitions")
+        for k, v in self.metadata["attributes"].items():
+            setattr(benchmark, k, v)
+        return benchmark
+
+
+class ResultStore:
+    """
+    Benchmark runs in one folder: runs.jsonl holds one line of metadata per run (framework, dataset hash, kwargs,
+    timings, iterations, ...), the resulting cameras / points are .npy columns in arrays/<run id>/.
+    The dataset is not stored, runs reference it by dataset_hash.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def _runs_file(self):
+        return os.path.join(self.path, RUNS_FILE)
+
+    def add(self, benchmark: Benchmark, session=None, latest=True, **extra) -> StoredRun:
+        """ extra: additional metadata entries of the run """
+        arrays, objects, metadata = encode_benchmark(benchmark)
+        return self.add_encoded(arrays, objects, {**metadata, **extra}, session=session, latest=latest)
+
+    def add_encoded(self, arrays, objects, metadata, session=None, latest=True) -> StoredRun:
+        """ adds the output of encode_benchmark (e.g. sent by a worker process) """
+        run_id = str(uuid4())
+        arrays_path = os.path.join(self.path, ARRAYS_FOLDER, run_id)
+        os.makedirs(arrays_path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(arrays_path, f"{name}.npy"), array, allow_pickle=False)
+        # Note: whatever did not fit into a column (rare, e.g. irregular metadata) is pickled next to the columns
+        json_objects = {}
+        pickled_objects = {}
+        for k, v in objects.items():
+            try:
+                json_objects[k] = json.loads(json.dumps(v))
+            except (TypeError, ValueError):
+                pickled_objects[k] = v
+        if pickled_objects:
+            with open(os.path.join(arrays_path, OBJECTS_FILE), "wb") as f:
+                pickle.dump(pickled_objects, f)
+
+        metadata = json.loads(json.dumps({
+            "run_id": run_id,
+            "session": session or datetime.now().strftime("%Y-%m-%dT%H-%M-%S"),
+            "latest": latest,
+            **metadata,
+            "columns": list(arrays),
+            "objects": json_objects,
+            "pickled_objects": bool(pickled_objects),
+        }, default=_to_json))
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._runs_file, "a") as f:
+            f.write(json.dumps(metadata) + "\n")
+        return StoredRun(self.path, metadata)
+
+    def runs(self, **filters) -> List[StoredRun]:
+        """ all runs in insertion order, filters compare metadata entries, e.g. runs(framework="Colmap") """
+        if not os.path.exists(self._runs_file):
+            return []
+        with open(self._runs_file) as f:
+            runs = [StoredRun(self.path, json.loads(line)) for line in f if line.strip()]
+        return [r for r in runs if all(r.metadata.get(k) == v for k, v in filters.items())]
+
+    def latest_runs(self, **filters) -> List[StoredRun]:
+        """ runs of the newest session added with latest=True """
+        runs = self.runs(latest=True, **filters)
+        if not runs:
+            return []
+        session = max(r.metadata["session"] for r in runs)
+        return [r for r in runs if r.metadata["session"] == session]
+
+    def load_benchmarks(self, datasets: Iterable[Dataset], runs: List[StoredRun] = None) -> List[Benchmark]:
+        """ benchmarks of runs (default: latest_runs) on whichever of the datasets has the run's dataset hash """
+        datasets_by_hash = {dataset_hash(d): d for d in datasets}
+        return [r.to_benchmark(datasets_by_hash[r.dataset_hash])
+                for r in (self.latest_runs() if runs is None else runs) if r.dataset_hash in datasets_by_hash]
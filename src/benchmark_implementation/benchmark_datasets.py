@@ -4,6 +4,7 @@ from dataclasses import dataclass
 from functools import partial
 
 from src.config import DATASETS_PATH
+from src.dataset.loaders.bal_dataset_loader.loader import load_bal_problem
 from src.dataset.loaders.colmap_dataset_loader.loader import load_colmap_dataset
 
 
@@ -39,6 +40,14 @@ ST_PETERS_SQUARE_SPARSE_NOISED = os.path.join(
 )
 ST_PETERS_SQUARE_IMAGES = os.path.join(DATASETS_PATH, "st_peters_square/images")
 
+# Note: "Bundle Adjustment in the Large" problems, expected to be downloaded into datasets/bal beforehand
+BAL_PATH = os.path.join(DATASETS_PATH, "bal")
+BAL_LADYBUG = os.path.join(BAL_PATH, "problem-49-7776-pre.txt.bz2")
+BAL_TRAFALGAR = os.path.join(BAL_PATH, "problem-257-65132-pre.txt.bz2")
+BAL_DUBROVNIK = os.path.join(BAL_PATH, "problem-356-226730-pre.txt.bz2")
+BAL_VENICE = os.path.join(BAL_PATH, "problem-1778-993923-pre.txt.bz2")
+BAL_FINAL = os.path.join(BAL_PATH, "problem-13682-4456117-pre.txt.bz2")
+
 """ Dataset Config Definitions """
 REICHSTAG_NOISED_CONFIG = DatasetConfig(
     sparse_folder=REICHSTAG_SPARSE_NOISED,
@@ -78,3 +87,9 @@ REICHSTAG_NOISED_LOADER = partial_loader(**REICHSTAG_NOISED_CONFIG)
 REICHSTAG_GT_LOADER = partial_loader(**REICHSTAG_GT_CONFIG)
 SACRE_COEUR_NOISED_LOADER = partial_loader(**SACRE_COEUR_NOISED_CONFIG)
 ST_PETERS_SQUARE_NOISED_LOADER = partial_loader(**ST_PETERS_NOISED_CONFIG)
+
+BAL_LADYBUG_LOADER = partial(load_bal_problem, BAL_LADYBUG, name="Ladybug")
+BAL_TRAFALGAR_LOADER = partial(load_bal_problem, BAL_TRAFALGAR, name="Trafalgar")
+BAL_DUBROVNIK_LOADER = partial(load_bal_problem, BAL_DUBROVNIK, name="Dubrovnik")
+BAL_VENICE_LOADER = partial(load_bal_problem, BAL_VENICE, name="Venice")
+BAL_FINAL_LOADER = partial(load_bal_problem, BAL_FINAL, name="Final")
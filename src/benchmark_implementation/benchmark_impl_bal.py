@@ -0,0 +1,197 @@
+"""
+Scaling tier on "Bundle Adjustment in the Large" problems: every solver runs on a ladder of growing
+sub problems, each run in its own (spawned) process so that time, peak memory and crashes are isolated
+"""
+import json
+import multiprocessing
+import os
+import resource
+import time
+import traceback
+from datetime import datetime
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from src.benchmark_implementation.benchmark_datasets import (
+    BAL_DUBROVNIK_LOADER,
+    BAL_FINAL_LOADER,
+    BAL_LADYBUG_LOADER,
+    BAL_TRAFALGAR_LOADER,
+    BAL_VENICE_LOADER,
+)
+from src.config import BENCHMARK_BAL_RESULTS_PATH
+from src.dataset.bundle_adjustment_problem import BundleAdjustmentProblem
+
+CAMERA_LADDER = [16, 64, 256, 1024, 4096, None]  # Note: None == full problem
+
+
+def _run_jax(problem: BundleAdjustmentProblem):
+    import jax
+
+    from src.reconstruction.bundle_adjustment.bundle_adjustment import JaxBundleAdjustment
+    from src.reconstruction.bundle_adjustment.utils import pad_observations, to_gpu
+
+    points_2d_all, p3d_indices_all, masks_all = pad_observations(
+        problem.camera_indices, problem.point_indices, problem.points_2d, problem.num_cameras
+    )
+    optimizer = JaxBundleAdjustment(problem.num_cameras, problem.avg_cam_width)
+    opt_params, cx_cy_skew = optimizer.prepare_params(problem.poses, problem.intrinsics_params, problem.points_3d)
+
+    start = time.perf_counter()
+    optimizer.compile(problem.num_points, points_2d_all.shape[1])
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    params, state = optimizer.optimize(
+        to_gpu(opt_params), to_gpu(points_2d_all), to_gpu(p3d_indices_all), to_gpu(cx_cy_skew), to_gpu(masks_all)
+    )
+    total_time = time.perf_counter() - start
+
+    params = np.array(params)
+    num_cams = problem.num_cameras
+    pose_vecs = params[: num_cams * 6].reshape((num_cams, 6))
+    poses = np.concatenate(
+        [Rotation.from_rotvec(pose_vecs[:, :3]).as_matrix(), pose_vecs[:, 3:, np.newaxis]], axis=2
+    )
+    intrinsics = problem.intrinsics.copy()
+    intrinsics[:, 0, 0], intrinsics[:, 1, 1] = params[num_cams * 6: num_cams * 8].reshape((num_cams, 2)).T
+    points_3d = params[num_cams * 8:].reshape((-1, 3))
+
+    memory_stats = jax.devices()[0].memory_stats() or {}
+    return problem.with_parameters(poses, intrinsics, points_3d), {
+        "time": total_time,
+        "compile_time": compile_time,
+        "iterations": int(state.iter_num),
+        "peak_device_memory_mb": memory_stats.get("peak_bytes_in_use", 0) / 2 ** 20 or None,
+    }
+
+
+def _run_colmap(problem: BundleAdjustmentProblem):
+    from src.benchmark.colmap_benchmark.bundle_adjuster import (
+        run_bundle_adjuster, scratch_directory)
+    from src.dataset.loaders.colmap_dataset_loader.cameras import read_cameras_bin
+    from src.dataset.loaders.colmap_dataset_loader.images import read_images_bin
+    from src.dataset.loaders.colmap_dataset_loader.points import read_points3d_bin
+
+    with scratch_directory() as tmp:
+        input_path, output_path = os.path.join(tmp, "input"), os.path.join(tmp, "output")
+        problem.export_in_colmap_format(input_path)
+        run = run_bundle_adjuster(input_path, output_path)
+        report, measured_time = run.report, run.measured_time
+
+        images = read_images_bin(os.path.join(output_path, "images.bin"))
+        cameras = read_cameras_bin(os.path.join(output_path, "cameras.bin"))
+        points, _ = read_points3d_bin(os.path.join(output_path, "points3D.bin"))
+
+    # Note: exported ids are index + 1
+    image_information = [images[i + 1].image_information for i in range(problem.num_cameras)]
+    wxyz = np.array([[i.qw, i.qx, i.qy, i.qz] for i in image_information])
+    poses = np.concatenate([
+        Rotation.from_quat(wxyz[:, [1, 2, 3, 0]]).as_matrix(),
+        np.array([[i.tx, i.ty, i.tz] for i in image_information])[..., np.newaxis],
+    ], axis=2)
+    intrinsics = problem.intrinsics.copy()
+    intrinsics[:, 0, 0], intrinsics[:, 1, 1] = np.array(
+        [cameras[i.camera_id].params[:2] for i in image_information]
+    ).T
+    points_3d = problem.points_3d.copy()
+    for identifier, point in points.items():
+        pi = point.point_information
+        points_3d[identifier - 1] = pi.x, pi.y, pi.z
+
+    return problem.with_parameters(poses, intrinsics, points_3d), {
+        "time": report.time,
+        "measured_time": measured_time,
+        "iterations": report.iterations,
+        "colmap_final_cost": report.final_cost,
+    }
+
+
+FRAMEWORKS = {"JAX": _run_jax, "Colmap": _run_colmap}
+
+
+def _peak_rss_mb(who):
+    return resource.getrusage(who).ru_maxrss / 1024  # Note: kilobytes on linux
+
+
+def _isolated_run(framework, problem, connection):
+    try:
+        result_problem, result = FRAMEWORKS[framework](problem)
+        result["final_cost"] = result_problem.cost()
+        result["peak_memory_mb"] = max(_peak_rss_mb(resource.RUSAGE_SELF), _peak_rss_mb(resource.RUSAGE_CHILDREN))
+        connection.send(result)
+    except BaseException:
+        connection.send({"error": traceback.format_exc()})
+    finally:
+        connection.close()
+
+
+def run_isolated(framework, problem: BundleAdjustmentProblem):
+    """ runs one solver on one problem in a fresh process, returns the measured record """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    p = context.Process(target=_isolated_run, args=(framework, problem, sender))
+    p.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:  # Note: killed without sending, e.g. by the oom killer
+        result = None
+    p.join()
+    if result is None:
+        result = {"error": f"worker died with exit code {p.exitcode}"}
+    return result
+
+
+def benchmark_bal(problem: BundleAdjustmentProblem, frameworks=("JAX", "Colmap"), camera_ladder=CAMERA_LADDER,
+                  results_file=None, verbose=True):
+    records = []
+    failed = set()
+    for camera_limit in camera_ladder:
+        sub_problem = problem.subproblem(camera_limit)
+        for framework in frameworks:
+            if framework in failed:  # Note: bigger problems will not succeed either
+                continue
+            record = {
+                "dataset": problem.name,
+                "framework": framework,
+                "num_cameras": sub_problem.num_cameras,
+                "num_points": sub_problem.num_points,
+                "num_observations": sub_problem.num_observations,
+                "initial_cost": sub_problem.cost(),
+                **run_isolated(framework, sub_problem),
+            }
+            if "error" in record:
+                failed.add(framework)
+            if verbose:
+                print({k: v for k, v in record.items() if k != "error"}, record.get("error", ""))
+            if results_file:
+                with open(results_file, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            records.append(record)
+        if camera_limit is None or camera_limit >= problem.num_cameras:
+            break
+    return records
+
+
+if __name__ == "__main__":
+    bal_loaders = [
+        BAL_LADYBUG_LOADER,
+        BAL_TRAFALGAR_LOADER,
+        BAL_DUBROVNIK_LOADER,
+        BAL_VENICE_LOADER,
+        BAL_FINAL_LOADER,
+    ]
+    os.makedirs(BENCHMARK_BAL_RESULTS_PATH, exist_ok=True)
+    results_file = os.path.join(
+        BENCHMARK_BAL_RESULTS_PATH, f"{datetime.now().strftime('%Y-%m-%dT%H-%M-%S')}.jsonl"
+    )
+    for loader in bal_loaders:
+        if not os.path.exists(loader.args[0]):
+            print(f"Skipping {loader.args[0]} (not found)")
+            continue
+        bal_problem = loader()
+        print(f"Benchmarking {bal_problem}")
+        benchmark_bal(bal_problem, results_file=results_file)
+        del bal_problem
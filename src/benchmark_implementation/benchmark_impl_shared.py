@@ -1,33 +1,15 @@
-import contextlib
-import copy
-import os
-import shutil
 from datetime import datetime
-from pathlib import Path
 from typing import List
 
 from src.benchmark.benchmark import Benchmark
+from src.benchmark.result_store import ResultStore
 
 
 def save_benchmarks(
     list_of_benchmarks: List[Benchmark], parent_dir, override_latest=True
 ):
+    """ adds the benchmarks as one session to the result store in parent_dir (see ResultStore.latest_runs) """
     current_time_formatted = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
-    benchmarks_path = os.path.join(parent_dir, current_time_formatted)
-    latest_path = os.path.join(parent_dir, "latest")
-
-    os.makedirs(benchmarks_path, exist_ok=True)
+    store = ResultStore(parent_dir)
     for b in list_of_benchmarks:
-        # Note: Default filename can lead to overrides e.g. when same benchmark class twice
-        if hasattr(b, "optimizer"):  # Hack
-            b_copy = copy.copy(b)
-            setattr(b_copy, "optimizer", None)
-            b = b_copy
-
-        f = b.export_pickle(benchmarks_path)
-        if override_latest:
-            os.makedirs(latest_path, exist_ok=True)
-            path_in_latest = os.path.join(latest_path, str(Path(f).name))
-            with contextlib.suppress(FileNotFoundError):
-                os.remove(path_in_latest)
-            shutil.copy(f, path_in_latest)
+        store.add(b, session=current_time_formatted, latest=override_latest)
@@ -0,0 +1,346 @@
+"""
+Performance regression gate: runs a fixed suite of the jaxopt benchmarks on synthetic scenes and compares time,
+compile time, peak memory and iterations with the baseline runs in the result store. Every metric is a median over
+several samples (repetitions, fresh processes), a regression has to exceed a threshold, a noise floor and the
+confidence interval of the baseline.
+
+    python -m src.benchmark_implementation.benchmark_regression --update-baseline  # e.g. before upgrading jax
+    python -m src.benchmark_implementation.benchmark_regression                    # exit code 1 on a regression
+
+Runs on cpu by default (--platform), the baseline has to be recorded on the same machine and platform.
+"""
+import argparse
+import importlib
+import os
+import platform
+import sys
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from importlib import metadata as importlib_metadata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.benchmark.benchmark import Benchmark
+from src.benchmark.repetitions import (TimingStatistics, min_samples,
+                                       repetition_statistics)
+from src.benchmark.result_store import ResultStore, StoredRun
+from src.config import BENCHMARK_REGRESSION_RESULTS_PATH, JAX_PLATFORM_NAME
+from src.dataset.dataset import Dataset
+from src.dataset.synthetic import SyntheticSceneConfig, generate_synthetic_problem
+
+BENCHMARKS = {
+    "pose": "src.benchmark.jaxopt_benchmark.benchmark_pose_optimization.JaxoptSinglePoseBenchmarkBatched",
+    "bundle_adjustment": "src.benchmark.jaxopt_benchmark.benchmark_bundle_adjustment.JaxoptBundleAdjustmentBenchmark",
+}
+PACKAGES = ["jax", "jaxlib", "jaxopt", "numpy", "scipy"]
+SIZES = {  # Note: cameras, points, observations per camera; small enough for a cpu
+    "small": (8, 1_000, 200),
+    "medium": (32, 5_000, 500),
+    "large": (64, 20_000, 1_000),
+}
+
+
+@dataclass(frozen=True)
+class RegressionCase:
+    benchmark: str  # key of BENCHMARKS
+    size: str  # key of SIZES
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.benchmark}_{self.size}"
+
+    def dataset(self) -> Dataset:
+        num_cameras, num_points, observations_per_camera = SIZES[self.size]
+        problem = generate_synthetic_problem(SyntheticSceneConfig(
+            num_cameras=num_cameras, num_points=num_points, observations_per_camera=observations_per_camera,
+            seed=self.seed, name=f"Synthetic {self.size}",
+        ))
+        return problem.with_noise(seed=self.seed).to_dataset()
+
+    def benchmark_kwargs(self, dataset: Dataset) -> Dict:
+        if self.benchmark == "bundle_adjustment":
+            return {"camera_limit": len(dataset.datasetEntries), "points_limit": len(dataset.points3D),
+                    "verbose": False}
+        return {"batch_size": 1, "verbose": False}
+
+
+SUITE = [RegressionCase(benchmark, size) for benchmark in BENCHMARKS for size in SIZES]
+
+
+@dataclass
+class Thresholds:
+    """
+    A metric regresses if its median rose by more than the relative threshold (0.1 == 10 %), by more than the
+    absolute noise floor and the confidence intervals of the baseline and current medians do not overlap
+    (intervals falling short of the requested confidence, i.e. too few samples, never count as regression).
+    """
+    time: float = 0.10
+    compile: float = 0.25
+    memory: float = 0.10
+    iterations: float = 0.0
+    time_floor: float = 1e-3  # seconds
+    compile_floor: float = 0.05  # seconds
+    memory_floor: float = 16 * 2 ** 20  # bytes
+    iterations_floor: float = 0.0
+
+    def of(self, metric) -> Tuple[float, float]:
+        """ (relative threshold, noise floor) of a metric """
+        name = "memory" if metric in ("rss_peak", "device_peak") else metric
+        return getattr(self, name), getattr(self, f"{name}_floor")
+
+
+METRICS = ["time", "compile", "rss_peak", "device_peak", "iterations"]
+CONFIDENCE = 0.95  # Note: of the median confidence intervals, needs at least min_samples(CONFIDENCE) == 6 samples
+
+
+@dataclass
+class MetricComparison:
+    case: str
+    metric: str
+    baseline: Optional[float]  # medians
+    current: Optional[float]
+    threshold: float
+    significant: bool  # Note: confidence intervals apart and the difference above the noise floor
+    too_few_samples: bool = False  # Note: the intervals do not reach the confidence, nothing is concluded
+
+    @property
+    def change(self) -> Optional[float]:
+        if self.baseline is None or self.current is None or self.baseline == 0:
+            return None
+        return self.current / self.baseline - 1
+
+    @property
+    def regressed(self) -> bool:
+        return self.change is not None and self.change > self.threshold and self.significant \
+            and not self.too_few_samples
+
+    @property
+    def status(self) -> str:
+        if self.change is None:
+            return "n/a"
+        if self.too_few_samples:
+            return "n/a (too few samples)"
+        if self.regressed:
+            return "REGRESSED"
+        return "improved" if self.change < -self.threshold and self.significant else "ok"
+
+
+def environment() -> Dict:
+    """ versions the timings depend on, a baseline is comparable if they match """
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = importlib_metadata.version(package)
+        except importlib_metadata.PackageNotFoundError:
+            versions[package] = None
+    return {"packages": versions, "python": platform.python_version(), "machine": platform.machine(),
+            "processor": platform.processor(), "cpu_count": os.cpu_count(),
+            "jax_platform": os.environ.get("JAX_PLATFORM_NAME", JAX_PLATFORM_NAME)}
+
+
+def environment_changes(baseline_environment: Optional[Dict], current_environment: Optional[Dict]) -> List[str]:
+    if not baseline_environment or not current_environment:
+        return []
+    changes = []
+    for key in sorted(set(baseline_environment) | set(current_environment)):
+        b, c = baseline_environment.get(key), current_environment.get(key)
+        if key == "packages":
+            changes += [f"{package} {(b or {}).get(package)} -> {(c or {}).get(package)}" for package in PACKAGES
+                        if (b or {}).get(package) != (c or {}).get(package)]
+        elif b != c:
+            changes.append(f"{key} {b} -> {c}")
+    return changes
+
+
+def _statistics(samples, confidence) -> Optional[Dict]:
+    return asdict(TimingStatistics.from_samples(samples, confidence)) if len(samples) else None
+
+
+def regression_metrics(timed: Benchmark, fresh: List[Benchmark], confidence=CONFIDENCE) -> Dict[str, Optional[Dict]]:
+    """
+    json compatible TimingStatistics per metric. time: steady state of the repeated run (timed),
+    compile / memory / iterations: one sample per fresh process, memory is the peak above the rss at benchmark start
+    (a forked process starts with the pages of the parent)
+    """
+    memories = [b.memory for b in fresh if b.memory]
+    device_peaks = [m["device_peak"] for m in memories]
+    return {
+        "time": timed.repetitions["steady_state"],
+        "compile": _statistics([b.compile_time for b in fresh if b.compile_time is not None], confidence),
+        "rss_peak": _statistics([m["rss_peak"] - m["rss_start"] for m in memories], confidence),
+        "device_peak": _statistics(device_peaks, confidence) if any(device_peaks) else None,  # Note: 0 on cpu
+        "iterations": _statistics([float(np.sum(b.iterations)) for b in [timed, *fresh]], confidence),
+    }
+
+
+def compare(baseline: StoredRun, current: StoredRun, thresholds: Thresholds,
+            confidence=CONFIDENCE) -> List[MetricComparison]:
+    """ metrics whose intervals (of either run) fall short of the confidence are n/a instead of failing the gate """
+    case = current.metadata["regression_case"]
+    comparisons = []
+    for metric in METRICS:
+        threshold, floor = thresholds.of(metric)
+        b, c = (repetition_statistics(run.metadata["regression_metrics"], metric) for run in (baseline, current))
+        if b is None or c is None:
+            comparisons.append(MetricComparison(case, metric, b and b.median, c and c.median, threshold, False))
+            continue
+        comparisons.append(MetricComparison(case, metric, b.median, c.median, threshold,
+                                            significant=not c.overlaps(b) and abs(c.median - b.median) > floor,
+                                            too_few_samples=min(b.confidence, c.confidence) < confidence))
+    return comparisons
+
+
+def _format_value(metric, value) -> str:
+    if value is None:
+        return "-"
+    if metric in ("rss_peak", "device_peak"):
+        return f"{value / 2 ** 20:.1f} MB"
+    if metric == "iterations":
+        return f"{value:.0f}"
+    return f"{value:.4f}s"
+
+
+@dataclass
+class RegressionCheck:
+    comparisons: List[MetricComparison] = field(default_factory=list)
+    environment_changes: List[str] = field(default_factory=list)  # Note: between baselines and current runs
+
+    @property
+    def regressed(self) -> bool:
+        return any(c.regressed for c in self.comparisons)
+
+    def report(self) -> str:
+        lines = [f"{'case':<28}{'metric':<13}{'baseline':>14}{'current':>14}{'change':>10}  status"]
+        for c in self.comparisons:
+            change = f"{c.change:+.1%}" if c.change is not None else "-"
+            lines.append(f"{c.case:<28}{c.metric:<13}{_format_value(c.metric, c.baseline):>14}"
+                         f"{_format_value(c.metric, c.current):>14}{change:>10}  {c.status}")
+        lines += [f"environment: {change}" for change in self.environment_changes]
+        regressions = [c for c in self.comparisons if c.regressed]
+        lines.append(f"{len(regressions)} regression(s)" if regressions else "no regressions")
+        return "\n".join(lines)
+
+
+def _benchmark_class(benchmark):
+    module_name, class_name = BENCHMARKS[benchmark].rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def run_case(case: RegressionCase, store: ResultStore, session: str, baseline: bool, warmup=1, repetitions=6,
+             processes=6, cpu_affinity=None, confidence=CONFIDENCE) -> StoredRun:
+    """
+    Runs the case in subprocesses (see subprocess_benchmark): once repeated for the steady state time (without memory
+    profiling) and once per fresh process for cold compile, memory and iterations. Adds the repeated run to the store.
+    """
+    dataset = case.dataset()
+    kwargs = case.benchmark_kwargs(dataset)
+    benchmark_class = _benchmark_class(case.benchmark)
+    timed = benchmark_class(dataset)
+    timed.subprocess_benchmark("repeat", warmup=warmup, repetitions=repetitions, cpu_affinity=cpu_affinity,
+                               confidence=confidence, **kwargs)
+    fresh = []
+    for _ in range(processes):
+        benchmark = benchmark_class(dataset)
+        benchmark.subprocess_benchmark(memory_profile=True, **kwargs)
+        fresh.append(benchmark)
+    return store.add(timed, session=session, latest=baseline, regression_case=case.name, baseline=baseline,
+                     regression_kwargs=kwargs, regression_metrics=regression_metrics(timed, fresh, confidence),
+                     environment=environment())
+
+
+def latest_baseline(store: ResultStore, case: RegressionCase) -> Optional[StoredRun]:
+    runs = [r for r in store.runs(regression_case=case.name, baseline=True) if "regression_metrics" in r.metadata]
+    return max(runs, key=lambda r: r.metadata["session"]) if runs else None
+
+
+def check_regressions(cases: List[RegressionCase] = None, thresholds: Thresholds = None, update_baseline=False,
+                      store_path=BENCHMARK_REGRESSION_RESULTS_PATH, warmup=1, repetitions=6, processes=6,
+                      cpu_affinity=None, confidence=CONFIDENCE, verbose=True) -> RegressionCheck:
+    """
+    Runs the cases (default: SUITE) and compares them with their latest baseline, update_baseline stores the runs
+    as new baseline instead. Runs are kept in the store either way.
+    """
+    cases = SUITE if cases is None else cases
+    thresholds = thresholds or Thresholds()
+    store = ResultStore(store_path)
+    session = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+    check = RegressionCheck()
+    for case in cases:
+        baseline = None if update_baseline else latest_baseline(store, case)
+        if not update_baseline and baseline is None:
+            print(f"{case.name}: no baseline in {store_path}, run with --update-baseline first")
+            continue
+        if verbose:
+            print(f"Running {case.name}")
+        current = run_case(case, store, session, update_baseline, warmup=warmup, repetitions=repetitions,
+                           processes=processes, cpu_affinity=cpu_affinity, confidence=confidence)
+        if baseline is None:
+            continue
+        if baseline.dataset_hash != current.dataset_hash:
+            print(f"{case.name}: the scene differs from the baseline's, the synthetic generator changed?")
+        check.comparisons += compare(baseline, current, thresholds, confidence)
+        changes = environment_changes(baseline.metadata.get("environment"), current.metadata.get("environment"))
+        check.environment_changes += [c for c in changes if c not in check.environment_changes]
+    return check
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--platform", default="cpu", help="jax platform, default cpu")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--cases", nargs="*", choices=[c.name for c in SUITE], help="default: the whole suite")
+    parser.add_argument("--store", default=BENCHMARK_REGRESSION_RESULTS_PATH, help="result store folder")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repetitions", type=int, default=6, help="of the steady state time")
+    parser.add_argument("--processes", type=int, default=6, help="fresh processes for compile time and memory")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE,
+                        help=f"of the median confidence intervals, default {CONFIDENCE}")
+    parser.add_argument("--cpus", type=int, nargs="*", help="pin the benchmarks to these cpus")
+    parser.add_argument("--report", help="also write the diff report to this file")
+    defaults = Thresholds()
+    for name, value in asdict(defaults).items():
+        if name.endswith("_floor"):
+            parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=value,
+                                help=f"absolute increase below which {name[:-6]} counts as noise, default {value}")
+        else:
+            parser.add_argument(f"--{name}-threshold", type=float, default=value,
+                                help=f"relative increase counting as regression, default {value}")
+    args = parser.parse_args(argv)
+
+    # Note: before the benchmarks import jax, the forked benchmark processes inherit the setting
+    os.environ["JAX_PLATFORM_NAME"] = args.platform
+    for benchmark in BENCHMARKS:
+        _benchmark_class(benchmark)
+    import jax
+    jax.config.update("jax_platform_name", args.platform)
+
+    thresholds = Thresholds(**{name: getattr(args, name if name.endswith("_floor") else f"{name}_threshold")
+                               for name in asdict(defaults)})
+    cases = [c for c in SUITE if not args.cases or c.name in args.cases]
+    without_baseline = [c for c in cases if latest_baseline(ResultStore(args.store), c) is None]
+    if without_baseline and not args.update_baseline:
+        print(f"no baseline for {', '.join(c.name for c in without_baseline)} in {args.store}, "
+              f"record one with --update-baseline")
+        return 2
+    if min(args.repetitions, args.processes) < min_samples(args.confidence):
+        print(f"fewer than {min_samples(args.confidence)} repetitions / processes do not reach a "
+              f"{args.confidence:.0%} confidence, their metrics are reported as n/a")
+    check = check_regressions(cases, thresholds, update_baseline=args.update_baseline, store_path=args.store,
+                              warmup=args.warmup, repetitions=args.repetitions, processes=args.processes,
+                              cpu_affinity=args.cpus, confidence=args.confidence)
+    if args.update_baseline:
+        print(f"baseline of {len(cases)} case(s) stored in {args.store}")
+        return 0
+
+    report = check.report()
+    print(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(report + "\n")
+    return 1 if check.regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
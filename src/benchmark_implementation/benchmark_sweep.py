@@ -0,0 +1,151 @@
+"""
+Scaling sweep over camera_limit x points_limit x framework x dataset (x repetitions) for bundle adjustment,
+every cell runs in its own worker process and ends up as one run of the result store
+"""
+import importlib
+import itertools
+import os
+import resource
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from multiprocessing.connection import wait
+from typing import Callable, Dict, Iterable, List
+
+from src.benchmark.memory import MemoryProfiler
+from src.benchmark.result_channel import BenchmarkSubprocessError, IsolatedRun
+from src.benchmark.result_store import ResultStore, StoredRun, encode_benchmark
+from src.benchmark_implementation.benchmark_datasets import (
+    REICHSTAG_NOISED_LOADER,
+)
+from src.config import BENCHMARK_BUNDLE_ADJUSTMENT_RESULTS_PATH
+from src.dataset.dataset import Dataset
+from src.dataset.loss_functions import LossFunction
+
+#  Note: imported in the workers only, a sweep does not need every framework installed
+FRAMEWORKS = {
+    "JAX": "src.benchmark.jaxopt_benchmark.benchmark_bundle_adjustment.JaxoptBundleAdjustmentBenchmark",
+    "Colmap": "src.benchmark.colmap_benchmark.benchmark_bundle_adjustment.ColmapBundleAdjustmentBenchmark",
+    "GTSAM": "src.benchmark.gtsam_benchmark.benchmark_bundle_adjustment.GtsamBundleAdjustmentBenchmark",
+}
+#  Note: the GTSAM benchmark has no limits, it gets the reduced dataset instead
+REDUCES_ITSELF = {"JAX": True, "Colmap": True, "GTSAM": False}
+#  Note: the jaxopt benchmark measures the memory of its phases (memory_profile) with the timers inside them
+PROFILES_ITSELF = {"JAX": True, "Colmap": False, "GTSAM": False}
+
+
+@dataclass(frozen=True)
+class SweepCell:
+    framework: str
+    dataset: str  # key of the datasets passed to run_sweep
+    camera_limit: int
+    points_limit: int
+    repetition: int
+
+
+def sweep_cells(frameworks: Iterable[str], datasets: Iterable[str], camera_limits: Iterable[int],
+                points_limits: Iterable[int], repetitions=1) -> List[SweepCell]:
+    return [SweepCell(framework, dataset, camera_limit, points_limit, repetition)
+            for dataset, camera_limit, points_limit, framework, repetition in
+            itertools.product(datasets, camera_limits, points_limits, frameworks, range(repetitions))]
+
+
+def _benchmark_class(framework):
+    module_name, class_name = FRAMEWORKS[framework].rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _peak_memory_bytes():
+    """ max resident set size of this process and its (waited for) children, e.g. the colmap binary """
+    return 1024 * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def run_cell(cell: SweepCell, dataset: Dataset):
+    """ worker: runs one cell, returns it encoded for ResultStore.add_encoded """
+    # Note: phases of the frameworks that do not measure their own. Without a sampler thread (interval=None) the
+    #  profiler stays out of their timers, the peak in between is covered by peak_memory
+    profiler = MemoryProfiler(interval=None)
+    if PROFILES_ITSELF[cell.framework]:  # Note: and spans, an outer solve phase would only nest them
+        phase, kwargs = lambda name: nullcontext(), {"memory_profile": True}
+    else:
+        phase, kwargs = profiler.phase, {}
+    if REDUCES_ITSELF[cell.framework]:
+        benchmark = _benchmark_class(cell.framework)(dataset)
+        with phase("solve"):
+            benchmark.benchmark(camera_limit=cell.camera_limit, points_limit=cell.points_limit, **kwargs)
+        errors = benchmark.reprojection_errors(LossFunction.TRIVIAL_LOSS, points_limit=cell.points_limit,
+                                               camera_limit=cell.camera_limit)
+    else:
+        with phase("load"):
+            reduced = dataset.make_reduced_dataset(camera_limit=cell.camera_limit, points_limit=cell.points_limit)
+        benchmark = _benchmark_class(cell.framework)(reduced)
+        with phase("solve"):
+            benchmark.benchmark(**kwargs)
+        errors = benchmark.reprojection_errors(LossFunction.TRIVIAL_LOSS, points_limit=None, camera_limit=None)
+
+    if benchmark.memory is None:
+        benchmark.memory = profiler.summary()
+    arrays, objects, metadata = encode_benchmark(benchmark)
+    metadata.update({
+        "sweep": asdict(cell),
+        "compile_time": getattr(benchmark, "compile_time", None) or 0.0,
+        "solve_time": benchmark.time,
+        "final_cost": 0.5 * float(sum(errors)),
+        "peak_memory": _peak_memory_bytes(),
+    })
+    return arrays, {"objects": objects, "metadata": metadata}
+
+
+def run_sweep(datasets: Dict[str, Callable[[], Dataset]], camera_limits: Iterable[int], points_limits: Iterable[int],
+              frameworks: Iterable[str] = tuple(FRAMEWORKS), repetitions=1, num_workers=1,
+              store_path=os.path.join(BENCHMARK_BUNDLE_ADJUSTMENT_RESULTS_PATH, "sweep"),
+              verbose=True) -> List[StoredRun]:
+    """
+    Runs every cell that is not in the store yet (a cell is identified by its SweepCell values, so reruns continue
+    an interrupted sweep), at most num_workers at a time. Failed cells are reported and retried by the next rerun.
+    Datasets are loaded once in this process and handed to the (forked) workers.
+    """
+    store = ResultStore(store_path)
+    completed = [r.metadata.get("sweep") for r in store.runs()]
+    pending = [c for c in sweep_cells(frameworks, datasets, camera_limits, points_limits, repetitions)
+               if asdict(c) not in completed]
+    if verbose:
+        print(f"{len(pending)} cells to run, {len(completed)} runs in the store")
+
+    session = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+    loaded_datasets = {}
+    running: Dict[IsolatedRun, SweepCell] = {}
+    stored = []
+    while pending or running:
+        while pending and len(running) < num_workers:
+            cell = pending.pop(0)
+            if cell.dataset not in loaded_datasets:
+                loaded_datasets[cell.dataset] = datasets[cell.dataset]()
+            running[IsolatedRun(run_cell, cell, loaded_datasets[cell.dataset])] = cell
+
+        ready = wait([w for run in running for w in run.waitables])
+        for run in [run for run in running if any(w in ready for w in run.waitables)]:
+            cell = running.pop(run)
+            try:
+                arrays, objects = run.result()
+            except BenchmarkSubprocessError as e:
+                print(f"{cell} failed:\n{e}")
+                continue
+            stored.append(store.add_encoded(arrays, objects["objects"], objects["metadata"], session=session))
+            if verbose:
+                metadata = objects["metadata"]
+                print(f"{cell}: compile {metadata['compile_time']:.3f}s, solve {metadata['solve_time']:.3f}s, "
+                      f"{metadata['iterations']} iterations, cost {metadata['final_cost']:.3f}, "
+                      f"peak rss {metadata['memory']['rss_peak'] / 2 ** 20:.1f} MB")
+    return stored
+
+
+if __name__ == "__main__":
+    run_sweep(
+        datasets={"Reichstag": REICHSTAG_NOISED_LOADER},
+        camera_limits=[5, 10, 15, 25, 50],
+        points_limits=[100, 400, 1600],
+        repetitions=3,
+        num_workers=1,  # Note: > 1 distorts the timings if the frameworks compete for the same cores / GPU
+    )
@@ -1,12 +1,16 @@
 import os
-from typing import List
+from typing import Dict, List
 
 import numpy as np
 from matplotlib import pyplot as plt
 
 from src.benchmark.benchmark import Benchmark, SinglePoseBenchmark, BundleAdjustmentBenchmark
 from src.benchmark.jaxopt_benchmark.benchmark_bundle_adjustment import JaxoptBundleAdjustmentBenchmark
+from src.benchmark.repetitions import repetition_statistics
+from src.benchmark.result_store import ResultStore
+from src.benchmark_implementation.benchmark_datasets import REICHSTAG_NOISED_LOADER
 from src.config import BENCHMARK_SINGLE_POSE_RESULTS_PATH, BENCHMARK_BUNDLE_ADJUSTMENT_RESULTS_PATH
+from src.dataset.camera import Camera
 from src.dataset.loss_functions import LossFunction
 
 
@@ -327,28 +331,118 @@ def save_iteration_plot(list_of_benchmarks: List[SinglePoseBenchmark]):
     )
 
 
+def pose_errors(benchmark: Benchmark) -> Dict[str, np.ndarray]:
+    """ errors of all result poses against the poses of the dataset in one call, see Camera.differences """
+    camera_mapping = benchmark.results.camera_mapping
+    return Camera.differences([benchmark.dataset.datasetEntries[i].camera for i in camera_mapping.keys()],
+                              list(camera_mapping.values()))
+
+
+def save_pose_error_plot(list_of_benchmarks: List[Benchmark], evaluation_folder="evaluation"):
+    dataset_name = list_of_benchmarks[0].dataset.name.replace(' ', '_').lower()
+    os.makedirs(f"{evaluation_folder}/{dataset_name}", exist_ok=True)
+
+    errors = list(map(pose_errors, list_of_benchmarks))
+    names = list(map(lambda b: f"{b.FRAMEWORK}", list_of_benchmarks))
+    for key, label in [("degrees", "Rotation error in degrees"), ("positional", "Position error")]:
+        fig: plt.Figure
+        ax: plt.Axes
+        fig, ax = plt.subplots()
+        ax.boxplot([e[key] for e in errors], labels=names)
+
+        ax.set_xlabel(f"Frameworks")
+        ax.set_ylabel(label)
+        ax.set_title(f"{list_of_benchmarks[0].NAME} ({list_of_benchmarks[0].dataset.name})")
+
+        fig.savefig(
+            f"{evaluation_folder}/{dataset_name}/{list_of_benchmarks[0].NAME.replace(' ', '_').lower() + '_'}"
+            f"{key}_pose_error_plot_{list_of_benchmarks[0].dataset.name.replace(' ', '').lower()}"
+            f".png"
+        )
+
+
+def repetition_table(list_of_benchmarks: List[Benchmark]) -> str:
+    """
+    steady state run time per framework (median with confidence interval, see Benchmark.repeat) relative to the first
+    benchmark, "~" marks differences within the overlap of the confidence intervals
+    """
+    reference = repetition_statistics(list_of_benchmarks[0].repetitions)
+    lines = [f"{'framework':<16}{'steady state':>32}{'cold compile':>14}{'warm compile':>14}{'relative':>10}"]
+    for b in list_of_benchmarks:
+        steady_state = repetition_statistics(b.repetitions)
+        warm_compile = repetition_statistics(b.repetitions, "warm_compile")
+        relative = f"{'~' if steady_state.overlaps(reference) else ''}{steady_state.median / reference.median:.2f}x"
+        lines.append(f"{b.FRAMEWORK:<16}"
+                     f"{f'{steady_state.median:.4f}s [{steady_state.ci_low:.4f}, {steady_state.ci_high:.4f}]':>32}"
+                     f"{b.repetitions['cold_compile']:>13.4f}s"
+                     f"{(f'{warm_compile.median:.4f}s' if warm_compile else '-'):>14}{relative:>10}")
+    return "\n".join(lines)
+
+
+def save_repetition_plot(list_of_benchmarks: List[Benchmark], evaluation_folder="evaluation"):
+    """ steady state medians with their confidence intervals, next to cold and warm compile times """
+    dataset_name = list_of_benchmarks[0].dataset.name.replace(' ', '_').lower()
+    os.makedirs(f"{evaluation_folder}/{dataset_name}", exist_ok=True)
+
+    names = list(map(lambda b: f"{b.FRAMEWORK}", list_of_benchmarks))
+    steady_states = [repetition_statistics(b.repetitions) for b in list_of_benchmarks]
+    warm_compiles = [repetition_statistics(b.repetitions, "warm_compile") for b in list_of_benchmarks]
+
+    fig: plt.Figure
+    ax: plt.Axes
+    fig, ax = plt.subplots()
+    x = np.arange(len(names))
+    medians = np.array([s.median for s in steady_states])
+    ax.bar(x - 0.25, medians, width=0.25, label="Steady state (median)",
+           yerr=[medians - [s.ci_low for s in steady_states], [s.ci_high for s in steady_states] - medians],
+           capsize=4)
+    ax.bar(x, [b.repetitions["cold_compile"] for b in list_of_benchmarks], width=0.25, label="Cold compile")
+    ax.bar(x + 0.25, [w.median if w else 0.0 for w in warm_compiles], width=0.25, label="Warm compile (median)")
+    ax.set_xticks(x, names)
+
+    ax.set_xlabel(f"Frameworks")
+    ax.set_ylabel("Time in s")
+    ax.legend(loc="upper right")
+    ax.set_title(f"{list_of_benchmarks[0].NAME} ({list_of_benchmarks[0].dataset.name}), "
+                 f"{steady_states[0].confidence:.0%} CI of {steady_states[0].n} repetitions")
+
+    fig.savefig(
+        f"{evaluation_folder}/{dataset_name}/{list_of_benchmarks[0].NAME.replace(' ', '_').lower() + '_'}"
+        f"repetition_plot_{list_of_benchmarks[0].dataset.name.replace(' ', '').lower()}"
+        f".png"
+    )
+
+
 def single_pose_statistics(list_of_benchmarks: List[SinglePoseBenchmark]):
     save_reprojection_error_histogram_single_pose(list_of_benchmarks)
     save_runtime_plot(list_of_benchmarks)
     save_iteration_plot(list_of_benchmarks)
+    save_pose_error_plot(list_of_benchmarks)
+    if all(b.repetitions for b in list_of_benchmarks):
+        save_repetition_plot(list_of_benchmarks)
+        print(repetition_table(list_of_benchmarks))
     #  if any([isinstance(b, JaxoptSinglePoseBenchmark) for b in list_of_benchmarks]):
     #  save_scatter_plot(list_of_benchmarks)
 
-    #  Camera.difference(list(cr.camera_mapping.values())[0], list(jr.camera_mapping.values())[0])
     #  colmapSinglePoseBenchmark.export_results_in_colmap_format(open_in_colmap=True)
     #  jaxopt_benchmark.export_results_in_colmap_format(open_in_colmap=True)
 
 
 def bundle_adjustment_statistics(list_of_benchmarks: List[BundleAdjustmentBenchmark]):
     save_reprojection_error_histogram_bundle_adjustment(list_of_benchmarks)
+    save_pose_error_plot(list_of_benchmarks, evaluation_folder="evaluation/bundle_adjustment")
+    if all(b.repetitions for b in list_of_benchmarks):
+        save_repetition_plot(list_of_benchmarks, evaluation_folder="evaluation/bundle_adjustment")
+        print(repetition_table(list_of_benchmarks))
 
 
 if __name__ == "__main__":
-    # latest_single_pose_benchmarks = Benchmark.load_pickle_folder(
-    #     os.path.join(BENCHMARK_SINGLE_POSE_RESULTS_PATH, "latest")
+    # latest_single_pose_benchmarks = ResultStore(BENCHMARK_SINGLE_POSE_RESULTS_PATH).load_benchmarks(
+    #     [REICHSTAG_NOISED_LOADER()]
     # )
-    latest_bundle_adjustment_benchmarks = Benchmark.load_pickle_folder(
-        os.path.join(BENCHMARK_BUNDLE_ADJUSTMENT_RESULTS_PATH, "latest")
+    # Note: the result store only references the datasets, the benchmarks are rebuilt on the loaded ones
+    latest_bundle_adjustment_benchmarks = ResultStore(BENCHMARK_BUNDLE_ADJUSTMENT_RESULTS_PATH).load_benchmarks(
+        [REICHSTAG_NOISED_LOADER()]
     )
     #  single_pose_statistics(latest_single_pose_benchmarks)
     bundle_adjustment_statistics(latest_bundle_adjustment_benchmarks[0:2])
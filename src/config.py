@@ -9,4 +9,8 @@ BENCHMARK_SINGLE_POSE_RESULTS_PATH = os.path.join(BENCHMARK_RESULTS_PATH, "singl
 BENCHMARK_BUNDLE_ADJUSTMENT_RESULTS_PATH = os.path.join(
     BENCHMARK_RESULTS_PATH, "bundle_adjustment"
 )
+BENCHMARK_BAL_RESULTS_PATH = os.path.join(BENCHMARK_RESULTS_PATH, "bal")
+BENCHMARK_REGRESSION_RESULTS_PATH = os.path.join(BENCHMARK_RESULTS_PATH, "regression")
+# Note: platform of the jaxopt benchmarks ("gpu", "cpu"), e.g. JAX_PLATFORM_NAME=cpu on machines without a gpu
+JAX_PLATFORM_NAME = os.environ.get("JAX_PLATFORM_NAME", "gpu")
 # TODO: Here also colmap cmd path
@@ -0,0 +1,226 @@
+import os
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from src.dataset import SEED
+from src.dataset.camera import Camera
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
+from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
+                                                     TransformationDirection)
+from src.dataset.dataset import Dataset
+from src.dataset.datasetEntry import DatasetEntry
+from src.dataset.imageMetadata import ImageMetadata
+from src.dataset.loaders.colmap_dataset_loader.cameras import (
+    CameraModelType, write_cameras_bin)
+from src.dataset.loaders.colmap_dataset_loader.images import write_images_bin
+from src.dataset.loaders.colmap_dataset_loader.loader import \
+    params_to_intrinsics
+from src.dataset.loaders.colmap_dataset_loader.points import write_points3d_bin
+from src.dataset.noise import (INTRINSICS_NOISE_MASK, intrinsics_noise,
+                               noised_poses, random_directions)
+from src.dataset.point import Point2D, Point3D
+from src.dataset.reprojection import residuals
+from src.dataset.tracks import Tracks
+
+
+@dataclass
+class BundleAdjustmentProblem:
+    """
+    Columnar bundle adjustment problem (one row per observation instead of one object per point).
+    Poses are W2C in the COLMAP coordinate system, intrinsics are pinhole matrices.
+    """
+    poses: np.ndarray  # (num_cameras, 3, 4)
+    intrinsics: np.ndarray  # (num_cameras, 3, 3)
+    points_3d: np.ndarray  # (num_points, 3)
+    camera_indices: np.ndarray  # (num_observations,)
+    point_indices: np.ndarray  # (num_observations,)
+    points_2d: np.ndarray  # (num_observations, 2)
+    widths: np.ndarray  # (num_cameras,)
+    heights: np.ndarray  # (num_cameras,)
+    name: Optional[str] = None
+    distortion: Optional[np.ndarray] = None  # (num_cameras, k), kept for reference, the solvers use pinhole cameras
+
+    @property
+    def num_cameras(self):
+        return len(self.poses)
+
+    @property
+    def num_points(self):
+        return len(self.points_3d)
+
+    @property
+    def num_observations(self):
+        return len(self.points_2d)
+
+    @property
+    def avg_cam_width(self):
+        return float(np.mean(self.widths))
+
+    @property
+    def image_names(self):
+        return [f"{i:08d}.jpg" for i in range(1, self.num_cameras + 1)]
+
+    @property
+    def intrinsics_params(self):
+        """ (num_cameras, 5) as fx fy cx cy skew, the parameter layout of the jax optimizers """
+        k = self.intrinsics
+        return np.stack([k[:, 0, 0], k[:, 1, 1], k[:, 0, 2], k[:, 1, 2], k[:, 0, 1]], axis=1)
+
+    def __repr__(self):
+        return f"BundleAdjustmentProblem(name={self.name}, cameras={self.num_cameras}, " \
+               f"points={self.num_points}, observations={self.num_observations})"
+
+    def with_parameters(self, poses=None, intrinsics=None, points_3d=None) -> "BundleAdjustmentProblem":
+        """ same observations, new parameters (e.g. the result of a solver) """
+        return replace(self,
+                       poses=self.poses if poses is None else np.asarray(poses),
+                       intrinsics=self.intrinsics if intrinsics is None else np.asarray(intrinsics),
+                       points_3d=self.points_3d if points_3d is None else np.asarray(points_3d))
+
+    def with_noise(self, point3d_noise=3e-2, camera_rotation_noise=5e-2, camera_translation_noise=5e-2,
+                   camera_intrinsics_noise=10, point2d_noise=1, seed=SEED) -> "BundleAdjustmentProblem":
+        """ columnar counterpart of Dataset.with_noise, draws the noise in the same order from the same generator """
+        rng = np.random.default_rng(seed)
+        points_3d = self.points_3d + random_directions(rng, self.num_points) * point3d_noise
+        rotations, translations = noised_poses(
+            rng,
+            rotations=Rotation.from_matrix(self.poses[:, :, :3]),
+            translations=self.poses[:, :, 3],
+            w2c=np.ones(self.num_cameras, dtype=bool),
+            rotation_noise=camera_rotation_noise,
+            translation_noise=camera_translation_noise,
+        )
+        poses = np.concatenate([rotations.as_matrix(), translations[..., np.newaxis]], axis=2)
+        intrinsics = self.intrinsics + intrinsics_noise(rng, self.num_cameras, camera_intrinsics_noise) * \
+            INTRINSICS_NOISE_MASK
+        noised = self.with_parameters(poses, intrinsics, points_3d)
+        noised.points_2d = self.points_2d + random_directions(rng, self.num_observations, dim=2) * point2d_noise
+        return noised
+
+    def reprojection_residuals(self):
+        """ observed - projected, (num_observations, 2) """
+        projection_matrices = np.einsum("nij,njk->nik", self.intrinsics, self.poses)
+        return residuals(projection_matrices, self.camera_indices, self.points_3d[self.point_indices], self.points_2d)
+
+    def squared_reprojection_errors(self):
+        return (self.reprojection_residuals() ** 2).sum(axis=1)
+
+    def cost(self):
+        """ 0.5 * sum of squared reprojection errors (in px^2), i.e. the (unnormalized) least squares cost """
+        return 0.5 * float(self.squared_reprojection_errors().sum())
+
+    def subproblem(self, camera_limit, min_track_length=2) -> "BundleAdjustmentProblem":
+        """ first camera_limit cameras, keeping only points observed at least min_track_length times by them """
+        if camera_limit is None or camera_limit >= self.num_cameras:
+            return self
+        return self._restricted(camera_limit, self.camera_indices < camera_limit, min_track_length,
+                                name=f"{self.name} ({camera_limit} cameras)" if self.name else None)
+
+    def without_short_tracks(self, min_track_length=2) -> "BundleAdjustmentProblem":
+        return self._restricted(self.num_cameras, np.ones(self.num_observations, dtype=bool), min_track_length,
+                                name=self.name)
+
+    def _restricted(self, camera_limit, observation_mask, min_track_length, name):
+        track_lengths = np.bincount(self.point_indices[observation_mask], minlength=self.num_points)
+        kept_points = track_lengths >= min_track_length
+        observation_mask = observation_mask & kept_points[self.point_indices]
+
+        new_point_index = np.full(self.num_points, -1, dtype=self.point_indices.dtype)
+        new_point_index[kept_points] = np.arange(np.count_nonzero(kept_points))
+        return BundleAdjustmentProblem(
+            poses=self.poses[:camera_limit],
+            intrinsics=self.intrinsics[:camera_limit],
+            points_3d=self.points_3d[kept_points],
+            camera_indices=self.camera_indices[observation_mask],
+            point_indices=new_point_index[self.point_indices[observation_mask]],
+            points_2d=self.points_2d[observation_mask],
+            widths=self.widths[:camera_limit],
+            heights=self.heights[:camera_limit],
+            distortion=None if self.distortion is None else self.distortion[:camera_limit],
+            name=name,
+        )
+
+    def _observations_by_camera(self):
+        """ (order, offsets): observations sorted by camera (stable) and the per-camera slices into them """
+        order = np.argsort(self.camera_indices, kind="stable")
+        offsets = np.zeros(self.num_cameras + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.camera_indices, minlength=self.num_cameras), out=offsets[1:])
+        return order, offsets
+
+    def to_dataset(self, images_path="") -> Dataset:
+        """ object based Dataset with the same ids as export_in_colmap_format (no image files behind it) """
+        order, offsets = self._observations_by_camera()
+        xs, ys = self.points_2d[order].T.tolist()
+        point3d_ids = (self.point_indices[order] + 1).tolist()
+        camera_poses = CameraPoseArray.from_rotation_translation_matrices(
+            self.poses, identifiers=self.image_names, coordinate_system=CoordinateSystem.COLMAP,
+            direction=TransformationDirection.W2C).to_poses()
+
+        dataset_entries = []
+        for index, name in enumerate(self.image_names):
+            start, end = offsets[index], offsets[index + 1]
+            width, height = int(self.widths[index]), int(self.heights[index])
+            k = self.intrinsics[index]
+            camera = Camera(
+                camera_pose=camera_poses[index],
+                camera_intrinsics=params_to_intrinsics(*map(float, (k[0, 0], k[1, 1], k[0, 2], k[1, 2], k[0, 1]))),
+                width=width,
+                height=height,
+            )
+            points2D = [Point2D(i, x, y, p, {}) for i, (x, y, p) in
+                        enumerate(zip(xs[start:end], ys[start:end], point3d_ids[start:end]))]
+            dataset_entries.append(DatasetEntry(
+                image_metadata=ImageMetadata(identifier=name, image_path=os.path.join(images_path, name),
+                                             width=width, height=height),
+                points2D=points2D,
+                camera=camera,
+            ))
+
+        points3D = [Point3D(i + 1, x, y, z, {"rgb": np.array([255, 255, 255]), "error": 0.0})
+                    for i, (x, y, z) in enumerate(self.points_3d.tolist())]
+        return Dataset(points3D=points3D, datasetEntries=dataset_entries, name=self.name,
+                       tracks=self._tracks(order, offsets))
+
+    def _tracks(self, order, offsets) -> Tracks:
+        sorted_cameras = self.camera_indices[order]
+        return Tracks.from_observations(
+            point3d_ids=np.arange(1, self.num_points + 1),
+            obs_point3d_ids=self.point_indices[order].astype(np.int64) + 1,
+            obs_image_ids=(sorted_cameras + 1).astype(np.uint32),
+            obs_point2d_idxs=(np.arange(len(order)) - offsets[:-1][sorted_cameras]).astype(np.uint32),
+        )
+
+    def export_in_colmap_format(self, output_path):
+        """ writes a binary colmap model, image/camera ids are camera index + 1 and point ids point index + 1 """
+        os.makedirs(output_path, exist_ok=True)
+        image_ids = np.arange(1, self.num_cameras + 1)
+        params = self.intrinsics_params
+        write_cameras_bin(os.path.join(output_path, "cameras.bin"),
+                          camera_ids=image_ids,
+                          camera_model_type=CameraModelType.PINHOLE,
+                          widths=self.widths,
+                          heights=self.heights,
+                          params=params[:, :4])
+
+        order, offsets = self._observations_by_camera()
+        xyzw = Rotation.from_matrix(self.poses[:, :, :3]).as_quat()
+        write_images_bin(os.path.join(output_path, "images.bin"),
+                         image_ids=image_ids,
+                         qvecs=np.concatenate([xyzw[:, 3:], xyzw[:, :3]], axis=1),
+                         tvecs=self.poses[:, :, 3],
+                         camera_ids=image_ids,
+                         names=self.image_names,
+                         xys=self.points_2d[order],
+                         point3d_ids=self.point_indices[order].astype(np.int64) + 1,
+                         offsets=offsets)
+
+        tracks = self._tracks(order, offsets)
+        write_points3d_bin(os.path.join(output_path, "points3D.bin"),
+                           point3d_ids=tracks.point3d_ids,
+                           xyz=self.points_3d,
+                           rgb=np.full((self.num_points, 3), 255, dtype=np.uint8),
+                           errors=np.zeros(self.num_points),
+                           tracks=tracks)
@@ -1,12 +1,13 @@
 import time
 from dataclasses import dataclass
-from typing import Tuple, Union
+from typing import Dict, Sequence, Tuple, Union
 from warnings import warn
 
 import numpy as np
 
 from src.dataset.camera_pose.camera_pose import CameraPose
 from src.dataset.camera_pose.enums_and_types import TransformationDirection
+from src.dataset.camera_pose.metrics import pose_errors_of_poses
 from src.dataset.loss_functions import LossFunction
 from src.dataset.point import Point3D
 
@@ -92,3 +93,8 @@ class Camera:
             "degrees": CameraPose.compute_rotation_error_in_degrees(camera_1.camera_pose, camera_2.camera_pose),
             "positional": CameraPose.compute_position_error(camera_1.camera_pose, camera_2.camera_pose),
         }
+
+    @staticmethod
+    def differences(cameras_1: Sequence["Camera"], cameras_2: Sequence["Camera"]) -> Dict[str, np.ndarray]:
+        """ difference of N pairs (paired by index) at once, every value is an (N,) array """
+        return pose_errors_of_poses([c.camera_pose for c in cameras_1], [c.camera_pose for c in cameras_2])
@@ -0,0 +1,124 @@
+from typing import Tuple
+
+import numpy as np
+
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
+from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
+                                                     TransformationDirection)
+from src.dataset.camera_pose.exceptions import NotEnoughCameraPosesErr
+
+
+def umeyama(points_one: np.ndarray, points_two: np.ndarray, with_scale=True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stacked absolute orientation, points (..., N, 3) -> (r (..., 3, 3), t (..., 3)) with points_two ~ r @ one + t.
+    r includes the scale sqrt(var(two) / var(one)) as CameraSet.compute_pose_matrix (S. Umeyama, "Least-Squares
+    Estimation of Transformation Parameters Between Two Point Patterns", 1991, without reflections).
+    """
+    points_one, points_two = np.asarray(points_one, dtype=float), np.asarray(points_two, dtype=float)
+    one_mean, two_mean = points_one.mean(axis=-2), points_two.mean(axis=-2)
+    one_m, two_m = points_one - one_mean[..., np.newaxis, :], points_two - two_mean[..., np.newaxis, :]
+
+    u, _, vt = np.linalg.svd(np.swapaxes(one_m, -1, -2) @ two_m)
+    v = np.swapaxes(vt, -1, -2)
+    d = np.ones(u.shape[:-1])
+    d[..., 2] = np.sign(np.linalg.det(u @ vt))
+    r = (v * d[..., np.newaxis, :]) @ np.swapaxes(u, -1, -2)
+    if with_scale:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.sqrt(np.square(two_m).sum(axis=(-1, -2)) / np.square(one_m).sum(axis=(-1, -2)))
+        r = r * scale[..., np.newaxis, np.newaxis]
+    t = two_mean - np.einsum("...ij,...j->...i", r, one_mean)
+    return r, t
+
+
+def _unified(pose_array: CameraPoseArray) -> CameraPoseArray:
+    return pose_array.in_coordinate_system(CoordinateSystem.COLMAP).in_direction(TransformationDirection.C2W)
+
+
+def transformed(pose_array: CameraPoseArray, r: np.ndarray, t: np.ndarray) -> CameraPoseArray:
+    """ C2W poses moved by the similarity (r incl. scale, t): positions r @ p + t, rotations R @ rotation """
+    pose_array = _unified(pose_array)
+    scale = np.cbrt(np.linalg.det(r))
+    return pose_array._like((r / scale) @ pose_array.rotation_matrices, pose_array.translations @ r.T + t)
+
+
+def similarity_residuals(r: np.ndarray, t: np.ndarray, pose_array_one: CameraPoseArray,
+                         pose_array_two: CameraPoseArray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Position and rotation errors (both (H, N)) of the H hypotheses (r (H, 3, 3), t (H, 3)) moving pose_array_one
+    onto pose_array_two (paired by index), rotation errors as CameraPose.compute_rotation_error
+    """
+    one, two = _unified(pose_array_one), _unified(pose_array_two)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rotations = r / np.cbrt(np.linalg.det(r))[:, np.newaxis, np.newaxis]
+    # Note: || (R_h R_one)^T R_two - I ||^2 = 6 - 2 tr(R_h^T R_two R_one^T), one (H, 9) @ (9, N) product
+    relative = (two.rotation_matrices @ np.swapaxes(one.rotation_matrices, 1, 2)).reshape((-1, 9))
+    rotation_errors = np.sqrt(np.maximum(6 - 2 * rotations.reshape((-1, 9)) @ relative.T, 0))
+
+    # Note: || r p + t - q ||^2 expanded into one (H, 17) @ (17, N) product as well, centered against cancellation
+    p_mean, q_mean = one.positions.mean(axis=0), two.positions.mean(axis=0)
+    p, q = one.positions - p_mean, two.positions - q_mean
+    t = t + r @ p_mean - q_mean
+    features = np.concatenate([np.square(p).sum(axis=1, keepdims=True), np.square(q).sum(axis=1, keepdims=True),
+                               p, (q[:, :, np.newaxis] * p[:, np.newaxis, :]).reshape((-1, 9)), q,
+                               np.ones((len(p), 1))], axis=1)
+    coefficients = np.concatenate([np.square(r).sum(axis=(1, 2))[:, np.newaxis] / 3, np.ones((len(r), 1)),
+                                   2 * np.einsum("hji,hj->hi", r, t), -2 * r.reshape((-1, 9)), -2 * t,
+                                   np.square(t).sum(axis=1, keepdims=True)], axis=1)
+    position_errors = np.sqrt(np.maximum(coefficients @ features.T, 0))
+    return position_errors, rotation_errors
+
+
+def _sample_subsets(rng: np.random.Generator, num_poses, num_hypotheses, sample_size) -> np.ndarray:
+    """ (num_hypotheses, sample_size) indices, distinct within each row """
+    samples = rng.integers(0, num_poses, size=(num_hypotheses, sample_size))
+    while True:
+        sorted_samples = np.sort(samples, axis=1)
+        duplicates = (sorted_samples[:, 1:] == sorted_samples[:, :-1]).any(axis=1)
+        if not duplicates.any():
+            return samples
+        samples[duplicates] = rng.integers(0, num_poses, size=(np.count_nonzero(duplicates), sample_size))
+
+
+def robust_similarity(pose_array_one: CameraPoseArray, pose_array_two: CameraPoseArray, with_scale=True,
+                      num_hypotheses=300, sample_size=6, local_optimization=False, lo_iterations=3,
+                      seed=123456789) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    RANSAC over minimal subsets of positions (paired by index), returns (r incl. scale, t).
+    All hypotheses are solved and scored at once, a hypothesis is taken if it lowers both the median position and the
+    median rotation error of the best one so far (in sampling order).
+    With local_optimization the best hypothesis is refitted on the poses with a position error up to its median
+    (at most lo_iterations times, as long as the medians improve).
+    """
+    if len(pose_array_one) != len(pose_array_two):
+        raise ValueError("Pose arrays must be paired")
+    num_poses = len(pose_array_one)
+    if num_poses < max(3, sample_size):
+        raise NotEnoughCameraPosesErr(f"Number of poses must be greater/equal {max(3, sample_size)}.")
+    positions_one = _unified(pose_array_one).positions
+    positions_two = _unified(pose_array_two).positions
+
+    samples = _sample_subsets(np.random.default_rng(seed), num_poses, num_hypotheses, sample_size)
+    r, t = umeyama(positions_one[samples], positions_two[samples], with_scale=with_scale)
+    position_errors, rotation_errors = similarity_residuals(r, t, pose_array_one, pose_array_two)
+    median_p, median_r = np.median(position_errors, axis=1), np.median(rotation_errors, axis=1)
+
+    best, min_positional, min_rotational = None, np.inf, np.inf
+    for i in range(num_hypotheses):
+        if median_p[i] < min_positional and median_r[i] < min_rotational:
+            best, min_positional, min_rotational = i, median_p[i], median_r[i]
+    if best is None:
+        return None, None
+    best_r, best_t, best_errors = r[best], t[best], position_errors[best]
+
+    for _ in range(lo_iterations if local_optimization else 0):
+        inliers = best_errors <= min_positional
+        if np.count_nonzero(inliers) < 3:
+            break
+        lo_r, lo_t = umeyama(positions_one[inliers], positions_two[inliers], with_scale=with_scale)
+        lo_p, lo_rot = similarity_residuals(lo_r[np.newaxis], lo_t[np.newaxis], pose_array_one, pose_array_two)
+        if not (np.median(lo_p) < min_positional and np.median(lo_rot) < min_rotational):
+            break
+        best_r, best_t, best_errors = lo_r, lo_t, lo_p[0]
+        min_positional, min_rotational = np.median(lo_p), np.median(lo_rot)
+    return best_r, best_t
@@ -0,0 +1,191 @@
+from typing import List, Sequence, Union
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.constants import CONVERSION_MATRIX
+from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
+                                                     TransformationDirection)
+from src.dataset.camera_pose.helpers import _opposite
+
+
+class CameraPoseArray:
+    """
+    N camera poses of one coordinate system and direction as contiguous (N, 3, 3) rotation matrices and
+    (N, 3) translations. Indexing with an int returns a CameraPose (view on the translation), slices and index
+    arrays return a CameraPoseArray.
+    """
+
+    def __init__(self, rotation_matrices: np.ndarray, translations: np.ndarray, identifiers: Sequence[str] = None,
+                 coordinate_system=CoordinateSystem.UNITY,
+                 direction=TransformationDirection.C2W):
+        self.rotation_matrices: np.ndarray = np.asarray(rotation_matrices, dtype=float).reshape((-1, 3, 3))
+        self.translations: np.ndarray = np.asarray(translations, dtype=float).reshape((-1, 3))
+        self.identifiers: List[str] = list(identifiers) if identifiers is not None else [None] * len(self)
+        self.coordinate_system: CoordinateSystem = coordinate_system
+        self.direction: TransformationDirection = direction
+
+    def __len__(self):
+        return len(self.rotation_matrices)
+
+    def __repr__(self):
+        return f"CameraPoseArray(num_poses={len(self)}, coordinate_system={self.coordinate_system.name}, " \
+               f"direction={self.direction.name})"
+
+    def __getitem__(self, index) -> Union[CameraPose, "CameraPoseArray"]:
+        if np.isscalar(index):
+            return CameraPose(rotation=Rotation.from_matrix(self.rotation_matrices[index]),
+                              translation=self.translations[index].copy(),
+                              identifier=self.identifiers[index],
+                              coordinate_system=self.coordinate_system,
+                              direction=self.direction)
+        return self._like(self.rotation_matrices[index], self.translations[index],
+                          identifiers=np.array(self.identifiers, dtype=object)[index].tolist())
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def _like(self, rotation_matrices, translations, identifiers=None, coordinate_system=None, direction=None):
+        return CameraPoseArray(rotation_matrices=rotation_matrices,
+                               translations=translations,
+                               identifiers=self.identifiers if identifiers is None else identifiers,
+                               coordinate_system=coordinate_system or self.coordinate_system,
+                               direction=direction or self.direction)
+
+    """
+    CONSTRUCTORS
+    """
+
+    @classmethod
+    def from_poses(cls, camera_poses: Sequence[CameraPose], coordinate_system=None,
+                   direction=None) -> "CameraPoseArray":
+        """ converts every pose into coordinate_system / direction (default: the ones of the first pose) """
+        if len(camera_poses) == 0:
+            return cls(np.zeros((0, 3, 3)), np.zeros((0, 3)), coordinate_system=coordinate_system or
+                       CoordinateSystem.UNITY, direction=direction or TransformationDirection.C2W)
+        coordinate_system = coordinate_system or camera_poses[0].coordinate_system
+        direction = direction or camera_poses[0].direction
+        rotation_matrices = Rotation.concatenate([p.rotation for p in camera_poses]).as_matrix()
+        translations = np.array([p.translation for p in camera_poses], dtype=float)
+
+        convert = np.array([p.coordinate_system != coordinate_system for p in camera_poses])
+        if convert.any():
+            rotation_matrices[convert] = CONVERSION_MATRIX @ rotation_matrices[convert] @ CONVERSION_MATRIX
+            translations[convert] = translations[convert] @ CONVERSION_MATRIX.T
+        invert = np.array([p.direction != direction for p in camera_poses])
+        if invert.any():
+            rotation_matrices[invert], translations[invert] = _inverted(rotation_matrices[invert],
+                                                                        translations[invert])
+        return cls(rotation_matrices, translations, identifiers=[p.identifier for p in camera_poses],
+                   coordinate_system=coordinate_system, direction=direction)
+
+    @classmethod
+    def from_wxyz_quaternions(cls, wxyz: np.ndarray, translations: np.ndarray, identifiers: Sequence[str] = None,
+                              coordinate_system=CoordinateSystem.UNITY,
+                              direction=TransformationDirection.C2W) -> "CameraPoseArray":
+        wxyz = np.asarray(wxyz, dtype=float).reshape((-1, 4))
+        #  Note: Scipy quaternion format (xyzw); Our format (wxyz)
+        rotation_matrices = Rotation.from_quat(wxyz[:, [1, 2, 3, 0]]).as_matrix() if len(wxyz) else \
+            np.zeros((0, 3, 3))
+        return cls(rotation_matrices, translations, identifiers=identifiers,
+                   coordinate_system=coordinate_system, direction=direction)
+
+    @classmethod
+    def from_rotvecs(cls, rotvecs: np.ndarray, translations: np.ndarray, identifiers: Sequence[str] = None,
+                     coordinate_system=CoordinateSystem.UNITY,
+                     direction=TransformationDirection.C2W) -> "CameraPoseArray":
+        rotvecs = np.asarray(rotvecs, dtype=float).reshape((-1, 3))
+        rotation_matrices = Rotation.from_rotvec(rotvecs).as_matrix() if len(rotvecs) else np.zeros((0, 3, 3))
+        return cls(rotation_matrices, translations, identifiers=identifiers,
+                   coordinate_system=coordinate_system, direction=direction)
+
+    @classmethod
+    def from_rotation_translation_matrices(cls, matrices: np.ndarray, identifiers: Sequence[str] = None,
+                                           coordinate_system=CoordinateSystem.UNITY,
+                                           direction=TransformationDirection.C2W) -> "CameraPoseArray":
+        """ (N, 3, 4) or (N, 4, 4), copied """
+        matrices = np.asarray(matrices, dtype=float)
+        return cls(matrices[:, :3, :3].copy(), matrices[:, :3, 3].copy(), identifiers=identifiers,
+                   coordinate_system=coordinate_system, direction=direction)
+
+    def to_poses(self) -> List[CameraPose]:
+        rotations = Rotation.from_matrix(self.rotation_matrices) if len(self) else []
+        return [CameraPose(rotation=rotations[i],
+                           translation=self.translations[i].copy(),
+                           identifier=self.identifiers[i],
+                           coordinate_system=self.coordinate_system,
+                           direction=self.direction) for i in range(len(self))]
+
+    """
+    POSE ALGEBRA
+    """
+
+    def inverse(self) -> "CameraPoseArray":
+        rotation_matrices, translations = _inverted(self.rotation_matrices, self.translations)
+        return self._like(rotation_matrices, translations, direction=_opposite(self.direction))
+
+    def in_direction(self, target_direction) -> "CameraPoseArray":
+        if self.direction == target_direction:
+            return self._like(self.rotation_matrices, self.translations)
+        return self.inverse()
+
+    def in_coordinate_system(self, target_system) -> "CameraPoseArray":
+        if self.coordinate_system == target_system:
+            return self._like(self.rotation_matrices, self.translations)
+        return self._like(CONVERSION_MATRIX @ self.rotation_matrices @ CONVERSION_MATRIX,
+                          self.translations @ CONVERSION_MATRIX.T,
+                          coordinate_system=target_system)
+
+    def compose(self, other: "CameraPoseArray") -> "CameraPoseArray":
+        """ self o other (other is applied first), pose wise or broadcast if one of both holds a single pose """
+        rotation_matrices = self.rotation_matrices @ other.rotation_matrices
+        translations = np.einsum("nij,nj->ni", np.broadcast_to(self.rotation_matrices, rotation_matrices.shape),
+                                 np.broadcast_to(other.translations, (len(rotation_matrices), 3))) + self.translations
+        return self._like(rotation_matrices, translations,
+                          identifiers=self.identifiers if len(self) == len(rotation_matrices) else other.identifiers)
+
+    def apply(self, points: np.ndarray) -> np.ndarray:
+        """ transforms (N, 3) points (one per pose) or (N, M, 3) points (M per pose) """
+        points = np.asarray(points, dtype=float)
+        if points.ndim == 2:
+            return np.einsum("nij,nj->ni", self.rotation_matrices, points) + self.translations
+        return np.einsum("nij,nmj->nmi", self.rotation_matrices, points) + self.translations[:, np.newaxis]
+
+    """
+    CONVERSIONS
+    """
+
+    @property
+    def rotation(self) -> Rotation:
+        return Rotation.from_matrix(self.rotation_matrices)
+
+    @property
+    def positions(self) -> np.ndarray:
+        """ (N, 3) camera centers """
+        if self.direction == TransformationDirection.C2W:
+            return self.translations
+        return self.inverse().translations
+
+    @property
+    def wxyz_quaternions(self) -> np.ndarray:
+        q = self.rotation.as_quat()
+        return np.concatenate([q[:, 3:], q[:, :3]], axis=1)
+
+    @property
+    def rotation_translation_matrices(self) -> np.ndarray:
+        """ (N, 3, 4) """
+        return np.concatenate([self.rotation_matrices, self.translations[..., np.newaxis]], axis=2)
+
+    @property
+    def transformation_translation_matrices(self) -> np.ndarray:
+        """ (N, 4, 4) """
+        matrices = np.zeros((len(self), 4, 4))
+        matrices[:, :3, :] = self.rotation_translation_matrices
+        matrices[:, 3, 3] = 1.0
+        return matrices
+
+
+def _inverted(rotation_matrices, translations):
+    inverse_rotations = np.swapaxes(rotation_matrices, 1, 2)
+    return inverse_rotations, -np.einsum("nij,nj->ni", inverse_rotations, translations)
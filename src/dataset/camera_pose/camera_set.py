@@ -1,13 +1,15 @@
 import os
-import random
 import sqlite3
 from pathlib import Path
-from typing import Callable, List, Union
+from typing import Callable, List, Tuple, Union
 
 import numpy as np
 from scipy import linalg
 
+from src.dataset.camera_pose import metrics
+from src.dataset.camera_pose.alignment import robust_similarity
 from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
 from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
                                                      PoseFormat,
                                                      TransformationDirection)
@@ -30,20 +32,99 @@ def _create_transformation_translation_matrix(rotation_matrix, translation_vecto
     return np.vstack([np.hstack([rotation_matrix, translation_vector.reshape((3, 1))]), np.array([0, 0, 0, 1])])
 
 
+def _matched_positions(camera_set_one: "CameraSet", camera_set_two: "CameraSet", match_identifiers):
+    """ (N, 3) positions of both sets, paired by identifier if match_identifiers (else by index) """
+    points_in_one, points_in_two = camera_set_one.pose_array.positions, camera_set_two.pose_array.positions
+    if match_identifiers:
+        indices_one, indices_two = camera_set_one.join(camera_set_two)
+        if len(indices_one) != len(camera_set_one) or len(indices_two) != len(camera_set_two):
+            raise NonMatchingIdentifiersErr()
+        points_in_one, points_in_two = points_in_one[indices_one], points_in_two[indices_two]
+    return points_in_one, points_in_two
+
+
 class CameraSet:
+    """
+    Poses unified to COLMAP coordinates and C2W, stored as CameraPoseArray with an identifier -> index dictionary.
+    The CameraPose objects of camera_poses are created on first access. Poses changed by anything but the
+    methods of the set (e.g. CameraPose.apply_translation) require a refresh()
+    """
+
     def __init__(self, camera_poses: List[CameraPose] = None, pose_format=PoseFormat.QT):
-        unified_coordinates = [c.in_coordinate_system(target_system=CoordinateSystem.COLMAP) for c in camera_poses]
-        unified_direction = list(map(lambda x: x.inverse() if x.direction == TransformationDirection.W2C else x,
-                                     unified_coordinates))
-        self.camera_poses = unified_direction
+        self._set_pose_array(CameraPoseArray.from_poses(camera_poses or [],
+                                                        coordinate_system=CoordinateSystem.COLMAP,
+                                                        direction=TransformationDirection.C2W))
+
+    @staticmethod
+    def from_pose_array(pose_array: CameraPoseArray) -> "CameraSet":
+        camera_set = CameraSet()
+        camera_set._set_pose_array(pose_array.in_coordinate_system(CoordinateSystem.COLMAP)
+                                   .in_direction(TransformationDirection.C2W))
+        return camera_set
+
+    def _set_pose_array(self, pose_array: CameraPoseArray):
+        self._pose_array = pose_array
+        self._camera_poses = None
+        self._index_by_identifier = None
+
+    @property
+    def camera_poses(self) -> List[CameraPose]:
+        if self._camera_poses is None:
+            self._camera_poses = self._pose_array.to_poses()
+        return self._camera_poses
+
+    @camera_poses.setter
+    def camera_poses(self, camera_poses: List[CameraPose]):
+        """ unified like in __init__, camera_poses returns the converted poses afterwards """
+        self._set_pose_array(CameraPoseArray.from_poses(camera_poses, coordinate_system=CoordinateSystem.COLMAP,
+                                                        direction=TransformationDirection.C2W))
+
+    def refresh(self):
+        """ rebuilds the pose array and the identifier index from camera_poses, which are created anew """
+        if self._camera_poses is not None:
+            self.camera_poses = self._camera_poses
+
+    def __len__(self):
+        return len(self._pose_array)
+
+    @property
+    def pose_array(self) -> CameraPoseArray:
+        return self._pose_array
+
+    @property
+    def identifiers(self) -> List[str]:
+        return self._pose_array.identifiers
+
+    def index_of(self, identifier):
+        """ index of the (first) pose with the identifier, None if there is none """
+        if self._index_by_identifier is None:
+            self._index_by_identifier = {}
+            for index, i in enumerate(self.identifiers):
+                self._index_by_identifier.setdefault(i, index)
+        return self._index_by_identifier.get(identifier)
 
     def sort_by_identifier(self):
-        self.camera_poses = sorted(self.camera_poses, key=lambda x: x.identifier)
+        order = sorted(range(len(self)), key=lambda i: self.identifiers[i])
+        camera_poses = self._camera_poses
+        self._set_pose_array(self._pose_array[np.array(order, dtype=np.int64)])
+        if camera_poses is not None:
+            self._camera_poses = [camera_poses[i] for i in order]
 
     def find_by_identifier(self, identifier):
-        for c in self.camera_poses:
-            if c.identifier == identifier:
-                return c
+        index = self.index_of(identifier)
+        return None if index is None else self.camera_poses[index]
+
+    def join(self, camera_set_two: "CameraSet") -> Tuple[np.ndarray, np.ndarray]:
+        """ (indices into self, indices into camera_set_two) of the common identifiers, in the order of self """
+        indices_two = [camera_set_two.index_of(i) for i in self.identifiers]
+        indices_one = np.array([i for i, j in enumerate(indices_two) if j is not None], dtype=np.int64)
+        return indices_one, np.array([j for j in indices_two if j is not None], dtype=np.int64)
+
+    def subset(self, indices) -> "CameraSet":
+        """ new set of copies of the poses at indices """
+        camera_set = CameraSet()
+        camera_set._set_pose_array(self._pose_array[np.asarray(indices, dtype=np.int64)])
+        return camera_set
 
     # @staticmethod
     # def get_common_poses(camera_set_one: "CameraSet", camera_set_two: "CameraSet"):
@@ -53,10 +134,8 @@ class CameraSet:
     #     return CameraSet(camera_poses=common)
 
     def get_common_poses(self, camera_set_two: "CameraSet"):
-        cpo = CameraSet(camera_poses=self.camera_poses)
-        cpt = CameraSet(camera_poses=camera_set_two.camera_poses)
-        common = [c for c in cpo.camera_poses if cpt.find_by_identifier(c.identifier)]
-        return CameraSet(camera_poses=common)
+        indices_one, _ = self.join(camera_set_two)
+        return self.subset(indices_one)
 
     def create_sparse_model(self, sparse_folder_path, project_folder, database_path):
 
@@ -152,18 +231,22 @@ class CameraSet:
     def apply_transform_4d(self, matrix_4d):
         for c in self.camera_poses:
             c.apply_transform_4d(matrix_4d=matrix_4d)
+        self.refresh()
 
     def apply_transform_3d(self, matrix_3d):
         for c in self.camera_poses:
             c.apply_transform_3d(matrix_3d=matrix_3d)
+        self.refresh()
 
     def apply_translation(self, translation_vector):
         for c in self.camera_poses:
             c.apply_translation(translation_vector=translation_vector)
+        self.refresh()
 
     def apply_move(self, translation_vector):
         for c in self.camera_poses:
             c.apply_move(translation_vector=translation_vector)
+        self.refresh()
 
     @staticmethod
     def compute_pose_quaternion(camera_set_one: "CameraSet", camera_set_two: "CameraSet", with_scale=True,
@@ -187,17 +270,7 @@ class CameraSet:
                  [2 * q[1] * q[3] - 2 * q[0] * q[2], 2 * q[2] * q[3] + 2 * q[0] * q[1],
                   1 - 2 * q[1] ** 2 - 2 * q[2] ** 2]])
 
-        points_in_one = [c.position for c in camera_set_one.camera_poses]
-        points_in_two = [c.position for c in camera_set_two.camera_poses]
-
-        if match_identifiers:
-            sorted_one = sorted(camera_set_one.camera_poses, key=lambda x: x.identifier)
-            sorted_two = sorted(camera_set_two.camera_poses, key=lambda x: x.identifier)
-            for o, t in list(zip(sorted_one, sorted_two)):
-                if o.identifier != t.identifier:
-                    raise NonMatchingIdentifiersErr()
-            points_in_one = [c.position for c in sorted_one]
-            points_in_two = [c.position for c in sorted_two]
+        points_in_one, points_in_two = _matched_positions(camera_set_one, camera_set_two, match_identifiers)
 
         num_points = len(points_in_one)
         dim_points = len(points_in_one[0])
@@ -219,8 +292,8 @@ class CameraSet:
         two_mean_stack = np.outer(two_mean, np.ones(len(points_in_two)))
         one_mat_meaned = one_mat - one_mean_stack
         two_mat_meaned = two_mat - two_mean_stack
-        one_squared_length_sum = np.sum(np.apply_along_axis(lambda x: np.square(np.linalg.norm(x)), 0, one_mat_meaned))
-        two_squared_length_sum = np.sum(np.apply_along_axis(lambda x: np.square(np.linalg.norm(x)), 0, two_mat_meaned))
+        one_squared_length_sum = np.sum(np.square(one_mat_meaned))
+        two_squared_length_sum = np.sum(np.square(two_mat_meaned))
         scale = np.sqrt(two_squared_length_sum / one_squared_length_sum)
 
         delta = np.array([[m[1, 2] - m[2, 1]], [m[2, 0] - m[0, 2]], [m[0, 1] - m[1, 0]]])
@@ -247,17 +320,7 @@ class CameraSet:
         This is a refinement of the method proposed by Arun, Huang and Blostein, ensuring that the
         rotation matrix is indeed a rotation and not a reflection.
         '''
-        points_in_one = [c.position for c in camera_set_one.camera_poses]
-        points_in_two = [c.position for c in camera_set_two.camera_poses]
-
-        if match_identifiers:
-            sorted_one = sorted(camera_set_one.camera_poses, key=lambda x: x.identifier)
-            sorted_two = sorted(camera_set_two.camera_poses, key=lambda x: x.identifier)
-            for o, t in list(zip(sorted_one, sorted_two)):
-                if o.identifier != t.identifier:
-                    raise NonMatchingIdentifiersErr()
-            points_in_one = [c.position for c in sorted_one]
-            points_in_two = [c.position for c in sorted_two]
+        points_in_one, points_in_two = _matched_positions(camera_set_one, camera_set_two, match_identifiers)
 
         num_points = len(points_in_one)
         dim_points = len(points_in_one[0])
@@ -280,8 +343,8 @@ class CameraSet:
         two_mean_stack = np.outer(two_mean, np.ones(len(points_in_two)))
         one_mat_meaned = one_mat - one_mean_stack
         two_mat_meaned = two_mat - two_mean_stack
-        one_squared_length_sum = np.sum(np.apply_along_axis(lambda x: np.square(np.linalg.norm(x)), 0, one_mat_meaned))
-        two_squared_length_sum = np.sum(np.apply_along_axis(lambda x: np.square(np.linalg.norm(x)), 0, two_mat_meaned))
+        one_squared_length_sum = np.sum(np.square(one_mat_meaned))
+        two_squared_length_sum = np.sum(np.square(two_mat_meaned))
         scale = np.sqrt(two_squared_length_sum / one_squared_length_sum)
 
         m = one_m.dot(two_m.T)
@@ -296,48 +359,14 @@ class CameraSet:
 
     @staticmethod
     def compute_robust_pose(camera_set_one: "CameraSet", camera_set_two: "CameraSet", with_scale=True,
-                            match_identifiers=False):
-        random.seed(123456789)
-
-        def get_random_subset(camera_set: "CameraSet", num=6):
-            return random.sample(camera_set.camera_poses, num)
-
+                            match_identifiers=False, num_hypotheses=300, local_optimization=False,
+                            seed=123456789):
+        """ RANSAC similarity (r incl. scale, t) moving the common poses of camera_set_one onto camera_set_two """
         #  Note: cs_one is usually colmap poses and cs_two is ar poses
-        camera_set_one_common = camera_set_one.get_common_poses(camera_set_two)
-        camera_set_two_common = camera_set_two.get_common_poses(camera_set_one)
-        camera_set_one_common.sort_by_identifier()
-        camera_set_two_common.sort_by_identifier()
-
-        r, t = None, None
-        min_positional = float("inf")
-        min_rotational = float("inf")
-        for i in range(300):
-            print(i)
-            """Calc and apply pose for cso -> subset space"""
-            cso_copy = CameraSet(camera_poses=list(camera_set_one_common.camera_poses))
-            curr_subset = CameraSet(camera_poses=get_random_subset(camera_set_two_common))
-
-            cso_common = cso_copy.get_common_poses(curr_subset)
-            temp_r, temp_t = CameraSet.compute_pose_quaternion(camera_set_one=cso_common,
-                                                               camera_set_two=curr_subset,
-                                                               match_identifiers=True)
-            transformation_translation_matrix = _create_transformation_translation_matrix(rotation_matrix=temp_r,
-                                                                                          translation_vector=temp_t)
-            cso_copy.apply_transform_4d(matrix_4d=transformation_translation_matrix)
-
-            """Calc errors"""
-            errors = CameraSet.compute_position_rotation_errors(cso_copy, camera_set_two_common,
-                                                                already_transformed=True)
-            position_errors = np.array([x["position_error"] for x in errors.values()])
-            rotation_errors = np.array([x["rotation_error"] for x in errors.values()])
-            median_p = np.median(position_errors)
-            median_r = np.median(rotation_errors)
-            if median_p < min_positional and median_r < min_rotational:
-                min_positional = median_p
-                min_rotational = median_r
-                r = temp_r
-                t = temp_t
-        return r, t
+        indices_one, indices_two = camera_set_one.join(camera_set_two)
+        return robust_similarity(camera_set_one.pose_array[indices_one], camera_set_two.pose_array[indices_two],
+                                 with_scale=with_scale, num_hypotheses=num_hypotheses,
+                                 local_optimization=local_optimization, seed=seed)
 
     @staticmethod
     def _compute_position_rotation_errors(camera_set_one: "CameraSet", camera_set_two: "CameraSet",
@@ -345,31 +374,23 @@ class CameraSet:
         """
         Helper function to compute errors between two Sets (only the common elements)
         """
-        camera_set_one_common = camera_set_one.get_common_poses(camera_set_two)
-        camera_set_two_common = camera_set_two.get_common_poses(camera_set_one)
+        indices_one, indices_two = camera_set_one.join(camera_set_two)
+        camera_set_one_common = camera_set_one.subset(indices_one)
 
         if not already_transformed:
             r, t = CameraSet.compute_pose_quaternion(camera_set_one=camera_set_one_common,
-                                                     camera_set_two=camera_set_two_common,
+                                                     camera_set_two=camera_set_two.subset(indices_two),
                                                      match_identifiers=True)
             transformation_translation_matrix = _create_transformation_translation_matrix(rotation_matrix=r,
                                                                                           translation_vector=t)
             camera_set_one_common.apply_transform_4d(matrix_4d=transformation_translation_matrix)
 
-        mapped = list(map(lambda x: (x, camera_set_two.find_by_identifier(x.identifier)),
-                          camera_set_one_common.camera_poses))
-        error_dict = {}
-        for one, two in mapped:
-            if one and two:
-                pd = CameraPose.compute_position_error(one, two)
-                rd = CameraPose.compute_rotation_error(one, two)
-            else:
-                pd, rd = None, None
-            error_dict.update({one.identifier: {
-                "position_error": pd,
-                "rotation_error": rd,
-            }})
-        return error_dict
+        one, two = camera_set_one_common.pose_array, camera_set_two.pose_array[indices_two]
+        position_errors, rotation_errors = metrics.position_errors(one, two), metrics.rotation_identity_errors(one, two)
+        return {
+            identifier: {"position_error": pd, "rotation_error": rd}
+            for identifier, pd, rd in zip(one.identifiers, position_errors.tolist(), rotation_errors.tolist())
+        }
 
     @staticmethod
     def compute_position_rotation_errors(camera_set_one: "CameraSet",
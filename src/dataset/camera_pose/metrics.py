@@ -0,0 +1,65 @@
+from typing import Dict, Sequence
+
+import numpy as np
+
+from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
+from src.dataset.camera_pose.enums_and_types import TransformationDirection
+
+
+def _paired(pose_array_one: CameraPoseArray, pose_array_two: CameraPoseArray):
+    """ both as C2W in the coordinate system of pose_array_one """
+    if len(pose_array_one) != len(pose_array_two):
+        raise ValueError("Pose arrays must be paired")
+    return pose_array_one.in_direction(TransformationDirection.C2W), \
+        pose_array_two.in_coordinate_system(pose_array_one.coordinate_system) \
+        .in_direction(TransformationDirection.C2W)
+
+
+def _relative_rotations(pose_array_one: CameraPoseArray, pose_array_two: CameraPoseArray) -> np.ndarray:
+    """ (N, 3, 3) R_one^-1 R_two """
+    one, two = _paired(pose_array_one, pose_array_two)
+    return np.swapaxes(one.rotation_matrices, 1, 2) @ two.rotation_matrices
+
+
+def position_errors(pose_array_one: CameraPoseArray, pose_array_two: CameraPoseArray) -> np.ndarray:
+    """ (N,) distances of the camera centers, as CameraPose.compute_position_error """
+    one, two = _paired(pose_array_one, pose_array_two)
+    return np.linalg.norm(one.positions - two.positions, axis=1)
+
+
+def rotation_identity_errors(pose_array_one: CameraPoseArray, pose_array_two: CameraPoseArray) -> np.ndarray:
+    """ (N,) || R_one^-1 R_two - I ||_F, as CameraPose.compute_rotation_error """
+    return np.linalg.norm(_relative_rotations(pose_array_one, pose_array_two) - np.identity(3), axis=(1, 2))
+
+
+def rotation_errors_in_rad(pose_array_one: CameraPoseArray, pose_array_two: CameraPoseArray) -> np.ndarray:
+    """ (N,) geodesic distance (angle of R_one^-1 R_two), as CameraPose.compute_rotation_error_in_rad """
+    relative = _relative_rotations(pose_array_one, pose_array_two)
+    # Note: atan2(sin, cos) stays accurate for small and large angles, unlike arccos of the trace
+    cos = (np.trace(relative, axis1=1, axis2=2) - 1) / 2
+    sin = np.linalg.norm(np.stack([relative[:, 2, 1] - relative[:, 1, 2],
+                                   relative[:, 0, 2] - relative[:, 2, 0],
+                                   relative[:, 1, 0] - relative[:, 0, 1]], axis=1), axis=1) / 2
+    return np.arctan2(sin, cos)
+
+
+def rotation_errors_in_degrees(pose_array_one: CameraPoseArray, pose_array_two: CameraPoseArray) -> np.ndarray:
+    return np.degrees(rotation_errors_in_rad(pose_array_one, pose_array_two))
+
+
+def pose_errors(pose_array_one: CameraPoseArray, pose_array_two: CameraPoseArray) -> Dict[str, np.ndarray]:
+    """ the errors of Camera.difference, each as (N,) array """
+    rad = rotation_errors_in_rad(pose_array_one, pose_array_two)
+    return {
+        "identity_error": rotation_identity_errors(pose_array_one, pose_array_two),
+        "rad": rad,
+        "degrees": np.degrees(rad),
+        "positional": position_errors(pose_array_one, pose_array_two),
+    }
+
+
+def pose_errors_of_poses(camera_poses_one: Sequence[CameraPose],
+                         camera_poses_two: Sequence[CameraPose]) -> Dict[str, np.ndarray]:
+    """ pose_errors of two lists of poses (paired by index) """
+    return pose_errors(CameraPoseArray.from_poses(camera_poses_one), CameraPoseArray.from_poses(camera_poses_two))
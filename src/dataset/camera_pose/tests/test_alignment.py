@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+
+from src.dataset.camera_pose.alignment import (robust_similarity,
+                                               similarity_residuals,
+                                               transformed, umeyama)
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
+from src.dataset.camera_pose.enums_and_types import CoordinateSystem
+
+
+def setup_pose_arrays(func):
+    def inner():
+        rng = np.random.default_rng(0)
+        num_poses = 40
+        pose_array_one = CameraPoseArray(Rotation.random(num_poses, random_state=0).as_matrix(),
+                                         rng.normal(size=(num_poses, 3)) * 5,
+                                         identifiers=[f"{i}" for i in range(num_poses)],
+                                         coordinate_system=CoordinateSystem.COLMAP)
+        r, t = 2.0 * Rotation.random(random_state=1).as_matrix(), np.array([1.0, -2.0, 3.0])
+        func(pose_array_one, transformed(pose_array_one, r, t), r, t)
+
+    return inner
+
+
+@setup_pose_arrays
+def test_umeyama(pose_array_one, pose_array_two, r, t):
+    samples = np.array([[0, 1, 2, 3], [4, 5, 6, 7]])
+    r_batched, t_batched = umeyama(pose_array_one.positions[samples], pose_array_two.positions[samples])
+    assert r_batched == pytest.approx(np.broadcast_to(r, (2, 3, 3)))
+    assert t_batched == pytest.approx(np.broadcast_to(t, (2, 3)))
+    position_errors, rotation_errors = similarity_residuals(r_batched, t_batched, pose_array_one, pose_array_two)
+    assert position_errors == pytest.approx(np.zeros((2, len(pose_array_one))), abs=1e-6)
+    assert rotation_errors == pytest.approx(np.zeros((2, len(pose_array_one))), abs=1e-6)
+
+
+@setup_pose_arrays
+def test_robust_similarity(pose_array_one, pose_array_two, r, t):
+    pose_array_two.translations[:10] += 20  # Note: a quarter outliers
+    for local_optimization in (False, True):
+        r_robust, t_robust = robust_similarity(pose_array_one, pose_array_two, local_optimization=local_optimization)
+        assert r_robust == pytest.approx(r)
+        assert t_robust == pytest.approx(t)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+
+from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
+from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
+                                                     TransformationDirection)
+
+
+def setup_camera_poses(func):
+    def inner():
+        rng = np.random.default_rng(0)
+        poses = [CameraPose(rotation=Rotation.from_rotvec(rng.normal(size=3)),
+                            translation=rng.normal(size=3),
+                            identifier=f"{i}",
+                            coordinate_system=CoordinateSystem.UNITY if i % 2 else CoordinateSystem.COLMAP,
+                            direction=TransformationDirection.C2W if i % 3 else TransformationDirection.W2C)
+                 for i in range(7)]
+        func(poses)
+
+    return inner
+
+
+def _assert_same_poses(pose_array: CameraPoseArray, poses):
+    for p, q in zip(pose_array, poses):
+        assert p.identifier == q.identifier
+        assert p.coordinate_system == q.coordinate_system and p.direction == q.direction
+        assert p.rotation_matrix == pytest.approx(q.rotation_matrix)
+        assert p.translation == pytest.approx(q.translation)
+
+
+@setup_camera_poses
+def test_from_poses(poses):
+    pose_array = CameraPoseArray.from_poses(poses, coordinate_system=CoordinateSystem.COLMAP,
+                                            direction=TransformationDirection.W2C)
+    _assert_same_poses(pose_array, [p.in_coordinate_system(CoordinateSystem.COLMAP)
+                                    .in_direction(TransformationDirection.W2C) for p in poses])
+
+
+@setup_camera_poses
+def test_inverse(poses):
+    pose_array = CameraPoseArray.from_poses(poses)
+    _assert_same_poses(pose_array.inverse(), [p.inverse() for p in pose_array])
+    _assert_same_poses(pose_array.inverse().inverse(), pose_array)
+    assert pose_array.positions == pytest.approx(np.array([p.position for p in pose_array]))
+
+
+@setup_camera_poses
+def test_in_coordinate_system(poses):
+    pose_array = CameraPoseArray.from_poses(poses, coordinate_system=CoordinateSystem.UNITY)
+    _assert_same_poses(pose_array.in_coordinate_system(CoordinateSystem.COLMAP),
+                       [p.in_coordinate_system(CoordinateSystem.COLMAP) for p in pose_array])
+
+
+@setup_camera_poses
+def test_compose(poses):
+    pose_array = CameraPoseArray.from_poses(poses)
+    composed = pose_array.compose(pose_array.inverse())
+    assert composed.rotation_matrices == pytest.approx(np.broadcast_to(np.identity(3), (len(poses), 3, 3)))
+    assert composed.translations == pytest.approx(np.zeros((len(poses), 3)))
+    matrices = pose_array.transformation_translation_matrices
+    assert pose_array.compose(pose_array[:1]).transformation_translation_matrices == \
+           pytest.approx(matrices @ matrices[:1])
+
+
+@setup_camera_poses
+def test_conversions(poses):
+    pose_array = CameraPoseArray.from_poses(poses)
+    assert pose_array.wxyz_quaternions == pytest.approx(np.array([p.wxyz_quaternion for p in pose_array]))
+    from_quaternions = CameraPoseArray.from_wxyz_quaternions(pose_array.wxyz_quaternions, pose_array.translations,
+                                                             identifiers=pose_array.identifiers,
+                                                             coordinate_system=pose_array.coordinate_system,
+                                                             direction=pose_array.direction)
+    _assert_same_poses(from_quaternions, pose_array.to_poses())
+    assert pose_array.rotation_translation_matrices == \
+           pytest.approx(np.array([p.rotation_translation_matrix for p in pose_array]))
+
+
+@setup_camera_poses
+def test_poses_do_not_share_translations(poses):
+    pose_array = CameraPoseArray.from_poses(poses)
+    translations = pose_array.translations.copy()
+    pose_array[0].apply_translation(np.ones(3))
+    pose_array.to_poses()[1].apply_translation(np.ones(3))
+    assert pose_array.translations == pytest.approx(translations)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+
+from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.camera_set import CameraSet
+from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
+                                                     TransformationDirection)
+
+
+def _random_poses(rng, num_poses, direction):
+    return [CameraPose(rotation=Rotation.from_rotvec(rng.normal(size=3)),
+                       translation=rng.normal(size=3),
+                       identifier=f"{i}",
+                       coordinate_system=CoordinateSystem.COLMAP,
+                       direction=direction) for i in range(num_poses)]
+
+
+def _assert_unified(camera_set: CameraSet):
+    for p, q in zip(camera_set.camera_poses, camera_set.pose_array):
+        assert p.coordinate_system == CoordinateSystem.COLMAP and p.direction == TransformationDirection.C2W
+        assert p.rotation_matrix == pytest.approx(q.rotation_matrix)
+        assert p.translation == pytest.approx(q.translation)
+
+
+def test_camera_poses_setter_unifies():
+    poses = _random_poses(np.random.default_rng(0), 5, TransformationDirection.W2C)
+    camera_set = CameraSet()
+    camera_set.camera_poses = poses
+    _assert_unified(camera_set)
+    assert camera_set.camera_poses[2].translation == pytest.approx(poses[2].inverse().translation)
+    assert camera_set.index_of("2") == 2
+
+
+def test_refresh_after_pose_change():
+    camera_set = CameraSet(_random_poses(np.random.default_rng(0), 5, TransformationDirection.C2W))
+    camera_set.apply_translation(np.ones(3))
+    _assert_unified(camera_set)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+
+from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
+from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
+                                                     TransformationDirection)
+from src.dataset.camera_pose.metrics import pose_errors
+
+
+def _random_poses(rng, num_poses, direction):
+    return [CameraPose(rotation=Rotation.from_rotvec(rng.normal(size=3)),
+                       translation=rng.normal(size=3),
+                       identifier=f"{i}",
+                       coordinate_system=CoordinateSystem.COLMAP,
+                       direction=direction) for i in range(num_poses)]
+
+
+def test_pose_errors():
+    rng = np.random.default_rng(0)
+    poses_one = _random_poses(rng, 10, TransformationDirection.C2W)
+    poses_two = _random_poses(rng, 10, TransformationDirection.W2C)
+    errors = pose_errors(CameraPoseArray.from_poses(poses_one), CameraPoseArray.from_poses(poses_two))
+    assert errors["identity_error"] == pytest.approx([CameraPose.compute_rotation_error(p, q)
+                                                      for p, q in zip(poses_one, poses_two)])
+    assert errors["rad"] == pytest.approx([CameraPose.compute_rotation_error_in_rad(p, q)
+                                           for p, q in zip(poses_one, poses_two)])
+    assert errors["degrees"] == pytest.approx([CameraPose.compute_rotation_error_in_degrees(p, q)
+                                               for p, q in zip(poses_one, poses_two)])
+    assert errors["positional"] == pytest.approx([CameraPose.compute_position_error(p, q)
+                                                  for p, q in zip(poses_one, poses_two)])
+
+
+def test_pose_errors_of_identical_poses():
+    pose_array = CameraPoseArray.from_poses(_random_poses(np.random.default_rng(1), 5, TransformationDirection.C2W))
+    for error in pose_errors(pose_array, pose_array.inverse()).values():
+        assert error == pytest.approx(np.zeros(5), abs=1e-7)
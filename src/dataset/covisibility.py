@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+@dataclass
+class CovisibilityIndex:
+    """
+    Symmetric (num_images, num_images) matrix of the number of 3d points two entries share, zero on the diagonal.
+    Indices are positions in datasetEntries.
+    """
+    matrix: sparse.csr_matrix
+    num_points_per_image: np.ndarray  # distinct 3d points observed by each entry
+
+    @property
+    def num_images(self):
+        return self.matrix.shape[0]
+
+    @property
+    def degrees(self) -> np.ndarray:
+        """ number of entries every entry shares at least one point with """
+        return np.diff(self.matrix.indptr)
+
+    @staticmethod
+    def from_incidence_matrix(incidence: sparse.csr_matrix) -> "CovisibilityIndex":
+        """ incidence: (num_images, num_points), 1 where the entry observes the point """
+        incidence = sparse.csr_matrix(incidence, dtype=np.int32)  # Note: half the memory of int64 / float64
+        covisibility = (incidence @ incidence.T).tocsr()
+        diagonal = covisibility.diagonal()
+        covisibility.setdiag(0)  # Note: every observing entry has its diagonal entry, no change of the structure
+        covisibility.eliminate_zeros()
+        return CovisibilityIndex(matrix=covisibility, num_points_per_image=diagonal)
+
+    @staticmethod
+    def from_observation_table(table: "ObservationTable") -> "CovisibilityIndex":
+        return CovisibilityIndex.from_incidence_matrix(table.incidence_matrix())
+
+    def shared_points(self, image_index, other_image_index) -> int:
+        return int(self.matrix[image_index, other_image_index])
+
+    def neighbours(self, image_index, min_shared=1) -> Tuple[np.ndarray, np.ndarray]:
+        """ (indices, shared point counts) of the entries sharing at least min_shared points, most shared first """
+        start, end = self.matrix.indptr[image_index], self.matrix.indptr[image_index + 1]
+        indices, counts = self.matrix.indices[start:end], self.matrix.data[start:end]
+        mask = counts >= min_shared
+        order = np.argsort(-counts[mask], kind="stable")
+        return indices[mask][order], counts[mask][order]
+
+    def thresholded(self, min_shared) -> sparse.csr_matrix:
+        """ the matrix without the edges of less than min_shared shared points """
+        if min_shared <= 1:
+            return self.matrix
+        m = self.matrix.copy()
+        m.data[m.data < min_shared] = 0
+        m.eliminate_zeros()
+        return m
+
+    def connected_components(self, min_shared=1) -> Tuple[int, np.ndarray]:
+        """ (number of components, component label per entry) of the graph of edges with at least min_shared """
+        return csgraph.connected_components(self.thresholded(min_shared), directed=False)
+
+    def largest_component(self, min_shared=1) -> np.ndarray:
+        _, labels = self.connected_components(min_shared)
+        return np.flatnonzero(labels == np.argmax(np.bincount(labels))) if len(labels) else labels
+
+    def greedy_subset(self, camera_limit, start=0, min_shared=1) -> np.ndarray:
+        """
+        Connected subset (sorted indices): begins with start and repeatedly adds the entry sharing the most points
+        with the subset. Stops early when nothing left shares at least min_shared points with the subset.
+        """
+        camera_limit = self.num_images if camera_limit is None else min(camera_limit, self.num_images)
+        if camera_limit <= 0:
+            return np.zeros(0, dtype=np.int64)
+        indptr, indices, data = self.matrix.indptr, self.matrix.indices, self.matrix.data
+        shared = np.zeros(self.num_images)
+        selected = np.zeros(self.num_images, dtype=bool)
+        best = start
+        for _ in range(camera_limit):
+            selected[best] = True
+            shared[best] = -np.inf
+            neighbours = indices[indptr[best]:indptr[best + 1]]
+            # Note: only rows of the subset are touched, no dense (num_images, num_images) matrix
+            shared[neighbours] += np.where(selected[neighbours], 0, data[indptr[best]:indptr[best + 1]])
+            best = int(np.argmax(shared))
+            if shared[best] < min_shared:
+                break
+        return np.flatnonzero(selected)
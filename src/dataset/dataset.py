@@ -1,18 +1,29 @@
 import copy
-from collections import Counter
 from dataclasses import dataclass, field
-from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from warnings import warn
 
 from scipy.spatial.transform import Rotation
 
-from src.benchmark.multiprocesser import ListMultiProcessor
-from src.dataset import np  # For the seed and reproducibility
+from src.dataset import SEED, np  # For the seed and reproducibility
+from src.dataset.camera import Camera
+from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.enums_and_types import TransformationDirection
+from src.dataset.covisibility import CovisibilityIndex
 from src.dataset.datasetEntry import DatasetEntry
+from src.dataset.helpers import gc_paused
 from src.dataset.loss_functions import LossFunction
+from src.dataset.noise import intrinsics_noise, noised_poses, random_directions
 from src.dataset.point import Point2D, Point3D
+from src.dataset.reduction import (CameraSelection, ObservationTable,
+                                   PointSelection, Selection,
+                                   points2d_without_3d, points3d_xyz, select)
+from src.dataset.reprojection import (ReprojectionBackend, ReprojectionErrors,
+                                      reprojection_errors)
+from src.dataset.spatial_index import SpatialIndex
+from src.dataset.tracks import Tracks
+from src.tracing import traced
 
 
 @dataclass
@@ -21,81 +32,153 @@ class Dataset:
     points3D_mapped: Dict = field(init=False)
     datasetEntries: List[DatasetEntry]
     name: Optional[str] = None
+    tracks: Optional[Tracks] = None  # Note: shared (read-only) between all copies of a dataset
 
     def __post_init__(self):
-        self.points3D_mapped = {p.identifier: p for p in self.points3D}
+        self.refresh_mapping()
 
     def refresh_mapping(self):
         self.points3D_mapped = {p.identifier: p for p in self.points3D}
+        # Note: assigned (not cleared), shallow copies of a dataset keep the caches of the original
+        self._observation_table = None
+        self._selections = {}
+        self._spatial_index = None
 
-    @staticmethod
-    def _random_direction():  # TODO: helper methods
-        r = np.random.rand(3)
-        r /= np.linalg.norm(r)
-        return r
+    def __copy__(self):  # Note: without it copy.copy would go through __getstate__ and drop the caches
+        dataset = self.__class__.__new__(self.__class__)
+        dataset.__dict__.update(self.__dict__)
+        dataset._selections = dict(self._selections)
+        return dataset
 
-    @staticmethod
-    def _random_direction_2d():  # TODO: helper methods
-        r = np.random.rand(2)
-        r /= np.linalg.norm(r)
-        return r
+    def __getstate__(self):  # Note: caches are not pickled (and absent in old pickles)
+        state = self.__dict__.copy()
+        state.pop("_observation_table", None)
+        state.pop("_selections", None)
+        state.pop("_spatial_index", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._observation_table = None
+        self._selections = {}
+        self._spatial_index = None
+
+    def observation_table(self) -> ObservationTable:
+        """ cached until refresh_mapping """
+        if self._observation_table is None:
+            self._observation_table = ObservationTable.from_dataset(self)
+        return self._observation_table
+
+    def covisibility_index(self) -> CovisibilityIndex:
+        """ which entries share how many points, cached with the observation table until refresh_mapping """
+        return self.observation_table().covisibility()
+
+    def spatial_index(self) -> SpatialIndex:
+        """ KD-tree over the positions of points3D, cached until refresh_mapping """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(points3d_xyz(self.points3D))
+        return self._spatial_index
+
+    def points_subset(self, point_indices) -> "Dataset":
+        """
+        snapshot with only the points at point_indices (e.g. the result of a spatial index query) and the entries
+        observing at least one of them, the other 2d points lose their 3d point identifier
+        """
+        table = self.observation_table()
+        point_indices = np.unique(np.asarray(point_indices, dtype=np.int64))
+        kept = np.zeros(table.num_points, dtype=bool)
+        kept[point_indices] = True
+        observation_mask = (table.point3d_indices >= 0) & kept[table.point3d_indices]
+        selection = Selection(table=table, camera_indices=np.unique(table.image_indices[observation_mask]),
+                              observation_mask=observation_mask, point3d_indices=point_indices)
+        return self.snapshot(
+            points3D=[self.points3D[i] for i in selection.point3d_indices.tolist()],
+            entry_indices=selection.camera_indices,
+            dropped_point2d_indices=selection.dropped_point2d_indices,
+        )
+
+    def reduction_selection(self, camera_limit, points_limit, camera_selection=CameraSelection.FIRST_N,
+                            point_selection=PointSelection.FIRST_N) -> Selection:
+        """ cached until refresh_mapping, shared by make_reduced_dataset and the benchmarks' results datasets """
+        key = (camera_limit, points_limit, camera_selection, point_selection)
+        if key not in self._selections:
+            self._selections[key] = select(self.observation_table(), camera_limit, points_limit,
+                                           camera_selection=camera_selection, point_selection=point_selection)
+        return self._selections[key]
 
     @staticmethod
     def with_noise(dataset: "Dataset", point3d_noise=3e-2, camera_rotation_noise=5e-2, camera_translation_noise=5e-2,
-                   camera_intrinsics_noise=10, point2d_noise=1):
-        new_dataset = copy.deepcopy(dataset)  # TODO: this is not performant
-        for p in new_dataset.points3D:
-            p.translate_np(Dataset._random_direction() * point3d_noise)  # * np.random.randn(3))
-        for d in new_dataset.datasetEntries:
-            d.camera.camera_pose.apply_move(  # TODO: check which distributions to use for random
-                Dataset._random_direction() * camera_translation_noise  # * np.random.randn(3)
-            )
-            d.camera.camera_pose.apply_transform_3d(
-                Rotation.from_rotvec(
-                    Dataset._random_direction() * camera_rotation_noise
-                ).as_matrix()  # * np.random.randn(3)
-            )
-            d.camera.camera_intrinsics.apply_noise(np.random.rand(3, 3) * camera_intrinsics_noise)
-            for p2 in d.points2D:
-                p2.translate_np(Dataset._random_direction_2d() * point2d_noise)
-            d.refresh_mapping()
-            new_dataset.refresh_mapping()
-        return new_dataset
+                   camera_intrinsics_noise=10, point2d_noise=1, seed=SEED):
+        """
+        Returns a noised copy, the original dataset is left untouched.
+        All noise is drawn at once per kind (3d points, cameras, intrinsics, 2d points) from one generator,
+        seeded with seed (default: the package SEED, i.e. the same noise every run; None draws fresh entropy).
+        """
+        rng = np.random.default_rng(seed)
+        entries = dataset.datasetEntries
+
+        xyz = points3d_xyz(dataset.points3D)
+        xyz += random_directions(rng, len(xyz)) * point3d_noise
+
+        poses = [d.camera.camera_pose for d in entries]
+        rotations, translations = noised_poses(
+            rng,
+            rotations=Rotation.concatenate([p.rotation for p in poses]) if poses else Rotation.identity(0),
+            translations=np.array([p.translation for p in poses], dtype=float).reshape((-1, 3)),
+            w2c=[p.direction == TransformationDirection.W2C for p in poses],
+            rotation_noise=camera_rotation_noise,
+            translation_noise=camera_translation_noise,
+        )
+        intrinsics_noise_matrices = intrinsics_noise(rng, len(entries), camera_intrinsics_noise)
+
+        num_points_2d = sum(len(d.points2D) for d in entries)
+        xy = np.fromiter((c for d in entries for p in d.points2D for c in (p.x, p.y)), dtype=float,
+                         count=2 * num_points_2d).reshape((-1, 2))
+        xy += random_directions(rng, len(xy), dim=2) * point2d_noise
+
+        with gc_paused():
+            new_points3D = [Point3D(p.identifier, x, y, z, p.metadata)
+                            for p, x, y, z in zip(dataset.points3D, *xyz.T.tolist())]
+            new_entries = []
+            xs, ys = xy.T.tolist()
+            end = 0
+            for index, d in enumerate(entries):
+                start, end = end, end + len(d.points2D)
+                pose = d.camera.camera_pose
+                camera = Camera(
+                    camera_pose=CameraPose(rotation=rotations[index], translation=translations[index],
+                                           identifier=pose.identifier, coordinate_system=pose.coordinate_system,
+                                           direction=pose.direction),
+                    camera_intrinsics=copy.deepcopy(d.camera.camera_intrinsics),
+                    width=d.camera.width,
+                    height=d.camera.height,
+                )
+                camera.camera_intrinsics.apply_noise(intrinsics_noise_matrices[index])
+                new_entries.append(DatasetEntry(
+                    image_metadata=d.image_metadata,
+                    points2D=[Point2D(p.identifier, x, y, p.point3D_identifier, p.metadata)
+                              for p, x, y in zip(d.points2D, xs[start:end], ys[start:end])],
+                    camera=camera,
+                ))
+            return Dataset(points3D=new_points3D, datasetEntries=new_entries, name=dataset.name, tracks=dataset.tracks)
 
     @staticmethod
     def with_noise_mp(dataset: "Dataset", point3d_noise=3e-2, camera_rotation_noise=5e-2, camera_translation_noise=5e-2,
-                      camera_intrinsics_noise=10, point2d_noise=1):
-        new_dataset = copy.deepcopy(dataset)  # TODO: this is not performant
-        x = copy.deepcopy(new_dataset.points3D[0])
-
-        def _process_p(p, point3d_noise):
-            return p.translated_np(Dataset._random_direction() * point3d_noise)
-
-        print(new_dataset.points3D[0])
-        l = ListMultiProcessor(new_dataset.points3D, partial(_process_p, point3d_noise=3e-2))
-
-        new_dataset.points3D = l.process()
-
-        def _process_d(d: DatasetEntry):
-            d.camera.camera_pose.apply_move(  # TODO: check which distributions to use for random
-                Dataset._random_direction() * camera_translation_noise  # * np.random.randn(3)
-            )
-            d.camera.camera_pose.apply_transform_3d(
-                Rotation.from_rotvec(
-                    Dataset._random_direction() * camera_rotation_noise
-                ).as_matrix()  # * np.random.randn(3)
-            )
-            d.camera.camera_intrinsics.apply_noise(np.random.rand(3, 3) * camera_intrinsics_noise)
-            points2D = []
-            for p2 in d.points2D:
-                points2D.append(p2.translated_np(Dataset._random_direction_2d() * point2d_noise))
-            return DatasetEntry(image_metadata=d.image_metadata, points2D=points2D, camera=copy.deepcopy(d.camera))
-
-        l = ListMultiProcessor(dataset.datasetEntries, _process_d)
-        new_dataset.datasetEntries = l.process()
-
-        new_dataset.refresh_mapping()
-        return new_dataset
+                      camera_intrinsics_noise=10, point2d_noise=1, seed=SEED):
+        """ Deprecated: with_noise is vectorized, there is nothing left to parallelize """
+        return Dataset.with_noise(dataset, point3d_noise=point3d_noise, camera_rotation_noise=camera_rotation_noise,
+                                  camera_translation_noise=camera_translation_noise,
+                                  camera_intrinsics_noise=camera_intrinsics_noise, point2d_noise=point2d_noise,
+                                  seed=seed)
+
+    def track(self, point3d_identifier):
+        """ returns (image_ids, point2d_idxs) of the point's track as views into self.tracks """
+        if self.tracks is None:
+            raise AttributeError("dataset has no tracks")
+        track_index = self.points3D_mapped[point3d_identifier].metadata.get("track_index")
+        if track_index is None:
+            return self.tracks.track_of(point3d_identifier)
+        return self.tracks.track(track_index)
 
     @property
     def images_path(self):
@@ -114,13 +197,13 @@ class Dataset:
         return reprojection_errors
 
     def compute_reprojection_errors_alt(self, loss_function: LossFunction):
-        reprojection_errors = {}
-        for index, de in enumerate(self.datasetEntries):
-            p2d, p3d = de.map2d_3d(self.points3D_mapped, zipped=False, np=True)
-            reprojection_errors.update({
-                index: de.camera.compute_projection_errors_alt(p2d=p2d, p3d=p3d, loss_function=loss_function)
-            })
-        return reprojection_errors
+        """ {image index: per observation errors}, see reprojection_errors for the flat arrays """
+        return self.reprojection_errors(loss_function).per_image()
+
+    @traced
+    def reprojection_errors(self, loss_function: LossFunction = LossFunction.TRIVIAL_LOSS,
+                            backend=ReprojectionBackend.NUMPY) -> ReprojectionErrors:
+        return reprojection_errors(self, loss_function=loss_function, backend=backend)
 
     # def compute_reprojection_errors_threaded(self):
     #     reprojection_errors = {}
@@ -150,15 +233,21 @@ class Dataset:
     def num_images(self):
         return len(self.datasetEntries)
 
+    def points_per_image(self):
+        """ (num 2d points, num 2d points with 3d) per entry, in one pass over the (cached) entry indices """
+        counts = np.array([(len(de.points2D), len(de.indices_with_3d)) for de in self.datasetEntries],
+                          dtype=np.int64).reshape((-1, 2))
+        return counts[:, 0], counts[:, 1]
+
     #  @property
     def avg_num_3d_points_per_image(self):  # TODO: avg or median(?)
-        return np.average([de.num_3d_points for de in self.datasetEntries])
+        return np.average(self.points_per_image()[1])
 
     #  @property
     def avg_num_2d_points_per_image(self):
-        return np.average([de.num_2d_points for de in self.datasetEntries])
+        return np.average(self.points_per_image()[0])
 
-    def __deepcopy__(self, memodict):
+    def __deepcopy__(self, memodict):  # Note: a full copy of every point, see snapshot for cheap derived datasets
         return Dataset(
             points3D=list(map(lambda p: Point3D(p.identifier, p.x, p.y, p.z, p.metadata), self.points3D)),
             datasetEntries=list(map(lambda de: DatasetEntry(
@@ -166,53 +255,82 @@ class Dataset:
                 points2D=list(
                     map(lambda p: Point2D(p.identifier, p.x, p.y, p.point3D_identifier, p.metadata), de.points2D)),
                 camera=copy.deepcopy(de.camera)
-            ), self.datasetEntries))
+            ), self.datasetEntries)),
+            name=self.name,
+            tracks=self.tracks,
         )
 
-    def make_reduced_dataset(self, camera_limit, points_limit):
-        """ WARNING: THIS RETURNS A SHALLOW COPY. MOST OBJECT REFERENCE STUFF IN THE ORIGINAL DATASET """
-        shallow_dataset = copy.copy(self)
-        shallow_dataset.datasetEntries = [copy.copy(de) for de in self.datasetEntries[: camera_limit]]
-        points_3d_by_camera_limit_times_cameras_sorted = sorted(
-            list(Counter([p3d for d_entry in shallow_dataset.datasetEntries for p2d, p3d in
-                          d_entry.map2d_3d(self.points3D_mapped)[: points_limit]]).items())
-            , key=lambda x: x[1]
-        )
-        shallow_dataset.points3D = [x[0] for x in points_3d_by_camera_limit_times_cameras_sorted if
-                                    x[1] >= 2]
-        point3d_ids = [p.identifier for p in shallow_dataset.points3D]
+    def snapshot(self, cameras: Dict[int, Camera] = None, points3D: List[Point3D] = None, entry_indices=None,
+                 dropped_point2d_indices: Callable[[int], np.ndarray] = None) -> "Dataset":
+        """
+        Copy-on-write view of the dataset: only the passed blocks are new, everything else (2d points, image
+        metadata, tracks, the entry caches and, if still valid, the observation table) is shared with this dataset.
+        Nothing of a snapshot may be modified in place, replace it instead.
 
-        shallow_dataset.refresh_mapping()
+        cameras: {index in the snapshot: camera} replacing the entries' cameras
+        points3D: replaces the 3d points
+        entry_indices: the entries of this dataset (in snapshot order) to keep, default all
+        dropped_point2d_indices: image_index (in this dataset) -> positions in points2D to copy without 3d point
+        """
+        snapshot = copy.copy(self)
+        if points3D is not None:
+            snapshot.points3D = points3D
 
-        for de in shallow_dataset.datasetEntries:
-            point_ids_we_want = [p.identifier for p in de.points_with_3d()[: points_limit]
-                                 if p.point3D_identifier in point3d_ids]
+        image_indices = range(len(self.datasetEntries)) if entry_indices is None else np.asarray(entry_indices).tolist()
+        entries_changed = entry_indices is not None
+        if cameras or dropped_point2d_indices or entries_changed:
+            cameras = cameras or {}
+            snapshot.datasetEntries = []
+            for index, image_index in enumerate(image_indices):
+                de = self.datasetEntries[image_index]
+                dropped = dropped_point2d_indices(image_index) if dropped_point2d_indices else ()
+                if index in cameras or len(dropped):
+                    de = copy.copy(de)  # Note: shares points2D and its caches until they are replaced
+                    if index in cameras:
+                        de.camera = cameras[index]
+                    if len(dropped):
+                        # Note: the list is a new object, only the dropped points are copied
+                        de.points2D = points2d_without_3d(de.points2D, dropped)
+                        de.refresh_mapping()
+                        entries_changed = True
+                snapshot.datasetEntries.append(de)
 
-            # Shallow copy of list
-            de.points2D = copy.copy(de.points2D)
-            for i in range(len(de.points2D)):
-                if de.points2D[i].identifier not in point_ids_we_want:
-                    point_copy = copy.deepcopy(de.points2D[i])
-                    point_copy.point3D_identifier = None
-                    # Note: the list is a new object, created by copy.copy(...)
-                    de.points2D[i] = point_copy
-            de.refresh_mapping()
+        if points3D is not None or entries_changed:
+            snapshot.refresh_mapping()
+            if points3D is None:
+                snapshot._spatial_index = self._spatial_index  # Note: the very same points
+            elif self._same_point_ids(points3D):
+                self._share_point_caches(snapshot, entries_changed)
+        return snapshot
 
-        return shallow_dataset
+    def _share_point_caches(self, snapshot: "Dataset", entries_changed):
+        """ same points (identifiers and order) at new positions: the caches only need the new coordinates """
+        table = None if entries_changed else self._observation_table
+        if table is None and self._spatial_index is None:
+            return
+        xyz = points3d_xyz(snapshot.points3D)
+        if table is not None:
+            snapshot._observation_table = table.with_xyz(xyz)
+        if self._spatial_index is not None:
+            snapshot._spatial_index = self._spatial_index.with_positions(xyz)
 
-    def get_reduced_dataset_2d_ids_per_camera(self, cameras_limit, points_limit, as_list=False):
-        points_3d_by_camera_limit_times_cameras_sorted = sorted(
-            list(Counter([p3d for d_entry in self.datasetEntries[:cameras_limit] for p2d, p3d in
-                          d_entry.map2d_3d(self.points3D_mapped)[: points_limit]]).items())
-            , key=lambda x: x[1]
+    def _same_point_ids(self, points3D):
+        return len(points3D) == len(self.points3D) and \
+            all(p.identifier == q.identifier for p, q in zip(points3D, self.points3D))
+
+    @traced
+    def make_reduced_dataset(self, camera_limit, points_limit, camera_selection=CameraSelection.FIRST_N,
+                             point_selection=PointSelection.FIRST_N):
+        """ snapshot, unchanged points and entries are shared with this dataset """
+        selection = self.reduction_selection(camera_limit, points_limit, camera_selection, point_selection)
+        return self.snapshot(
+            points3D=[self.points3D[i] for i in selection.point3d_indices.tolist()],
+            entry_indices=selection.camera_indices,
+            dropped_point2d_indices=selection.dropped_point2d_indices,
         )
-        point3d_ids = [x[0].identifier for x in points_3d_by_camera_limit_times_cameras_sorted
-                       if x[1] >= 2]
-        res = {
-            index: [p.identifier for p in de.points_with_3d()[: points_limit]
-                    if p.point3D_identifier in point3d_ids]
-            for index, de in enumerate(self.datasetEntries[:cameras_limit])
-        }
+
+    def get_reduced_dataset_2d_ids_per_camera(self, cameras_limit, points_limit, as_list=False):
+        res = self.reduction_selection(cameras_limit, points_limit).point2d_ids_per_camera()
         if as_list:
             return list(res.values())
         return res
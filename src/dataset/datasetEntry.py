@@ -1,6 +1,8 @@
 from dataclasses import dataclass, field
 from typing import Dict, List
 
+import numpy as np
+
 from src.dataset.camera import Camera
 from src.dataset.imageMetadata import ImageMetadata
 from src.dataset.point import Point2D
@@ -14,22 +16,71 @@ class DatasetEntry:
     camera: Camera
 
     def __post_init__(self):
-        self.points2D_mapped = {p.identifier: p for p in self.points2D}
+        self.refresh_mapping()
+
+    def __copy__(self):  # Note: without it copy.copy would go through __getstate__ and drop the caches
+        entry = self.__class__.__new__(self.__class__)
+        entry.__dict__.update(self.__dict__)
+        return entry
+
+    def __getstate__(self):  # Note: caches are not pickled (and absent in old pickles)
+        state = self.__dict__.copy()
+        state.pop("_indices_with_3d", None)
+        state.pop("_point3d_ids", None)
+        state.pop("_points_with_3d", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._clear_3d_cache()
+
+    def _clear_3d_cache(self):
+        # Note: assigned (not cleared), shallow copies of an entry keep the caches of the original
+        self._indices_with_3d = None
+        self._point3d_ids = None
+        self._points_with_3d = None
+
+    def _build_3d_cache(self):
+        points2D = self.points2D
+        indices = [i for i, p in enumerate(points2D) if p.point3D_identifier]
+        self._points_with_3d = [points2D[i] for i in indices]
+        self._indices_with_3d = np.array(indices, dtype=np.int64)
+        self._point3d_ids = np.fromiter((p.point3D_identifier for p in self._points_with_3d), dtype=np.int64,
+                                        count=len(indices))
 
     def points_with_3d(self):
-        return list(filter(lambda x: x.point3D_identifier, self.points2D))
+        """ cached until refresh_mapping, the returned list is shared and must not be modified """
+        if self._points_with_3d is None:
+            self._build_3d_cache()
+        return self._points_with_3d
+
+    @property
+    def indices_with_3d(self) -> np.ndarray:
+        """ positions in points2D of the points with a 3d point identifier """
+        if self._indices_with_3d is None:
+            self._build_3d_cache()
+        return self._indices_with_3d
+
+    @property
+    def point3d_ids(self) -> np.ndarray:
+        """ 3d point identifiers of points_with_3d() """
+        if self._point3d_ids is None:
+            self._build_3d_cache()
+        return self._point3d_ids
 
     def refresh_mapping(self):  # TODO: Technically using @property would be better but slows down debugging
+        """ has to be called after points2D (or one of its points) was replaced """
         self.points2D_mapped = {p.identifier: p for p in self.points2D}
+        self._clear_3d_cache()
 
     def map2d_3d(self, points3D_mapped, zipped=True, np=False):
+        points_with_3d = self.points_with_3d()
         if zipped:
             if not np:
-                return [(p, points3D_mapped.get(p.point3D_identifier)) for p in self.points_with_3d()]
-            return [(p.xy, points3D_mapped.get(p.point3D_identifier).xyz) for p in self.points_with_3d()]
-        points_with_3d = self.points_with_3d()
+                return [(p, points3D_mapped.get(p.point3D_identifier)) for p in points_with_3d]
+            return [(p.xy, points3D_mapped.get(p.point3D_identifier).xyz) for p in points_with_3d]
         if not np:
-            return points_with_3d, [points3D_mapped.get(p.point3D_identifier) for p in points_with_3d]
+            return list(points_with_3d), [points3D_mapped.get(p.point3D_identifier) for p in points_with_3d]
         return list(map(lambda p: p.xy, points_with_3d)), \
             [points3D_mapped.get(p.point3D_identifier).xyz for p in points_with_3d]
 
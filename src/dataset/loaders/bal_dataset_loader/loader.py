@@ -0,0 +1,73 @@
+import bz2
+import os
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from src.config import DATASETS_PATH
+from src.dataset.bundle_adjustment_problem import BundleAdjustmentProblem
+from src.tracing import traced
+
+BAL_CAMERA_PARAMS = 9  # Note: rodrigues vector, translation, focal length, k1, k2
+FLIP_YZ = np.diag([1.0, -1.0, -1.0])  # Note: BAL cameras look down -z with y up, colmap down +z with y down
+
+
+def _open_bal(path):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt")
+    return open(path, "r")
+
+
+@traced
+def load_bal_problem(path, name=None) -> BundleAdjustmentProblem:
+    """
+    Loads a problem in the "Bundle Adjustment in the Large" text format (plain or .bz2).
+    The file is parsed in two streamed blocks (observations, parameters), never as one string.
+    Note: BAL image coordinates are centered, the principal point is placed at the center of the
+          bounding box of each camera's observations; the radial distortion is not modelled by the solvers
+    """
+    with _open_bal(path) as f:
+        num_cameras, num_points, num_observations = map(int, f.readline().split())
+        observations = np.loadtxt(f, max_rows=num_observations, ndmin=2)
+        params = np.loadtxt(f, ndmin=1).ravel()
+
+    if len(observations) != num_observations or len(params) != num_cameras * BAL_CAMERA_PARAMS + num_points * 3:
+        raise ValueError(f"{path} is truncated or not a BAL file")
+
+    camera_indices = observations[:, 0].astype(np.int64)
+    point_indices = observations[:, 1].astype(np.int64)
+    cameras = params[:num_cameras * BAL_CAMERA_PARAMS].reshape((num_cameras, BAL_CAMERA_PARAMS))
+    points_3d = params[num_cameras * BAL_CAMERA_PARAMS:].reshape((num_points, 3))
+
+    poses = np.empty((num_cameras, 3, 4))
+    poses[:, :, :3] = FLIP_YZ @ Rotation.from_rotvec(cameras[:, :3]).as_matrix()
+    poses[:, :, 3] = cameras[:, 3:6] @ FLIP_YZ
+
+    half_extent = np.zeros((num_cameras, 2))
+    np.maximum.at(half_extent, camera_indices, np.abs(observations[:, 2:4]))
+    half_extent = np.ceil(np.where(half_extent > 0, half_extent, half_extent.max(axis=0)))
+    widths, heights = (2 * half_extent).astype(np.int64).T
+
+    intrinsics = np.zeros((num_cameras, 3, 3))
+    intrinsics[:, 0, 0] = intrinsics[:, 1, 1] = cameras[:, 6]
+    intrinsics[:, :2, 2] = half_extent
+    intrinsics[:, 2, 2] = 1.0
+
+    points_2d = half_extent[camera_indices] + observations[:, 2:4] * [1.0, -1.0]
+    return BundleAdjustmentProblem(
+        poses=poses,
+        intrinsics=intrinsics,
+        points_3d=points_3d,
+        camera_indices=camera_indices,
+        point_indices=point_indices,
+        points_2d=points_2d,
+        widths=widths,
+        heights=heights,
+        name=name if name else os.path.basename(path).split(".")[0],
+        distortion=cameras[:, 7:9].copy(),
+    )
+
+
+if __name__ == "__main__":
+    problem = load_bal_problem(os.path.join(DATASETS_PATH, "bal", "problem-49-7776-pre.txt.bz2"))
+    print(problem, problem.cost())
@@ -4,6 +4,8 @@ from dataclasses import dataclass
 from enum import Enum
 from typing import List
 
+import numpy as np
+
 from src.config import DATASETS_PATH
 from src.dataset.loaders.colmap_dataset_loader.read_write_model import \
     read_cameras_text
@@ -58,6 +60,26 @@ def read_cameras_bin(file):
     return {cc.camera_id: cc for cc in cameras}
 
 
+def camera_record_dtype(num_camera_params):
+    # Note: packed little-endian layout of one cameras.bin record
+    return np.dtype([("camera_id", "<i4"), ("model_id", "<i4"), ("width", "<u8"), ("height", "<u8"),
+                     ("params", "<f8", (num_camera_params,))])
+
+
+def write_cameras_bin(file, camera_ids, camera_model_type: CameraModelType, widths, heights, params):
+    """ writes all cameras (of the same model) at once, params has shape (num_cameras, num_camera_params) """
+    params = np.asarray(params, dtype=np.float64)
+    records = np.empty(len(camera_ids), dtype=camera_record_dtype(params.shape[1]))
+    records["camera_id"] = camera_ids
+    records["model_id"] = camera_model_type.value
+    records["width"] = widths
+    records["height"] = heights
+    records["params"] = params
+    with open(file, "wb") as f:
+        np.array([len(records)], dtype="<u8").tofile(f)
+        records.tofile(f)
+
+
 def read_cameras_txt(file):
     c = read_cameras_text(file)
     c = list(map(lambda x: Camera(x.id, CameraModelType[x.model], x.width, x.height, x.params), c.values()))
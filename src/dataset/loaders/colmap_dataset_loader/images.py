@@ -3,6 +3,8 @@ import struct
 from dataclasses import dataclass
 from typing import List, Union
 
+import numpy as np
+
 from src.config import DATASETS_PATH
 from src.dataset.loaders.colmap_dataset_loader.read_write_model import \
     read_images_text
@@ -36,6 +38,9 @@ class Image:
     point2d_entries: List[Point2dEntry]
 
 
+INVALID_POINT3D_ID = 18446744073709551615  # Note: (uint64) -1, used by colmap for 2d points without 3d point
+
+
 def read_images_bin(file):
     images = []
     with open(file, "rb") as f:
@@ -48,13 +53,45 @@ def read_images_bin(file):
             point2d_entries = []
             for i in range(num_points):
                 x, y, point3d_id = struct.unpack_from("<2dQ", f.read(24))
-                if point3d_id == 18446744073709551615:
+                if point3d_id == INVALID_POINT3D_ID:
                     point3d_id = None
                 point2d_entries.append(Point2dEntry(i, x, y, point3d_id))
             images.append(Image(image_information, point2d_entries))
     return {i.image_information.image_id: i for i in images}
 
 
+IMAGE_HEADER_DTYPE = np.dtype([("image_id", "<i4"), ("qvec", "<f8", (4,)), ("tvec", "<f8", (3,)),
+                               ("camera_id", "<i4")])
+POINT2D_RECORD_DTYPE = np.dtype([("xy", "<f8", (2,)), ("point3d_id", "<i8")])
+
+
+def write_images_bin(file, image_ids, qvecs, tvecs, camera_ids, names, xys, point3d_ids, offsets):
+    """
+    Writes images.bin from columnar arrays.
+    qvecs are wxyz quaternions (W2C), xys/point3d_ids hold the 2d points of all images back to back
+    with the points of the i-th image in [offsets[i], offsets[i + 1]), point3d_id -1 marks a missing 3d point
+    (stored as int64, i.e. the same bytes as INVALID_POINT3D_ID).
+    """
+    headers = np.empty(len(image_ids), dtype=IMAGE_HEADER_DTYPE)
+    headers["image_id"] = image_ids
+    headers["qvec"] = qvecs
+    headers["tvec"] = tvecs
+    headers["camera_id"] = camera_ids
+
+    points = np.empty(len(point3d_ids), dtype=POINT2D_RECORD_DTYPE)
+    points["xy"] = xys
+    points["point3d_id"] = point3d_ids
+
+    num_points = np.diff(offsets).astype("<u8")
+    with open(file, "wb") as f:
+        np.array([len(headers)], dtype="<u8").tofile(f)
+        for index in range(len(headers)):
+            f.write(headers[index].tobytes())
+            f.write(names[index].encode("utf-8") + b"\x00")
+            f.write(num_points[index].tobytes())
+            points[offsets[index]: offsets[index + 1]].tofile(f)
+
+
 def read_images_txt(file):
     im = read_images_text(file)
     images = []
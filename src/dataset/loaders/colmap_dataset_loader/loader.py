@@ -7,21 +7,25 @@ from uuid import uuid4
 import numpy as np
 from PIL import Image
 
+from src.benchmark.multiprocesser import Backend, parallel_map
 from src.config import DATASETS_PATH
 from src.dataset.camera import Camera, CameraIntrinsics
-from src.dataset.camera_pose.camera_pose import CameraPose
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
 from src.dataset.camera_pose.enums_and_types import (CoordinateSystem,
                                                      TransformationDirection)
 from src.dataset.dataset import Dataset
 from src.dataset.datasetEntry import DatasetEntry
 from src.dataset.imageMetadata import ImageMetadata
 from src.dataset.loaders.colmap_dataset_loader.cameras import (
-    CameraModelType, read_cameras_bin, read_cameras_txt)
+    CameraModelType, read_cameras_bin, read_cameras_txt, write_cameras_bin)
 from src.dataset.loaders.colmap_dataset_loader.images import (read_images_bin,
-                                                              read_images_txt)
+                                                              read_images_txt,
+                                                              write_images_bin)
 from src.dataset.loaders.colmap_dataset_loader.points import (
-    read_points3d_bin, read_points3d_txt)
+    read_points3d_bin, read_points3d_txt, write_points3d_bin)
 from src.dataset.point import Point2D, Point3D
+from src.dataset.tracks import Tracks
+from src.tracing import traced
 
 
 def params_to_intrinsics(fx, fy, cx, cy, s=None):
@@ -42,11 +46,17 @@ def get_intrinsics(camera):
 
 
 def _get_image_width_height(image_path):
-    im = Image.open(image_path)
-    width, height = im.size
+    with Image.open(image_path) as im:  # Note: reads the header only
+        width, height = im.size
     return width, height
 
 
+def _image_sizes(images, path_to_images):
+    """ (width, height) per image in the order of images, the headers are read by a thread pool (file access) """
+    image_paths = [os.path.join(path_to_images, im.image_information.name) for im in images.values()]
+    return parallel_map(_get_image_width_height, image_paths, backend=Backend.THREAD, num_workers=16)
+
+
 def _parse_points(points):
     return list(map(lambda p: Point3D(
         p.point_information.point3d_id,
@@ -56,35 +66,37 @@ def _parse_points(points):
         metadata={
             "rgb": np.array([p.point_information.r, p.point_information.g, p.point_information.b]),
             "error": p.point_information.error,
-            "track_entries": p.track_entries
+            "track_index": p.track_index  # Note: the track itself lives (once) in Dataset.tracks
         }
     ), points.values()))
 
 
+def _parse_camera_poses(images) -> CameraPoseArray:
+    """ all image poses at once, in the order of images """
+    information = [im.image_information for im in images.values()]
+    return CameraPoseArray.from_wxyz_quaternions(
+        wxyz=np.array([[i.qw, i.qx, i.qy, i.qz] for i in information], dtype=float),
+        translations=np.array([[i.tx, i.ty, i.tz] for i in information], dtype=float),
+        identifiers=[Path(i.name).name for i in information],
+        coordinate_system=CoordinateSystem.COLMAP,
+        direction=TransformationDirection.W2C  # !!! W2C !!!
+    )
+
+
 def _parse_dataset_entries(images, cameras, path_to_images):
     datasetEntries = []
-    for im in images.values():
+    camera_poses = _parse_camera_poses(images)
+    image_sizes = _image_sizes(images, path_to_images)
+    for index, im in enumerate(images.values()):
         image_path = os.path.join(path_to_images, im.image_information.name)
-        width, height = _get_image_width_height(image_path)
+        width, height = image_sizes[index]
         image_metadata = ImageMetadata(identifier=im.image_information.name,
                                        image_path=image_path,
                                        width=width,
                                        height=height)
         points2D = list(map(lambda p: Point2D(p.id, p.x, p.y, p.point3d_id, {}), im.point2d_entries))
 
-        camera_pose = CameraPose.from_string_wxyz_quaternion_translation(f"{im.image_information.qw} "
-                                                                         f"{im.image_information.qx} "
-                                                                         f"{im.image_information.qy} "
-                                                                         f"{im.image_information.qz} "
-                                                                         f"{im.image_information.tx} "
-                                                                         f"{im.image_information.ty} "
-                                                                         f"{im.image_information.tz}",
-                                                                         identifier=Path(
-                                                                             im.image_information.name).name,
-                                                                         coordinate_system=CoordinateSystem.COLMAP,
-                                                                         direction=TransformationDirection.W2C
-                                                                         # !!! W2C !!!
-                                                                         )
+        camera_pose = camera_poses[index]
         camera_intrinsics = get_intrinsics(cameras.get(im.image_information.camera_id))
         camera = Camera(camera_pose=camera_pose,
                         camera_intrinsics=camera_intrinsics,
@@ -95,22 +107,11 @@ def _parse_dataset_entries(images, cameras, path_to_images):
 
 def _parse_cameras_only(images, cameras, path_to_images):  # Note: this is mainly here to evaluate colmap benchmark
     parsed_cameras = {}
-    for im in images.values():
-        image_path = os.path.join(path_to_images, im.image_information.name)
-        width, height = _get_image_width_height(image_path)
-        camera_pose = CameraPose.from_string_wxyz_quaternion_translation(f"{im.image_information.qw} "
-                                                                         f"{im.image_information.qx} "
-                                                                         f"{im.image_information.qy} "
-                                                                         f"{im.image_information.qz} "
-                                                                         f"{im.image_information.tx} "
-                                                                         f"{im.image_information.ty} "
-                                                                         f"{im.image_information.tz}",
-                                                                         identifier=Path(
-                                                                             im.image_information.name).name,
-                                                                         coordinate_system=CoordinateSystem.COLMAP,
-                                                                         direction=TransformationDirection.W2C
-                                                                         # !!! W2C !!!
-                                                                         )
+    camera_poses = _parse_camera_poses(images)
+    image_sizes = _image_sizes(images, path_to_images)
+    for index, im in enumerate(images.values()):
+        width, height = image_sizes[index]
+        camera_pose = camera_poses[index]
         camera_intrinsics = get_intrinsics(cameras.get(im.image_information.camera_id))
         parsed_cameras.update(
             {
@@ -122,6 +123,7 @@ def _parse_cameras_only(images, cameras, path_to_images):  # Note: this is mainl
     return parsed_cameras
 
 
+@traced
 def load_colmap_cameras(path_to_sparse_folder, path_to_images, binary=False):
     if binary:
         images = read_images_bin(os.path.join(path_to_sparse_folder, "images.bin"))
@@ -134,33 +136,81 @@ def load_colmap_cameras(path_to_sparse_folder, path_to_images, binary=False):
     return parsed_cameras
 
 
+@traced
 def load_colmap_dataset(path_to_sparse_folder, path_to_images, binary=False, name=None):
     if binary:
-        points = read_points3d_bin(os.path.join(path_to_sparse_folder, "points3D.bin"))
+        points, tracks = read_points3d_bin(os.path.join(path_to_sparse_folder, "points3D.bin"))
         images = read_images_bin(os.path.join(path_to_sparse_folder, "images.bin"))
         cameras = read_cameras_bin(os.path.join(path_to_sparse_folder, "cameras.bin"))
     else:
-        points = read_points3d_txt(os.path.join(path_to_sparse_folder, "points3D.txt"))
+        points, tracks = read_points3d_txt(os.path.join(path_to_sparse_folder, "points3D.txt"))
         images = read_images_txt(os.path.join(path_to_sparse_folder, "images.txt"))
         cameras = read_cameras_txt(os.path.join(path_to_sparse_folder, "cameras.txt"))
 
     points3D = _parse_points(points)
     datasetEntries = _parse_dataset_entries(images, cameras, path_to_images)
 
-    return Dataset(points3D, datasetEntries, name=name)
+    return Dataset(points3D, datasetEntries, name=name, tracks=tracks)
+
+
+def _export_in_colmap_format_binary(ds: Dataset, output_path):
+    image_ids = np.arange(1, len(ds.datasetEntries) + 1)
+    intrinsics = [d.camera.camera_intrinsics for d in ds.datasetEntries]
+    write_cameras_bin(os.path.join(output_path, "cameras.bin"),
+                      camera_ids=image_ids,
+                      camera_model_type=CameraModelType.PINHOLE,  # TODO: maybe not always pinhole
+                      widths=[d.camera.width for d in ds.datasetEntries],
+                      heights=[d.camera.height for d in ds.datasetEntries],
+                      params=[[i.focal_x, i.focal_y, i.center_x, i.center_y] for i in intrinsics])
+
+    w2c_poses = [d.camera.camera_pose.in_direction(TransformationDirection.W2C) for d in ds.datasetEntries]
+    num_points2d = np.array([len(d.points2D) for d in ds.datasetEntries], dtype=np.int64)
+    offsets = np.zeros(len(num_points2d) + 1, dtype=np.int64)
+    np.cumsum(num_points2d, out=offsets[1:])
+    points2d = [p for d in ds.datasetEntries for p in d.points2D]
+    xys = np.stack([np.fromiter((p.x for p in points2d), dtype=np.float64, count=len(points2d)),
+                    np.fromiter((p.y for p in points2d), dtype=np.float64, count=len(points2d))], axis=1)
+    point2d_idxs = np.fromiter((p.identifier for p in points2d), dtype=np.uint32, count=len(points2d))
+    point3d_ids = np.fromiter((p.point3D_identifier if p.point3D_identifier is not None else -1 for p in points2d),
+                              dtype=np.int64, count=len(points2d))
+    write_images_bin(os.path.join(output_path, "images.bin"),
+                     image_ids=image_ids,
+                     qvecs=np.array([p.wxyz_quaternion for p in w2c_poses]).reshape((-1, 4)),
+                     tvecs=np.array([p.translation for p in w2c_poses]).reshape((-1, 3)),
+                     camera_ids=image_ids,
+                     names=[d.image_metadata.identifier for d in ds.datasetEntries],
+                     xys=xys,
+                     point3d_ids=point3d_ids,
+                     offsets=offsets)
+
+    has_3d = point3d_ids != -1
+    tracks = Tracks.from_observations(point3d_ids=np.array([p.identifier for p in ds.points3D], dtype=np.int64),
+                                      obs_point3d_ids=point3d_ids[has_3d],
+                                      obs_image_ids=np.repeat(image_ids, num_points2d)[has_3d],
+                                      obs_point2d_idxs=point2d_idxs[has_3d])
+    write_points3d_bin(os.path.join(output_path, "points3D.bin"),
+                       point3d_ids=tracks.point3d_ids,
+                       xyz=np.array([p.xyz for p in ds.points3D], dtype=np.float64).reshape((-1, 3)),
+                       rgb=[p.metadata.get("rgb") if p.metadata.get("rgb") is not None else (255, 255, 255)
+                            for p in ds.points3D],
+                       errors=[p.metadata.get("error") if p.metadata.get("error") is not None else 999
+                               for p in ds.points3D],
+                       tracks=tracks)
 
 
 def export_in_colmap_format(ds: Dataset, output_path, binary=False):
+    os.makedirs(output_path, exist_ok=True)
+    if binary:
+        _export_in_colmap_format_binary(ds, output_path)
+        return
+
     from src.dataset.loaders.colmap_dataset_loader.read_write_model import (
-        BaseImage, Camera, Point3D, write_cameras_binary, write_cameras_text,
-        write_images_binary, write_images_text, write_points3D_binary,
+        BaseImage, Camera, Point3D, write_cameras_text, write_images_text,
         write_points3D_text)
     cameras = []
     base_images = []
     points3D = []
 
-    os.makedirs(output_path, exist_ok=True)
-
     for index, d in enumerate(ds.datasetEntries, start=1):
         cameras.append(
             Camera(index,
@@ -202,14 +252,9 @@ def export_in_colmap_format(ds: Dataset, output_path, binary=False):
     cameras = {c.id: c for c in cameras}
     base_images = {b.id: b for b in base_images}
     points3D = {p.id: p for p in points3D}
-    if binary:
-        write_cameras_binary(cameras, os.path.join(output_path, "cameras.bin"))
-        write_images_binary(base_images, os.path.join(output_path, "images.bin"))
-        write_points3D_binary(points3D, os.path.join(output_path, "points3D.bin"))
-    else:
-        write_cameras_text(cameras, os.path.join(output_path, "cameras.txt"))
-        write_images_text(base_images, os.path.join(output_path, "images.txt"))
-        write_points3D_text(points3D, os.path.join(output_path, "points3D.txt"))
+    write_cameras_text(cameras, os.path.join(output_path, "cameras.txt"))
+    write_images_text(base_images, os.path.join(output_path, "images.txt"))
+    write_points3D_text(points3D, os.path.join(output_path, "points3D.txt"))
 
 
 # TODO: Decide where this goes
@@ -1,11 +1,14 @@
 import os
 import struct
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, Tuple
+
+import numpy as np
 
 from src.config import DATASETS_PATH
 from src.dataset.loaders.colmap_dataset_loader.read_write_model import \
     read_points3D_text
+from src.dataset.tracks import Tracks
 
 
 @dataclass
@@ -20,45 +23,90 @@ class PointInformation:
     error: float
 
 
-@dataclass
-class TrackEntry:
-    image_id: int
-    point2d_idx: int
-
-
 @dataclass
 class Point:
     point_information: PointInformation
-    track_entries: List[TrackEntry]
+    track_index: int  # Note: index into the Tracks returned alongside the points
 
 
-def read_points3d_bin(file):
+def read_points3d_bin(file) -> Tuple[Dict[int, Point], Tracks]:
     points = []
+    point3d_ids = []
+    track_lengths = []
+    track_chunks = []
     with open(file, "rb") as f:
-        num_points = struct.unpack_from("<Q", f.read(8))[0]
-        for _ in range(num_points):
-            point3d_id, x, y, z, r, g, b, error = struct.unpack_from("<Q3d3Bd", f.read(43))
-            point_information = PointInformation(point3d_id, x, y, z, r, g, b, error)
-            track_length = struct.unpack_from("<Q", f.read(8))[0]
-            track_entries = []
-            for _ in range(track_length):
-                track_entries.append(TrackEntry(*struct.unpack_from("<2I", f.read(8))))
-            points.append(Point(point_information, track_entries))
-    return {pp.point_information.point3d_id: pp for pp in points}
-
-
-def read_points3d_txt(file):
+        data = f.read()
+    num_points = struct.unpack_from("<Q", data, 0)[0]
+    offset = 8
+    for index in range(num_points):
+        point3d_id, x, y, z, r, g, b, error, track_length = struct.unpack_from("<Q3d3BdQ", data, offset)
+        offset += 51
+        points.append(Point(PointInformation(point3d_id, x, y, z, r, g, b, error), index))
+        point3d_ids.append(point3d_id)
+        track_lengths.append(track_length)
+        # Note: only the raw bytes are kept per point, all tracks are decoded at once below
+        track_chunks.append(data[offset: offset + 8 * track_length])
+        offset += 8 * track_length
+    track_entries = np.frombuffer(b"".join(track_chunks), dtype="<u4").reshape((-1, 2))
+    tracks = Tracks.from_lengths(point3d_ids, track_lengths, track_entries[:, 0], track_entries[:, 1])
+    return {pp.point_information.point3d_id: pp for pp in points}, tracks
+
+
+POINT_HEADER_DTYPE = np.dtype([("point3d_id", "<u8"), ("xyz", "<f8", (3,)), ("rgb", "u1", (3,)), ("error", "<f8"),
+                               ("track_length", "<u8")])
+TRACK_ENTRY_DTYPE = np.dtype([("image_id", "<u4"), ("point2d_idx", "<u4")])
+
+
+def write_points3d_bin(file, point3d_ids, xyz, rgb, errors, tracks: Tracks):
+    """
+    Writes points3D.bin from columnar arrays, tracks have to be in the same order as point3d_ids.
+    Note: the records have variable length, hence the layout (offset of every header and track entry)
+    is computed up front and the whole file is assembled in one buffer
+    """
+    num_points = len(point3d_ids)
+    headers = np.empty(num_points, dtype=POINT_HEADER_DTYPE)
+    headers["point3d_id"] = point3d_ids
+    headers["xyz"] = xyz
+    headers["rgb"] = rgb
+    headers["error"] = errors
+    headers["track_length"] = tracks.lengths
+
+    track_entries = np.empty(len(tracks.image_ids), dtype=TRACK_ENTRY_DTYPE)
+    track_entries["image_id"] = tracks.image_ids
+    track_entries["point2d_idx"] = tracks.point2d_idxs
+
+    header_size, entry_size = POINT_HEADER_DTYPE.itemsize, TRACK_ENTRY_DTYPE.itemsize
+    header_offsets = np.arange(num_points, dtype=np.int64) * header_size + tracks.offsets[:-1] * entry_size
+    entry_offsets = np.repeat(header_offsets + header_size, tracks.lengths) + \
+        (np.arange(len(track_entries), dtype=np.int64) - np.repeat(tracks.offsets[:-1], tracks.lengths)) * entry_size
+
+    buffer = np.empty(num_points * header_size + len(track_entries) * entry_size, dtype=np.uint8)
+    header_bytes = headers.view(np.uint8).reshape((-1, header_size))
+    entry_bytes = track_entries.view(np.uint8).reshape((-1, entry_size))
+    # Note: scattering byte column by byte column keeps the index arrays at the size of one column
+    for column in range(header_size):
+        buffer[header_offsets + column] = header_bytes[:, column]
+    for column in range(entry_size):
+        buffer[entry_offsets + column] = entry_bytes[:, column]
+    with open(file, "wb") as f:
+        np.array([num_points], dtype="<u8").tofile(f)
+        buffer.tofile(f)
+
+
+def read_points3d_txt(file) -> Tuple[Dict[int, Point], Tracks]:
     points = []
+    image_ids = []
+    point2d_idxs = []
     po = read_points3D_text(file)
-    for p in po.values():
+    for index, p in enumerate(po.values()):
         point_information = PointInformation(p.id, p.xyz[0], p.xyz[1], p.xyz[2], p.rgb[0], p.rgb[1], p.rgb[2], p.error)
-        track_entries = []
-        for index, point2d_idx in enumerate(start=0, iterable=p.point2D_idxs):
-            track_entries.append(TrackEntry(p.image_ids[index], point2d_idx))
-        points.append(Point(point_information, track_entries))
-    return {pp.point_information.point3d_id: pp for pp in points}
+        points.append(Point(point_information, index))
+        image_ids.append(p.image_ids)
+        point2d_idxs.append(p.point2D_idxs)
+    tracks = Tracks.from_track_arrays([p.point_information.point3d_id for p in points], image_ids, point2d_idxs)
+    return {pp.point_information.point3d_id: pp for pp in points}, tracks
 
 
 if __name__ == "__main__":
-    pt1 = read_points3d_bin(os.path.join(DATASETS_PATH, "reichstag/sparse" + "/points3D.bin"))
-    pt2 = read_points3d_txt(os.path.join(DATASETS_PATH, "reichstag/sparse/TXT" + "/points3D.txt"))
+    pt1, tracks1 = read_points3d_bin(os.path.join(DATASETS_PATH, "reichstag/sparse" + "/points3D.bin"))
+    pt2, tracks2 = read_points3d_txt(os.path.join(DATASETS_PATH, "reichstag/sparse/TXT" + "/points3D.txt"))
@@ -0,0 +1,38 @@
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+
+def random_directions(rng: np.random.Generator, n, dim=3):
+    """
+    n unit vectors, one per row
+    Note: components are drawn from [0, 1) (as the noised datasets always were), i.e. the directions all lie in
+          the positive orthant and the noise is not zero mean
+    """
+    r = rng.random((n, dim))
+    return r / np.linalg.norm(r, axis=1, keepdims=True)
+
+
+def noised_poses(rng: np.random.Generator, rotations: Rotation, translations, w2c, rotation_noise,
+                 translation_noise):
+    """
+    Moves every camera by a random direction * translation_noise, then applies rotvec(random direction *
+    rotation_noise) to the pose like CameraPose.apply_transform_3d (R -> N R, t -> N t). The result depends on
+    the direction: W2C cameras are rotated about their center, C2W cameras (center and orientation) about the
+    world origin. w2c is a (per pose) bool mask of the transformation direction.
+    Returns (rotations, translations) in the input's direction.
+    """
+    moves = random_directions(rng, len(translations)) * translation_noise
+    # Note: for W2C (t = -R c) moving the center c by v means t - R v
+    translations = np.where(np.asarray(w2c)[:, np.newaxis], translations - rotations.apply(moves),
+                            translations + moves)
+    noise_rotations = Rotation.from_rotvec(random_directions(rng, len(translations)) * rotation_noise)
+    return noise_rotations * rotations, noise_rotations.apply(translations)
+
+
+# Note: entries CameraIntrinsics.apply_noise(..., masked=True) touches (fx, fy, cx, cy, skew)
+INTRINSICS_NOISE_MASK = np.array([[1.0, 1.0, 1.0], [0.0, 1.0, 1.0], [0.0, 0.0, 0.0]])
+
+
+def intrinsics_noise(rng: np.random.Generator, n, camera_intrinsics_noise):
+    """ (n, 3, 3) noise matrices as used by CameraIntrinsics.apply_noise """
+    return rng.random((n, 3, 3)) * camera_intrinsics_noise
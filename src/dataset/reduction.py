@@ -0,0 +1,220 @@
+import copy
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from scipy import sparse
+
+from src.dataset.covisibility import CovisibilityIndex
+
+
+def points3d_xyz(points3D) -> np.ndarray:
+    """ (num_points, 3) coordinates of a list of Point3D """
+    return np.fromiter((c for p in points3D for c in (p.x, p.y, p.z)), dtype=float,
+                       count=3 * len(points3D)).reshape((-1, 3))
+
+
+@dataclass
+class ObservationTable:
+    """
+    One row per 2d point that has a 3d point identifier, in dataset order (entries, then points2D).
+    Rows of the i-th entry are offsets[i]:offsets[i + 1].
+    """
+    image_indices: np.ndarray  # index into datasetEntries
+    point2d_indices: np.ndarray  # position in the entry's points2D list
+    point2d_ids: np.ndarray
+    point3d_ids: np.ndarray
+    point3d_indices: np.ndarray  # index into points3D, -1 if the dataset has no such point
+    ranks: np.ndarray  # position among the entry's points with 3d (what points_limit cuts on)
+    offsets: np.ndarray
+    xy: np.ndarray  # (num_rows, 2), the 2d point coordinates
+    xyz: np.ndarray  # (num_points3D, 3), in points3D order
+
+    def __post_init__(self):
+        self._covisibility = None
+
+    @property
+    def num_images(self):
+        return len(self.offsets) - 1
+
+    @property
+    def num_points(self):
+        return len(self.xyz)
+
+    def __len__(self):
+        return len(self.image_indices)
+
+    @staticmethod
+    def from_dataset(dataset: "Dataset") -> "ObservationTable":
+        point2d_indices, point2d_ids, point3d_ids, xy, counts = [], [], [], [], []
+        for de in dataset.datasetEntries:
+            points_with_3d = de.points_with_3d()
+            point2d_indices.append(de.indices_with_3d)
+            point2d_ids.extend(p.identifier for p in points_with_3d)
+            point3d_ids.append(de.point3d_ids)
+            xy.extend((p.x, p.y) for p in points_with_3d)
+            counts.append(len(points_with_3d))
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        image_indices = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+        point3d_ids = np.concatenate(point3d_ids) if point3d_ids else np.zeros(0, dtype=np.int64)
+
+        ids = np.fromiter((p.identifier for p in dataset.points3D), dtype=np.int64, count=len(dataset.points3D))
+        order = np.argsort(ids)
+        positions = np.minimum(np.searchsorted(ids[order], point3d_ids), max(len(ids) - 1, 0))
+        found = ids[order][positions] == point3d_ids if len(ids) else np.zeros(len(point3d_ids), dtype=bool)
+        return ObservationTable(
+            image_indices=image_indices,
+            point2d_indices=np.concatenate(point2d_indices) if point2d_indices else np.zeros(0, dtype=np.int64),
+            point2d_ids=np.array(point2d_ids, dtype=np.int64),
+            point3d_ids=point3d_ids,
+            point3d_indices=np.where(found, order[positions] if len(ids) else -1, -1),
+            ranks=np.arange(len(image_indices)) - offsets[:-1][image_indices],
+            offsets=offsets,
+            xy=np.array(xy, dtype=float).reshape((-1, 2)),
+            xyz=points3d_xyz(dataset.points3D),
+        )
+
+    def incidence_matrix(self, rows=None) -> sparse.csr_matrix:
+        """ (num_images, num_points) matrix, 1 where the image observes the point """
+        rows = np.flatnonzero(self.point3d_indices >= 0) if rows is None else rows
+        m = sparse.csr_matrix((np.ones(len(rows)), (self.image_indices[rows], self.point3d_indices[rows])),
+                              shape=(self.num_images, self.num_points))
+        m.data[:] = 1.0  # Note: duplicate observations of a point in one image are summed up
+        return m
+
+    def with_xyz(self, xyz) -> "ObservationTable":
+        """ the same observations of the same points at new positions, keeps the covisibility cache """
+        table = copy.copy(self)
+        table.xyz = xyz
+        return table
+
+    def covisibility(self) -> CovisibilityIndex:
+        """ cached, the table is never modified """
+        if self._covisibility is None:
+            self._covisibility = CovisibilityIndex.from_observation_table(self)
+        return self._covisibility
+
+
+""" CAMERA SELECTION: (table, camera_limit) -> indices of the selected entries """
+
+
+def first_n_cameras(table: ObservationTable, camera_limit):
+    return np.arange(table.num_images)[:camera_limit]
+
+
+def covisible_cameras(table: ObservationTable, camera_limit):
+    """ greedy connected subset: starts at the first entry and adds the entry sharing the most points with the subset """
+    return table.covisibility().greedy_subset(camera_limit)
+
+
+class CameraSelection(Enum):
+    FIRST_N: Callable[[Any], Any] = first_n_cameras
+    COVISIBLE: Callable[[Any], Any] = covisible_cameras
+
+
+""" POINT SELECTION: (table, rows, points_limit) -> rows (observations) kept per camera """
+
+
+def _lowest_keys_per_image(table: ObservationTable, rows, keys, points_limit):
+    order = np.lexsort((table.ranks[rows], keys, table.image_indices[rows]))
+    sorted_rows = rows[order]
+    images = table.image_indices[sorted_rows]
+    position = np.arange(len(sorted_rows)) - np.searchsorted(images, images, side="left")
+    return np.sort(sorted_rows[position < points_limit])
+
+
+def first_n_points(table: ObservationTable, rows, points_limit):
+    return rows[table.ranks[rows] < points_limit]
+
+
+def longest_track_points(table: ObservationTable, rows, points_limit):
+    """ the points seen by the most selected cameras first """
+    track_lengths = np.bincount(table.point3d_indices[rows], minlength=table.num_points)
+    return _lowest_keys_per_image(table, rows, -track_lengths[table.point3d_indices[rows]], points_limit)
+
+
+def spatially_stratified_points(table: ObservationTable, rows, points_limit, cells_per_axis=8):
+    """ round robin over a voxel grid spanning the observed points, so every image keeps points spread over the scene """
+    xyz = table.xyz[table.point3d_indices[rows]]
+    low, high = xyz.min(axis=0), xyz.max(axis=0)
+    cells = np.clip(((xyz - low) / np.maximum(high - low, 1e-12) * cells_per_axis).astype(np.int64),
+                    0, cells_per_axis - 1)
+    voxels = (cells[:, 0] * cells_per_axis + cells[:, 1]) * cells_per_axis + cells[:, 2]
+    # Note: the n-th observation of a voxel within an image gets key n
+    order = np.lexsort((table.ranks[rows], voxels, table.image_indices[rows]))
+    group = table.image_indices[rows][order] * cells_per_axis ** 3 + voxels[order]
+    rounds = np.empty(len(rows), dtype=np.int64)
+    rounds[order] = np.arange(len(rows)) - np.searchsorted(group, group, side="left")
+    return _lowest_keys_per_image(table, rows, rounds, points_limit)
+
+
+class PointSelection(Enum):
+    FIRST_N: Callable[[Any], Any] = first_n_points
+    LONGEST_TRACK: Callable[[Any], Any] = longest_track_points
+    SPATIALLY_STRATIFIED: Callable[[Any], Any] = spatially_stratified_points
+
+
+@dataclass
+class Selection:
+    table: ObservationTable
+    camera_indices: np.ndarray  # selected entries, in the order of the reduced dataset
+    observation_mask: np.ndarray  # bool per table row
+    point3d_indices: np.ndarray  # kept points, in the order of the reduced dataset
+
+    def rows_of(self, image_index):
+        return slice(self.table.offsets[image_index], self.table.offsets[image_index + 1])
+
+    def dropped_point2d_indices(self, image_index, keep=None) -> np.ndarray:
+        """ positions in points2D that have a 3d point identifier but are not part of the selection (or keep) """
+        rows = self.rows_of(image_index)
+        keep = self.observation_mask if keep is None else keep
+        return self.table.point2d_indices[rows][~keep[rows]]
+
+    def point2d_ids_per_camera(self) -> Dict[int, List]:
+        return {
+            index: self.table.point2d_ids[self.rows_of(image_index)][self.observation_mask[self.rows_of(image_index)]]
+            .tolist() for index, image_index in enumerate(self.camera_indices)
+        }
+
+
+def select(table: ObservationTable, camera_limit, points_limit, camera_selection=CameraSelection.FIRST_N,
+           point_selection=PointSelection.FIRST_N, min_track_length=2) -> Selection:
+    """
+    Picks cameras, then per camera up to points_limit observations, then keeps the points observed at least
+    min_track_length times by the picked observations. Runs on index arrays only.
+    """
+    camera_indices = np.asarray(camera_selection(table, camera_limit), dtype=np.int64)
+    in_cameras = np.zeros(table.num_images, dtype=bool)
+    in_cameras[camera_indices] = True
+    rows = np.flatnonzero(in_cameras[table.image_indices] & (table.point3d_indices >= 0))
+    chosen = rows if points_limit is None else point_selection(table, rows, points_limit)
+
+    chosen_points = table.point3d_indices[chosen]
+    counts = np.bincount(chosen_points, minlength=table.num_points)
+    kept_points = counts >= min_track_length
+    observation_mask = np.zeros(len(table), dtype=bool)
+    observation_mask[chosen[kept_points[chosen_points]]] = True
+
+    # Note: points ordered by number of observations, ties by first appearance (as the Counter based version did)
+    unique_points, first_appearance = np.unique(chosen_points, return_index=True)
+    unique_points = unique_points[np.argsort(first_appearance, kind="stable")]
+    unique_points = unique_points[np.argsort(counts[unique_points], kind="stable")]
+    return Selection(
+        table=table,
+        camera_indices=camera_indices,
+        observation_mask=observation_mask,
+        point3d_indices=unique_points[kept_points[unique_points]],
+    )
+
+
+def points2d_without_3d(points2D, positions):
+    """ shallow copy of the list where the points at positions are replaced by copies without 3d point identifier """
+    points2D = copy.copy(points2D)
+    for i in positions.tolist():
+        point_copy = copy.copy(points2D[i])
+        point_copy.point3D_identifier = None
+        points2D[i] = point_copy
+    return points2D
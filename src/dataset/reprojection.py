@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict
+
+import numpy as np
+
+from src.dataset.camera_pose.camera_pose_array import CameraPoseArray
+from src.dataset.camera_pose.enums_and_types import TransformationDirection
+from src.dataset.loss_functions import LossFunction
+
+
+class ReprojectionBackend(Enum):
+    NUMPY = "numpy"
+    JAX = "jax"
+
+
+@dataclass
+class ReprojectionErrors:
+    """ per observation errors of all images back to back, the i-th image owns errors[offsets[i]:offsets[i + 1]] """
+    errors: np.ndarray
+    offsets: np.ndarray
+
+    def __len__(self):
+        return len(self.errors)
+
+    def of_image(self, index) -> np.ndarray:
+        return self.errors[self.offsets[index]:self.offsets[index + 1]]
+
+    def per_image(self) -> Dict[int, np.ndarray]:
+        """ the {image index: errors} layout of Dataset.compute_reprojection_errors_alt (views, no copies) """
+        return {index: self.of_image(index) for index in range(len(self.offsets) - 1)}
+
+
+def projection_matrices(cameras) -> np.ndarray:
+    """ (n, 3, 4) K @ [R|t] (W2C) of all cameras """
+    poses = CameraPoseArray.from_poses([c.camera_pose for c in cameras], direction=TransformationDirection.W2C)
+    intrinsics = np.array([c.camera_intrinsics.camera_intrinsics_matrix for c in cameras], dtype=float)
+    return intrinsics.reshape((-1, 3, 3)) @ poses.rotation_translation_matrices
+
+
+def residuals(projections, camera_indices, points_3d, points_2d) -> np.ndarray:
+    """
+    points_2d - projection, (n, 2); points_3d are already gathered per observation
+    Note: one (k, 3) @ (3, 3) product per camera, gathering a 3x4 matrix per observation is ~10x slower
+    """
+    order = np.argsort(camera_indices, kind="stable")
+    offsets = np.zeros(len(projections) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(camera_indices, minlength=len(projections)), out=offsets[1:])
+    projected = points_3d[order]
+    for index in range(len(projections)):
+        start, end = offsets[index], offsets[index + 1]
+        if start != end:
+            p = projections[index]
+            projected[start:end] = projected[start:end] @ p[:, :3].T + p[:, 3]
+    result = np.empty(points_2d.shape, dtype=float)
+    result[order] = points_2d[order] - projected[:, :2] / projected[:, 2:3]
+    return result
+
+
+_residuals_jax = None
+
+
+def residuals_jax(projections, camera_indices, points_3d, points_2d) -> np.ndarray:
+    """ jitted single pass version of residuals (one gathered 3x4 matrix per observation) """
+    global _residuals_jax
+    if _residuals_jax is None:
+        import jax
+        import jax.numpy as jnp
+
+        jax.config.update("jax_enable_x64", True)  # Note: as the jax optimizers do, float32 is too coarse in px
+
+        @jax.jit
+        def _residuals(p, c, x, xy):
+            p = p[c]
+            projected = jnp.einsum("nij,nj->ni", p[..., :3], x) + p[..., 3]
+            return xy - projected[:, :2] / projected[:, 2:3]
+
+        _residuals_jax = _residuals
+    return np.asarray(_residuals_jax(projections, camera_indices, points_3d, points_2d))
+
+
+def reprojection_errors(dataset: "Dataset", loss_function=LossFunction.TRIVIAL_LOSS,
+                        backend=ReprojectionBackend.NUMPY) -> ReprojectionErrors:
+    """
+    loss_function(squared residual) summed over x and y for every observation of the dataset in one pass,
+    i.e. what Camera.compute_projection_errors_alt computes image by image
+    """
+    table = dataset.observation_table()
+    valid = table.point3d_indices >= 0
+    image_indices = table.image_indices[valid]
+    projections = projection_matrices([de.camera for de in dataset.datasetEntries])
+    r = (residuals_jax if backend == ReprojectionBackend.JAX else residuals)(
+        projections, image_indices, table.xyz[table.point3d_indices[valid]], table.xy[valid]
+    )
+    offsets = np.zeros(len(dataset.datasetEntries) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(image_indices, minlength=len(dataset.datasetEntries)), out=offsets[1:])
+    return ReprojectionErrors(errors=loss_function(r ** 2).sum(axis=1), offsets=offsets)
@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from src.dataset.camera import Camera
+from src.dataset.camera_pose.enums_and_types import TransformationDirection
+
+
+@dataclass
+class SpatialIndex:
+    """
+    KD-tree over the 3d point coordinates, all queries return sorted indices into points3D.
+    Moved points (see update / with_positions) are kept in an overlay and checked one by one until there are
+    more than rebuild_ratio of them, then the tree is rebuilt.
+    """
+    xyz: np.ndarray  # (num_points, 3), current positions
+    leafsize: int = 16
+    rebuild_ratio: float = 0.1
+
+    def __post_init__(self):
+        self.xyz = np.array(self.xyz, dtype=float).reshape((-1, 3))
+        self.rebuild()
+
+    def __len__(self):
+        return len(self.xyz)
+
+    @property
+    def num_moved(self):
+        return len(self._moved)
+
+    def rebuild(self):
+        self._tree = cKDTree(self.xyz, leafsize=self.leafsize)
+        self._tree_xyz = self.xyz.copy()
+        self._moved = np.zeros(0, dtype=np.int64)  # Note: sorted indices whose position differs from the tree
+
+    def update(self, indices, xyz):
+        """ moves the points at indices to xyz (in place) """
+        indices = np.asarray(indices, dtype=np.int64)
+        self.xyz[indices] = xyz
+        moved = indices[(self.xyz[indices] != self._tree_xyz[indices]).any(axis=1)]
+        self._moved = np.union1d(self._moved, moved)
+        if self.num_moved > self.rebuild_ratio * len(self):
+            self.rebuild()
+
+    def with_positions(self, xyz) -> "SpatialIndex":
+        """ index of the same points at new positions, shares the tree with this index """
+        xyz = np.array(xyz, dtype=float).reshape(self.xyz.shape)
+        index = object.__new__(SpatialIndex)
+        index.xyz, index.leafsize, index.rebuild_ratio = xyz, self.leafsize, self.rebuild_ratio
+        index._tree, index._tree_xyz = self._tree, self._tree_xyz
+        index._moved = np.flatnonzero((xyz != self._tree_xyz).any(axis=1))
+        if index.num_moved > self.rebuild_ratio * len(self):
+            index.rebuild()
+        return index
+
+    def _filtered(self, tree_candidates, predicate) -> np.ndarray:
+        """ candidates of the tree (without the moved points) and all moved points that satisfy the predicate """
+        candidates = np.asarray(tree_candidates, dtype=np.int64)
+        if self.num_moved:
+            candidates = np.union1d(np.setdiff1d(candidates, self._moved, assume_unique=True), self._moved)
+        else:
+            candidates = np.sort(candidates)
+        return candidates[predicate(self.xyz[candidates])]
+
+    def radius_query(self, center, radius) -> np.ndarray:
+        center = np.asarray(center, dtype=float)
+        return self._filtered(
+            self._tree.query_ball_point(center, radius),
+            lambda xyz: ((xyz - center) ** 2).sum(axis=1) <= radius ** 2,
+        )
+
+    def box_query(self, low, high) -> np.ndarray:
+        """ axis aligned box, bounds included """
+        low, high = np.asarray(low, dtype=float), np.asarray(high, dtype=float)
+        # Note: the max norm ball around the center encloses the box, the exact test follows
+        return self._filtered(
+            self._tree.query_ball_point((low + high) / 2, float(np.max(high - low)) / 2, p=np.inf),
+            lambda xyz: ((xyz >= low) & (xyz <= high)).all(axis=1),
+        )
+
+    def frustum_query(self, camera: Camera, near=0.0, far=None, margin=0.0) -> np.ndarray:
+        """ points in front of the camera (depth in (near, far]) that project into the image (+ margin px) """
+        pose = camera.camera_pose.in_direction(TransformationDirection.W2C)
+        rotation_translation = pose.rotation_translation_matrix
+        projection = camera.camera_intrinsics.camera_intrinsics_matrix @ rotation_translation
+
+        def in_frustum(xyz):
+            depth = xyz @ rotation_translation[2, :3] + rotation_translation[2, 3]
+            uvw = xyz @ projection[:, :3].T + projection[:, 3]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                uv = uvw[:, :2] / uvw[:, 2:3]
+            mask = (depth > near) & (uv >= -margin).all(axis=1) & \
+                (uv[:, 0] <= camera.width + margin) & (uv[:, 1] <= camera.height + margin)
+            return mask if far is None else mask & (depth <= far)
+
+        if far is None:
+            return self._filtered(np.arange(len(self)), in_frustum)
+        # Note: the rays through the image corners (at depth 1) bound the distance of a point with depth <= far
+        corners = np.array([[u, v, 1.0] for u in (-margin, camera.width + margin)
+                            for v in (-margin, camera.height + margin)])
+        rays = np.linalg.solve(camera.camera_intrinsics.camera_intrinsics_matrix, corners.T)
+        center = -rotation_translation[:, :3].T @ rotation_translation[:, 3]
+        return self._filtered(
+            self._tree.query_ball_point(center, far * float(np.linalg.norm(rays, axis=0).max())),
+            in_frustum,
+        )
@@ -0,0 +1,106 @@
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import numpy as np
+
+from src.dataset.bundle_adjustment_problem import BundleAdjustmentProblem
+from src.dataset.dataset import Dataset
+
+
+@dataclass
+class SyntheticSceneConfig:
+    num_cameras: int = 32
+    num_points: int = 10_000
+    observations_per_camera: int = 1_000
+    point2d_noise: float = 0.5  # Note: std of the gaussian pixel noise
+    outlier_ratio: float = 0.0  # Note: fraction of observations replaced by uniformly random pixels
+    shared_intrinsics: bool = True
+    focal_length: float = 800.0
+    focal_length_spread: float = 0.1  # Note: relative, only used without shared intrinsics
+    width: int = 1024
+    height: int = 768
+    scene_radius: float = 1.0
+    camera_distance: float = 4.0
+    min_track_length: int = 2
+    seed: int = 0
+    name: Optional[str] = "Synthetic"
+
+
+def _random_unit_vectors(rng, n):
+    v = rng.normal(size=(n, 3))
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _look_at_origin(rng, centers):
+    """ W2C (colmap) rotations of cameras at centers looking at the origin with a random roll """
+    z = -centers / np.linalg.norm(centers, axis=1, keepdims=True)
+    x = np.cross(z, _random_unit_vectors(rng, len(centers)))
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    y = np.cross(z, x)
+    return np.stack([x, y, z], axis=1)  # Note: rows are the camera axes in world coordinates
+
+
+def generate_synthetic_problem(config: SyntheticSceneConfig = None, **kwargs) -> BundleAdjustmentProblem:
+    """
+    Random scene: points uniformly inside a ball, cameras on a sphere around it looking at the center.
+    Every camera observes observations_per_camera random points (fewer if they project outside the image),
+    points with less than min_track_length observations are dropped.
+    The returned problem holds the ground truth parameters and the noisy observations.
+    """
+    config = replace(config if config else SyntheticSceneConfig(), **kwargs)
+    rng = np.random.default_rng(config.seed)
+    num_cameras, num_points = config.num_cameras, config.num_points
+
+    points_3d = _random_unit_vectors(rng, num_points) * \
+        (config.scene_radius * np.cbrt(rng.random(num_points)))[:, np.newaxis]
+
+    centers = _random_unit_vectors(rng, num_cameras) * config.camera_distance
+    rotations = _look_at_origin(rng, centers)
+    poses = np.concatenate([rotations, -np.einsum("nij,nj->ni", rotations, centers)[..., np.newaxis]], axis=2)
+
+    focal_lengths = np.full(num_cameras, config.focal_length)
+    if not config.shared_intrinsics:
+        focal_lengths *= 1 + config.focal_length_spread * rng.uniform(-1, 1, num_cameras)
+    intrinsics = np.zeros((num_cameras, 3, 3))
+    intrinsics[:, 0, 0] = intrinsics[:, 1, 1] = focal_lengths
+    intrinsics[:, 0, 2], intrinsics[:, 1, 2], intrinsics[:, 2, 2] = config.width / 2, config.height / 2, 1.0
+
+    observations_per_camera = min(config.observations_per_camera, num_points)
+    camera_indices = np.repeat(np.arange(num_cameras), observations_per_camera)
+    point_indices = np.concatenate([  # Note: one O(observations_per_camera) draw per camera
+        rng.choice(num_points, observations_per_camera, replace=False) for _ in range(num_cameras)
+    ]) if num_cameras else np.zeros(0, dtype=np.int64)
+
+    problem = BundleAdjustmentProblem(
+        poses=poses,
+        intrinsics=intrinsics,
+        points_3d=points_3d,
+        camera_indices=camera_indices,
+        point_indices=point_indices,
+        points_2d=np.zeros((len(camera_indices), 2)),
+        widths=np.full(num_cameras, config.width),
+        heights=np.full(num_cameras, config.height),
+        name=config.name,
+    )
+    points_2d = problem.points_2d - problem.reprojection_residuals()  # Note: exact projections
+    visible = (points_2d >= 0).all(axis=1) & (points_2d < [config.width, config.height]).all(axis=1)
+
+    points_2d += rng.normal(scale=config.point2d_noise, size=points_2d.shape)
+    outliers = rng.random(len(points_2d)) < config.outlier_ratio
+    points_2d[outliers] = rng.random((np.count_nonzero(outliers), 2)) * [config.width, config.height]
+
+    problem.camera_indices, problem.point_indices, problem.points_2d = \
+        camera_indices[visible], point_indices[visible], points_2d[visible]
+    return problem.without_short_tracks(config.min_track_length)
+
+
+def generate_synthetic_dataset(config: SyntheticSceneConfig = None, **kwargs) -> Dataset:
+    return generate_synthetic_problem(config, **kwargs).to_dataset()
+
+
+if __name__ == "__main__":
+    import time
+
+    start = time.perf_counter()
+    synthetic_problem = generate_synthetic_problem(num_cameras=2_000, num_points=500_000, observations_per_camera=1_000)
+    print(synthetic_problem, f"{time.perf_counter() - start:.2f}s", synthetic_problem.cost())
@@ -0,0 +1,50 @@
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+from src.dataset.point import Point3D
+from src.dataset.synthetic import generate_synthetic_dataset
+
+
+@pytest.fixture
+def dataset():
+    dataset = generate_synthetic_dataset(num_cameras=4, num_points=200, observations_per_camera=50)
+    dataset.observation_table()  # Note: builds the entry caches as well
+    return dataset
+
+
+def _assert_entry_caches_shared(entry, original):
+    assert entry.points_with_3d() is original.points_with_3d()
+    assert entry.indices_with_3d is original.indices_with_3d
+    assert entry.point3d_ids is original.point3d_ids
+
+
+def test_copy_keeps_caches(dataset):
+    dataset_copy = copy.copy(dataset)
+    assert dataset_copy._observation_table is dataset._observation_table
+    _assert_entry_caches_shared(copy.copy(dataset.datasetEntries[0]), dataset.datasetEntries[0])
+
+
+def test_snapshot_shares_caches(dataset):
+    camera = copy.deepcopy(dataset.datasetEntries[0].camera)
+    snapshot = dataset.snapshot(cameras={0: camera})
+    assert snapshot.datasetEntries[0].camera is camera
+    assert snapshot._observation_table is dataset._observation_table
+    for entry, original in zip(snapshot.datasetEntries, dataset.datasetEntries):
+        _assert_entry_caches_shared(entry, original)
+
+
+def test_snapshot_with_moved_points_keeps_covisibility(dataset):
+    covisibility = dataset.covisibility_index()
+    points3D = [Point3D(p.identifier, p.x + 1, p.y, p.z, p.metadata) for p in dataset.points3D]
+    snapshot = dataset.snapshot(points3D=points3D)
+    assert snapshot.covisibility_index() is covisibility
+    assert np.allclose(snapshot.observation_table().xyz, dataset.observation_table().xyz + [1, 0, 0])
+
+
+def test_pickle_drops_caches(dataset):
+    restored = pickle.loads(pickle.dumps(dataset))
+    assert restored._observation_table is None
+    assert restored.datasetEntries[0]._points_with_3d is None
@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+@dataclass
+class Tracks:
+    """
+    Flat storage of all point tracks of a model.
+    The track of the i-th point is image_ids[offsets[i]:offsets[i + 1]] / point2d_idxs[offsets[i]:offsets[i + 1]]
+    Note: image_ids are the (colmap) image ids of the model the tracks were loaded from
+    """
+    point3d_ids: np.ndarray  # uint64, (num_points,)
+    image_ids: np.ndarray  # uint32, (num_track_entries,)
+    point2d_idxs: np.ndarray  # uint32, (num_track_entries,)
+    offsets: np.ndarray  # int64, (num_points + 1,)
+
+    def __post_init__(self):
+        self._index_by_point3d_id = None
+
+    def __eq__(self, other):  # Note: the generated __eq__ would compare the arrays elementwise
+        if not isinstance(other, Tracks):
+            return NotImplemented
+        return all(np.array_equal(getattr(self, name), getattr(other, name))
+                   for name in ("point3d_ids", "image_ids", "point2d_idxs", "offsets"))
+
+    def __len__(self):
+        return len(self.point3d_ids)
+
+    def __repr__(self):  # Note: keeps str(metadata) & debugging cheap, never prints the arrays
+        return f"Tracks(num_points={len(self)}, num_track_entries={len(self.image_ids)})"
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.point3d_ids.nbytes + self.image_ids.nbytes + self.point2d_idxs.nbytes + self.offsets.nbytes
+
+    def index_of(self, point3d_id) -> int:
+        if self._index_by_point3d_id is None:
+            self._index_by_point3d_id = {int(p): i for i, p in enumerate(self.point3d_ids)}
+        return self._index_by_point3d_id[int(point3d_id)]
+
+    def track(self, index) -> Tuple[np.ndarray, np.ndarray]:
+        """ returns (image_ids, point2d_idxs) of the index-th point as views into the flat arrays """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.image_ids[start:end], self.point2d_idxs[start:end]
+
+    def track_of(self, point3d_id) -> Tuple[np.ndarray, np.ndarray]:
+        return self.track(self.index_of(point3d_id))
+
+    def point_indices(self) -> np.ndarray:
+        """ index of the owning point for every track entry, i.e. the inverse of offsets """
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.lengths)
+
+    @staticmethod
+    def from_lengths(point3d_ids: Sequence[int], lengths: Sequence[int], image_ids, point2d_idxs) -> "Tracks":
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return Tracks(
+            point3d_ids=np.asarray(point3d_ids, dtype=np.uint64),
+            image_ids=np.asarray(image_ids, dtype=np.uint32),
+            point2d_idxs=np.asarray(point2d_idxs, dtype=np.uint32),
+            offsets=offsets,
+        )
+
+    @staticmethod
+    def from_track_arrays(point3d_ids: Sequence[int], image_ids: List[np.ndarray],
+                          point2d_idxs: List[np.ndarray]) -> "Tracks":
+        lengths = [len(i) for i in image_ids]
+        return Tracks.from_lengths(
+            point3d_ids,
+            lengths,
+            np.concatenate(image_ids) if lengths else np.zeros(0),
+            np.concatenate(point2d_idxs) if lengths else np.zeros(0),
+        )
+
+    @staticmethod
+    def from_observations(point3d_ids, obs_point3d_ids, obs_image_ids, obs_point2d_idxs) -> "Tracks":
+        """ inverts observations (image_id, point2d_idx -> point3d_id) into tracks ordered like point3d_ids """
+        order = np.argsort(obs_point3d_ids, kind="stable")
+        sorted_point3d_ids = obs_point3d_ids[order]
+        starts = np.searchsorted(sorted_point3d_ids, point3d_ids, side="left")
+        lengths = np.searchsorted(sorted_point3d_ids, point3d_ids, side="right") - starts
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = order[np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])]
+        return Tracks.from_lengths(point3d_ids, lengths, obs_image_ids[gather], obs_point2d_idxs[gather])
@@ -66,3 +66,29 @@ def parse_cam_pose(cam_vec):
 
 parse_intrinsics_vmap = jax.jit(jax.vmap(parse_intrinsics))
 parse_cam_pose_vmap = jax.jit(jax.vmap(parse_cam_pose))
+
+
+def pad_observations(camera_indices, point_indices, points_2d, num_cameras):
+    """
+    Converts flat observations into the padded per-camera layout of JaxBundleAdjustment
+    (points_2d_all, p3d_indices_all, masks_all); padding repeats the first observation of each camera with mask 0
+    """
+    camera_indices = np.asarray(camera_indices)
+    order = np.argsort(camera_indices, kind="stable")
+    sorted_cameras = camera_indices[order]
+    counts = np.bincount(camera_indices, minlength=num_cameras)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    slots = np.arange(len(order)) - starts[sorted_cameras]
+
+    max_count = int(counts.max()) if len(counts) else 0
+    points_2d_all = np.zeros((num_cameras, max_count, 2))
+    p3d_indices_all = np.zeros((num_cameras, max_count), dtype=np.asarray(point_indices).dtype)
+    masks_all = np.zeros((num_cameras, max_count))
+    points_2d_all[sorted_cameras, slots] = np.asarray(points_2d)[order]
+    p3d_indices_all[sorted_cameras, slots] = np.asarray(point_indices)[order]
+    masks_all[sorted_cameras, slots] = 1.0
+
+    padding = masks_all == 0.0
+    points_2d_all[padding] = np.broadcast_to(points_2d_all[:, :1], points_2d_all.shape)[padding]
+    p3d_indices_all[padding] = np.broadcast_to(p3d_indices_all[:, :1], p3d_indices_all.shape)[padding]
+    return points_2d_all, p3d_indices_all, masks_all
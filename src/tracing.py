@@ -0,0 +1,152 @@
+"""
+Nested timing spans, e.g.
+
+    with Tracer() as tracer:
+        with span("prepare"):
+            ...
+    tracer.export_chrome_trace("trace.json")  # chrome://tracing or https://ui.perfetto.dev
+    print(tracer.summary_table())
+
+Without an active Tracer span() and @traced cost one list check.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+_tracers: List["Tracer"] = []  # Note: active tracers, spans are recorded by the innermost one
+_stacks = threading.local()  # Note: names of the open spans per thread
+_NO_SPAN = nullcontext()
+
+
+@dataclass
+class Span:
+    path: Tuple[str, ...]  # names of the enclosing spans and this one
+    start: int  # perf_counter_ns
+    duration: int  # ns
+    thread: int
+    args: Dict = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        return self.path[-1]
+
+
+def _stack() -> List[str]:
+    if not hasattr(_stacks, "names"):
+        _stacks.names = []
+    return _stacks.names
+
+
+class _OpenSpan:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        stack = _stack()
+        stack.append(self.name)
+        self.path = tuple(stack)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter_ns() - self.start
+        _stack().pop()
+        if _tracers:
+            _tracers[-1].spans.append(Span(self.path, self.start, duration, threading.get_ident(), self.args))
+
+
+def span(name, **args):
+    """ context manager timing the enclosed block as span name (args end up in the chrome trace) """
+    if not _tracers:
+        return _NO_SPAN
+    return _OpenSpan(name, args)
+
+
+def traced(name=None):
+    """ decorator, every call is a span (default name: the qualified function name), also usable as @traced """
+    def decorator(function):
+        span_name = name if isinstance(name, str) else function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _tracers:
+                return function(*args, **kwargs)
+            with _OpenSpan(span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator(name) if callable(name) else decorator
+
+
+class Tracer:
+    """
+    Collects the spans closed while it is active (with Tracer(): ...). Tracers nest, the spans of an inner tracer
+    are handed to the outer one when it closes. Paths in the summary are relative to the spans open at entry.
+    """
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self.origin = time.perf_counter_ns()
+        self._base = ()
+
+    def __enter__(self):
+        self._base = tuple(_stack())
+        _tracers.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _tracers.remove(self)
+        if _tracers:
+            _tracers[-1].spans.extend(self.spans)
+
+    def _relative(self, path) -> Tuple[str, ...]:
+        return path[len(self._base):] if path[:len(self._base)] == self._base else path
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        json compatible, per span path ("benchmark/compile") in order of the first start: count and
+        total / self (without child spans) / mean / min / max seconds
+        """
+        summary, durations = {}, {}
+        for s in sorted(self.spans, key=lambda s: s.start):
+            key = "/".join(self._relative(s.path))
+            durations.setdefault(key, []).append(s.duration / 1e9)
+        for key, values in durations.items():
+            summary[key] = {"count": len(values), "total": sum(values), "self": sum(values),
+                            "mean": sum(values) / len(values), "min": min(values), "max": max(values)}
+        for key, entry in summary.items():
+            parent = key.rpartition("/")[0]
+            if parent in summary:
+                summary[parent]["self"] -= entry["total"]
+        return summary
+
+    def summary_table(self) -> str:
+        lines = [f"{'span':<48}{'count':>7}{'total [s]':>12}{'self [s]':>12}{'mean [s]':>12}{'max [s]':>12}"]
+        for key, e in self.summary().items():
+            indented = "  " * key.count("/") + key.rpartition("/")[2]
+            lines.append(f"{indented:<48}{e['count']:>7}{e['total']:>12.4f}{e['self']:>12.4f}"
+                         f"{e['mean']:>12.4f}{e['max']:>12.4f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> Dict:
+        """ trace event format ("X" complete events, microseconds since the creation of the tracer) """
+        pid = os.getpid()
+        return {
+            "traceEvents": [{"name": s.name, "cat": "/".join(s.path[:-1]) or "root", "ph": "X",
+                             "ts": (s.start - self.origin) / 1e3, "dur": s.duration / 1e3,
+                             "pid": pid, "tid": s.thread, "args": s.args}
+                            for s in sorted(self.spans, key=lambda s: s.start)],
+            "displayTimeUnit": "ms",
+        }
+
+    def export_chrome_trace(self, path) -> str:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=repr)
+        return path